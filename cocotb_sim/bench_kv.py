@@ -0,0 +1,117 @@
+#Key-value benchmark : puts/s and gets/s, in simulation time, of the log-structured store
+#(flash_kv.LogStore) against naive in-place updates, where every key has a fixed slot and
+#a put reads its sector back, erases it and programs it again. The same random updates of
+#a few hot keys run on both, then the same random gets. test_kv_bench.py runs it on every
+#toplevel, the results go to the json file named by KV_BENCH_JSON.
+
+import os
+import json
+import random
+import cocotb
+from cocotb.clock import Clock
+from cocotb.utils import get_sim_time
+from flash_host import host_for
+from flash_model import FlashRefModel
+from flash_kv import LogStore
+
+g_sys_clk = int(cocotb.top.g_sys_clk)
+period_ns = 10**9 / g_sys_clk
+
+keys = [b"key%d" % i for i in range(8)]
+value_size = 8
+ops = int(os.environ.get("KV_BENCH_OPS","96"))
+
+results = {}
+
+
+class InPlaceStore:
+	"""Fixed slot per key, updated in place : read, erase and reprogram the sector"""
+
+	def __init__(self,host,keys,slot_size):
+		self.host = host
+		self.sector_size = host.model.sector_size
+		self.slots = {key : i * slot_size for (i,key) in enumerate(keys)}
+		self.slot_size = slot_size
+
+	async def put(self,key,value):
+		addr = self.slots[key]
+		base = addr - addr % self.sector_size
+		sector = bytearray(await self.host.read(base,self.sector_size))
+		sector[addr - base:addr - base + len(value)] = value
+		await self.host.write_enable()
+		await self.host.sector_erase(base)
+		await self.host.wait_ready()
+		await self.host.page_program_stream(base,sector)
+
+	async def get(self,key):
+		return await self.host.read(self.slots[key],value_size)
+
+	async def sync(self):
+		pass
+
+
+async def timed(coro):
+	start = get_sim_time("ns")
+	ret = await coro
+	return (ret,get_sim_time("ns") - start)
+
+
+async def run_ops(store,updates,lookups,expected):
+	#puts/s includes making them durable, gets/s checks every value
+	async def puts():
+		for (key,value) in updates:
+			await store.put(key,value)
+		await store.sync()
+
+	async def gets():
+		for key in lookups:
+			assert await store.get(key) == expected[key],"Different expected to actual read data"
+
+	(_,put_ns) = await timed(puts())
+	(_,get_ns) = await timed(gets())
+	return dict(puts=len(updates),put_ns=put_ns,puts_per_s=len(updates) * 10**9 / put_ns,
+		gets=len(lookups),get_ns=get_ns,gets_per_s=len(lookups) * 10**9 / get_ns)
+
+
+def dump():
+	path = os.environ.get("KV_BENCH_JSON")
+	if(path is None):
+		return
+	with open(path,"w") as f:
+		json.dump(dict(toplevel=cocotb.top._name,ops=ops,results=results),f,indent=2)
+
+
+@cocotb.test()
+async def bench_kv(dut):
+	"""Measure puts/s and gets/s of the log-structured store and of in-place updates"""
+	host = host_for(dut,FlashRefModel.for_dut(dut))
+	cocotb.start_soon(Clock(host.clk, period_ns, units="ns").start())
+	await host.reset(5)
+
+	rng = random.Random(21)
+	#a skewed update mix : half the puts go to two keys
+	updates = [(rng.choice(keys[:2] if rng.random() < 0.5 else keys),rng.randbytes(value_size))
+		for i in range(ops)]
+	expected = dict(updates)
+	lookups = [rng.choice(list(expected)) for i in range(ops)]
+
+	store = LogStore(host)
+	await store.format()
+	results["log"] = await run_ops(store,updates,lookups,expected)
+	results["log"].update(collections=store.stats["collections"],erases=store.stats["erases"],
+		bytes_appended=store.stats["bytes_appended"],bytes_copied=store.stats["bytes_copied"])
+
+	#the index back from the flash with one streaming read
+	mounted = LogStore(host)
+	(_,results["log"]["mount_ns"]) = await timed(mounted.mount())
+	assert dict(mounted.index) == dict(store.index),"Different index after mount"
+
+	await store.format()
+	naive = InPlaceStore(host,keys,value_size)
+	results["in_place"] = await run_ops(naive,updates,lookups,expected)
+	results["in_place"].update(erases=len(updates))
+
+	for (name,stats) in results.items():
+		dut._log.info("{:<9} {:>10.0f} puts/s {:>10.0f} gets/s {:>4} erases".format(
+			name,stats["puts_per_s"],stats["gets_per_s"],stats["erases"]))
+	dump()
@@ -0,0 +1,135 @@
+#SPI throughput benchmark of the controller : READ, FAST_READ, PAGE_PROGRAM, status
+#polling, and sustained streaming READ and PAGE_PROGRAM of a multi-KiB region issued
+#through the host driver, timed in simulation time. test_throughput.py runs
+#it over a matrix of generics and toplevels, the results go to the json file named by
+#THROUGHPUT_JSON.
+#
+#	bytes_per_s			payload bytes moved per simulated second
+#	overhead_cycles		system clock cycles per command that are not spent clocking
+#						payload bits on sclk (register accesses, command/address/dummy bytes, gaps)
+#	cs_idle_ns			time chip-select was released while the operation was running
+
+import os
+import json
+import cocotb
+from cocotb.clock import Clock
+from cocotb.triggers import RisingEdge,FallingEdge
+from cocotb.utils import get_sim_time
+from flash_host import host_for
+from flash_model import FlashRefModel
+
+g_sys_clk = int(cocotb.top.g_sys_clk)
+g_freq_read = int(cocotb.top.g_freq_read)
+g_freq_rest = int(cocotb.top.g_freq_rest)
+period_ns = 10**9 / g_sys_clk
+
+results = {}
+
+
+class ChipSelectTimer:
+	"""Accumulates the time chip-select is asserted (o_s_n low)"""
+
+	def __init__(self,dut):
+		self.cs = dut.o_s_n
+		self.low_ns = 0
+		self.windows = 0
+		self.fall = None
+
+	async def run(self):
+		while True:
+			await FallingEdge(self.cs)
+			self.fall = get_sim_time("ns")
+			self.windows += 1
+			await RisingEdge(self.cs)
+			self.low_ns += get_sim_time("ns") - self.fall
+			self.fall = None
+
+	def snapshot(self):
+		#a window still open counts up to now
+		low = self.low_ns
+		if(self.fall is not None):
+			low += get_sim_time("ns") - self.fall
+		return (low,self.windows)
+
+
+async def measure(timer,op,payload,commands,f_spi):
+	(low,windows) = timer.snapshot()
+	start = get_sim_time("ns")
+	ret = await op
+	elapsed = get_sim_time("ns") - start
+	(low_end,windows_end) = timer.snapshot()
+
+	payload_cycles = payload * 8 * (g_sys_clk // f_spi)
+	stats = dict(
+		bytes=payload,
+		commands=commands,
+		elapsed_ns=elapsed,
+		bytes_per_s=payload * 10**9 / elapsed,
+		overhead_cycles=(elapsed / period_ns - payload_cycles) / commands,
+		cs_idle_ns=elapsed - (low_end - low),
+		cs_windows=windows_end - windows)
+	return (ret,stats)
+
+
+async def stream(host,addr,n,chunk):
+	rx = bytearray()
+	async for data in host.stream_read(addr,n,chunk):
+		rx += data
+	return bytes(rx)
+
+
+async def poll_status(host,n):
+	for i in range(n):
+		await host.read_status()
+
+
+def dump():
+	path = os.environ.get("THROUGHPUT_JSON")
+	if(path is None):
+		return
+	with open(path,"w") as f:
+		json.dump(dict(
+			toplevel=cocotb.top._name,
+			generics=dict(g_freq_read=g_freq_read,g_freq_rest=g_freq_rest,g_sys_clk=g_sys_clk),
+			results=results),f,indent=2)
+
+
+@cocotb.test()
+async def bench_throughput(dut):
+	"""Measure the throughput of the read, fast read, page program, status polling, streaming read and streaming program commands"""
+	host = host_for(dut,FlashRefModel.for_dut(dut))
+	cocotb.start_soon(Clock(host.clk, period_ns, units="ns").start())
+	timer = ChipSelectTimer(dut)
+	cocotb.start_soon(timer.run())
+	await host.reset(5)
+
+	model = host.model
+	page = bytes(i & 0xFF for i in range(model.page_size))
+	n = min(model.mem_size,256)
+
+	await host.write_enable()
+	(_,results["page_program"]) = await measure(timer,host.page_program(0,page),len(page),1,g_freq_rest)
+
+	(rx,results["read"]) = await measure(timer,host.read(0,n),n,1,g_freq_read)
+	assert rx == model.read(0,n),"Different expected to actual read data"
+
+	(rx,results["fast_read"]) = await measure(timer,host.fast_read(0,n),n,1,g_freq_rest)
+	assert rx == model.read(0,n),"Different expected to actual read data"
+
+	#the whole (reduced) memory or the first 4 KiB of a full size one, as a single command
+	n = min(model.mem_size,4096)
+	(rx,results["stream_read"]) = await measure(timer,stream(host,0,n,model.page_size),n,1,g_freq_read)
+	assert rx == model.read(0,n),"Different expected to actual read data"
+
+	#the same region programmed back, page after page (write enable, program and WIP poll each)
+	data = bytes(reversed(rx))
+	(_,results["program_stream"]) = await measure(timer,host.page_program_stream(0,data),n,
+		-(-n // model.page_size),g_freq_rest)
+
+	polls = 16
+	(_,results["status_poll"]) = await measure(timer,poll_status(host,polls),polls,polls,g_freq_rest)
+
+	for (op,stats) in results.items():
+		dut._log.info("{:<12} {:>12.0f} B/s {:>8.1f} overhead cycles/cmd {:>10.0f} ns cs idle".format(
+			op,stats["bytes_per_s"],stats["overhead_cycles"],stats["cs_idle_ns"]))
+	dump()
@@ -0,0 +1,25 @@
+from flash_tlm import run_coroutine
+import asyncio
+import inspect
+import pytest
+
+# the async def tests of the python layers over TlmFlashHost run on asyncio, or on the
+# stand-in cocotb scheduler of flash_tlm when marked tlm_scheduler (the layers that start
+# coroutines of their own)
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "tlm_scheduler: run the async test on flash_tlm.TlmScheduler")
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    test = pyfuncitem.obj
+    if not inspect.iscoroutinefunction(test):
+        return None
+    coro = test(**{name: pyfuncitem.funcargs[name] for name in inspect.signature(test).parameters})
+    if pyfuncitem.get_closest_marker("tlm_scheduler"):
+        run_coroutine(coro)
+    else:
+        asyncio.run(coro)
+    return True
@@ -0,0 +1,37 @@
+#Coverage driven stimulus : instead of re-randomizing until a value that was not covered yet
+#comes up (a list scan inside a rejection loop), draw directly from the bins still uncovered.
+#Closing n bins takes exactly n draws.
+
+import random
+
+
+class UncoveredBins:
+	"""Draws every bin of range(size) exactly once, in random order"""
+
+	def __init__(self,size,rng=None):
+		self.size = size
+		self.rng = rng if rng is not None else random
+		self.covered = 0
+		#lazy Fisher-Yates shuffle : only the swapped positions are stored, so memory
+		#grows with the number of draws, not with the bin space (2**16, 2**24 bins ...)
+		self.swaps = {}
+
+	def __len__(self):
+		return self.size - self.covered
+
+	def __iter__(self):
+		while(self.covered < self.size):
+			yield self.draw()
+
+	def draw(self):
+		if(self.covered == self.size):
+			raise IndexError("all {} bins are covered".format(self.size))
+		k = self.covered
+		j = self.rng.randrange(k,self.size)
+		swaps = self.swaps
+		value = swaps.get(j,j)
+		head = swaps.pop(k,k)
+		if(j != k):
+			swaps[j] = head
+		self.covered = k + 1
+		return value
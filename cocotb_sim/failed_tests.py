@@ -0,0 +1,33 @@
+# Waveforms are off by default, a failing test is re-run alone with the seed of the failing
+# run and --wave. This reads the seed and the names of the failed tests from a cocotb results
+# file, for CachedGhdl.run and for the Makefiles :
+#
+#   python failed_tests.py results.xml   ->   TESTCASE=test_erase RANDOM_SEED=1666
+#   (nothing is printed when every test passed)
+import xml.etree.ElementTree as ET
+import sys
+
+
+def failed_tests(results_xml):
+    """(random seed, names of the failed tests) of a cocotb results file"""
+    tree = ET.parse(results_xml)
+    seed = None
+    failed = []
+    for prop in tree.iter("property"):
+        if prop.get("name") == "random_seed":
+            seed = int(prop.get("value"))
+    for tc in tree.iter("testcase"):
+        if any(True for _ in tc.iter("failure")):
+            failed.append(tc.get("name"))
+    return (seed, failed)
+
+
+def main():
+    (seed, failed) = failed_tests(sys.argv[1])
+    if failed:
+        print("failed with RANDOM_SEED={} : {}".format(seed, " ".join(failed)), file=sys.stderr)
+        print("TESTCASE={} RANDOM_SEED={}".format(",".join(failed), seed))
+
+
+if __name__ == "__main__":
+    main()
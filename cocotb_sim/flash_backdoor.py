@@ -0,0 +1,72 @@
+#Backdoor access to the memory array of the flash simulation model behind a toplevel
+#(mem of serial_flash_sim_model, memory of m25p80_sim_model) : whole images are written
+#and read through the cocotb handles in zero simulated time, instead of page programming
+#and reading them back through the controller.
+#With g_sparse_memory, m25p80_sim_model keeps its memory in a protected type that the
+#simulator interface cannot reach, there is no backdoor (see available).
+#Preload after the reset (serial_flash_sim_model erases mem on reset) and before any program
+#or erase command : m25p80_sim_model forces the cells it writes, a deposit does not override them.
+
+import numpy as np
+from flash_model import ERASED,geometry_of
+
+
+def byte_of(value):
+	#cells m25p80_sim_model never wrote hold 'U', the reference model takes them as erased
+	return int(value) if value.is_resolvable else ERASED
+
+
+def memory_of(dut):
+	if(dut._name.lower() in ("flash_top","flash_top_axi")):
+		return dut.serial_flash_sim_model.mem
+	return dut.m25p80_sim_model.memory
+
+
+class FlashBackdoor:
+	"""Bulk load/dump of the flash simulation model memory, as bytes or numpy uint8 arrays"""
+
+	def __init__(self,dut,model=None):
+		self.dut = dut
+		#optional reference model (flash_model.FlashRefModel), kept in sync with the loads
+		self.model = model
+		if(not self.available(dut)):
+			raise ValueError("the memory of {} is sparse (g_sparse_memory), it has no backdoor".format(dut._name))
+		mem = memory_of(dut)
+		#one handle per byte, memory is declared downto : index by address, not by position
+		self.size = len(mem)
+		self.cells = [mem[i] for i in range(self.size)]
+
+	@staticmethod
+	def available(dut):
+		return len(memory_of(dut)) == geometry_of(dut)[0]
+
+	def load(self,data,addr=0):
+		#data : bytes-like or array-like of byte values, written from addr on
+		if(isinstance(data,(bytes,bytearray,memoryview))):
+			data = np.frombuffer(data,dtype=np.uint8)
+		else:
+			data = np.asarray(data,dtype=np.uint8)
+		if(addr < 0 or addr + len(data) > self.size):
+			raise IndexError("{} bytes at {:#x} do not fit in {} bytes of memory".format(len(data),addr,self.size))
+		for (cell,byte) in zip(self.cells[addr:addr + len(data)],data.tolist()):
+			cell.setimmediatevalue(byte)
+		if(self.model is not None):
+			self.model.mem.load(addr,data.tobytes())
+
+	def erase(self):
+		self.load(np.full(self.size,ERASED,dtype=np.uint8))
+
+	def dump_array(self,addr=0,n=None):
+		n = self.size - addr if n is None else n
+		return np.fromiter((byte_of(cell.value) for cell in self.cells[addr:addr + n]),dtype=np.uint8,count=n)
+
+	def dump(self,addr=0,n=None):
+		return self.dump_array(addr,n).tobytes()
+
+	def check(self,expected,addr=0):
+		#compare the memory with an expected image, listing the first differences
+		expected = np.frombuffer(bytes(expected),dtype=np.uint8)
+		actual = self.dump_array(addr,len(expected))
+		diff = np.flatnonzero(actual != expected)
+		assert len(diff) == 0,"{} bytes differ from the expected image, first at {}".format(len(diff),
+			", ".join("{:#x}: {:#04x} != {:#04x}".format(addr + i,actual[i],expected[i]) for i in diff[:8]))
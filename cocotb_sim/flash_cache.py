@@ -0,0 +1,82 @@
+#LRU cache of whole flash pages for the reads of the host driver (FlashHost.enable_cache).
+#A read that misses fills whole pages, a run of missed pages in one continuous READ, so
+#that the neighbouring reads hit. The host invalidates what each write command may reach :
+#PAGE_PROGRAM its page, SECTOR_ERASE its sector, BULK_ERASE and WR_STATUS_REG everything.
+#Changes that do not go through the host (backdoor loads) are not seen, clear() after them.
+
+from collections import OrderedDict
+
+
+class PageCache:
+	"""Least recently used pages of the flash, within a byte budget"""
+
+	def __init__(self,page_size,sector_size,budget,mem_size=None):
+		self.page_size = page_size
+		self.sector_size = sector_size
+		self.budget = budget
+		#addresses wrap around at the end of the memory, like the reads of the flash
+		self.mem_pages = None if mem_size is None else mem_size // page_size
+		#page index -> bytes, least recently used first
+		self.pages = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.invalidations = 0
+
+	def __len__(self):
+		return len(self.pages)
+
+	@property
+	def size(self):
+		return len(self.pages) * self.page_size
+
+	def key(self,index):
+		return index if self.mem_pages is None else index % self.mem_pages
+
+	def get(self,index):
+		index = self.key(index)
+		page = self.pages.get(index)
+		if(page is None):
+			self.misses += 1
+		else:
+			self.hits += 1
+			self.pages.move_to_end(index)
+		return page
+
+	def put(self,index,data):
+		index = self.key(index)
+		self.pages[index] = bytes(data)
+		self.pages.move_to_end(index)
+		while(self.size > self.budget):
+			self.pages.popitem(last=False)
+			self.evictions += 1
+
+	def invalidate(self,addr,n):
+		if(self.mem_pages is not None):
+			addr %= self.mem_pages * self.page_size
+		first = addr // self.page_size
+		last = (addr + n - 1) // self.page_size
+		#walk whichever is smaller : the range or the cached pages
+		if(last - first < len(self.pages)):
+			indexes = range(first,last + 1)
+		else:
+			indexes = [i for i in self.pages if first <= i <= last]
+		for index in indexes:
+			if(self.pages.pop(index,None) is not None):
+				self.invalidations += 1
+
+	def invalidate_page(self,addr):
+		self.invalidate(addr - addr % self.page_size,self.page_size)
+
+	def invalidate_sector(self,addr):
+		self.invalidate(addr - addr % self.sector_size,self.sector_size)
+
+	def clear(self):
+		self.invalidations += len(self.pages)
+		self.pages.clear()
+
+	def stats(self):
+		lookups = self.hits + self.misses
+		return dict(hits=self.hits,misses=self.misses,evictions=self.evictions,
+			invalidations=self.invalidations,pages=len(self.pages),bytes=self.size,
+			hit_rate=self.hits / lookups if lookups else 0)
@@ -0,0 +1,504 @@
+from cocotb.triggers import RisingEdge,FallingEdge,ClockCycles,Timer
+from cocotb.utils import get_sim_time
+from flash_cache import PageCache
+
+
+#supported flash commands
+#command set codes for serial embedded memory , eg any from ST M25Pxx series
+NOP = 255					#pseudo-cmd, not actual flash cmd
+WR_ENABLE = 6
+WR_DISABLE = 4
+RD_STATUS_REG = 5
+WR_STATUS_REG = 1
+PAGE_PROGRAM = 2
+SECTOR_ERASE = 216
+BULK_ERASE = 199
+RD_DATA = 3
+F_RD_DATA = 11
+
+# 					USER REGISTER MAP (wb_regs.vhd)
+
+# 			Address 		| 		Functionality
+#			   0 			|	write flash command code
+#			   1 			|	write data to tx / keep programming data bytes
+#			   2 			|	write A23-A16
+#			   3 			|	write A15-A8
+#			   4 			|	write A7-A0
+#			   5 			|	keep reading data bytes (write) / read rx data (read)
+#			   7 			|	unmapped, used to move the bus away from address 1
+REG_CMD = 0
+REG_TX_DATA = 1
+REG_ADDR_H = 2
+REG_ADDR_M = 3
+REG_ADDR_L = 4
+REG_RX_DATA = 5
+REG_NONE = 7
+#registers a write only stores into : writing the value they hold changes nothing in the
+#controller, the host keeps a shadow copy and skips such writes. Writes of registers 1 and 5
+#are requests of their own and always go out
+SHADOWED_REGS = (REG_CMD,REG_ADDR_H,REG_ADDR_M,REG_ADDR_L)
+
+#status register bits
+WIP = 0x01					#write in progress
+WEL = 0x02					#write enable latch
+
+
+class FlashHost:
+	"""Async host driver for the flash controller behind the Wishbone register map"""
+
+	#optional page cache of the reads, see enable_cache
+	cache = None
+	#skip the writes of SHADOWED_REGS that would not change their value
+	elide_writes = True
+	#bus clock cycles of one register write
+	write_cycles = 1
+
+	def __init__(self,dut,model=None):
+		self.dut = dut
+		#optional reference model (flash_model.FlashRefModel), every command
+		#issued through the host is applied to it as well
+		self.model = model
+
+		#cache the handles, every register access goes through them
+		self.clk = dut.i_clk
+		self.arstn = dut.i_arstn
+		self.we = dut.i_we
+		self.stb = dut.i_stb
+		self.addr = dut.i_addr
+		self.data = dut.i_data
+		self.ack = dut.o_ack
+		self.rd_data = dut.o_data
+		self.byte_tx_done = dut.o_byte_tx_done
+		self.byte_rx_done = dut.o_byte_rx_done
+		self.dv = dut.o_dv
+		self.cs = dut.o_s_n
+
+		#number of register accesses issued on the bus, to measure the driver
+		self.bus_writes = 0
+		self.bus_reads = 0
+		#register -> value last written, and the writes it saved
+		self.shadow = {}
+		self.writes_elided = 0
+
+	def now(self):
+		return get_sim_time("ns")
+
+	def idle(self,ns):
+		#trigger of an idle period on the bus
+		return Timer(ns,units="ns")
+
+	def enable_cache(self,budget,page_size=None,sector_size=None):
+		#LRU cache of whole pages in front of read/fast_read (flash_cache.py), the
+		#geometry defaults to the one of the reference model
+		mem_size = None
+		if(self.model is not None):
+			(mem_size,page_size,sector_size) = (self.model.mem_size,page_size or self.model.page_size,
+				sector_size or self.model.sector_size)
+		elif(page_size is None or sector_size is None):
+			raise ValueError("enable_cache needs the page and sector sizes or a reference model")
+		self.cache = PageCache(page_size,sector_size,budget,mem_size)
+		return self.cache
+
+	def written(self,cmd,addr=0):
+		#invalidate the cached pages a write command may change
+		if(self.cache is None):
+			return
+		if(cmd == PAGE_PROGRAM):
+			self.cache.invalidate_page(addr)
+		elif(cmd == SECTOR_ERASE):
+			self.cache.invalidate_sector(addr)
+		elif(cmd in (BULK_ERASE,WR_STATUS_REG)):
+			#a status write leaves the array alone, but is a write all the same
+			self.cache.clear()
+
+	def invalidate_shadow(self):
+		#register contents unknown, the next write of each one goes out on the bus
+		self.shadow = {}
+
+	def elide(self,addr,data):
+		#True when the write would leave a shadowed register as it is
+		if(not self.elide_writes or addr not in SHADOWED_REGS):
+			return False
+		if(self.shadow.get(addr) == data):
+			self.writes_elided += 1
+			return True
+		self.shadow[addr] = data
+		return False
+
+	def report_bus(self,log):
+		log("register writes : {} on the bus, {} elided ({} bus cycles saved), {} reads".format(
+			self.bus_writes,self.writes_elided,self.writes_elided * self.write_cycles,self.bus_reads))
+
+	async def reset(self,cycles=1):
+		self.invalidate_shadow()
+		self.arstn.value = 0
+		self.we.value = 0
+		self.stb.value = 0
+		self.addr.value = 0
+		self.data.value = 0
+		self.dut.i_dq.value = 0
+		await ClockCycles(self.clk,cycles)
+		self.arstn.value = 1
+		await RisingEdge(self.clk)
+		self.dut._log.info("the core was reset")
+
+	async def write_reg(self,addr,data):
+		#a single bus write cycle, the strobe is left asserted so that
+		#consecutive writes go out on consecutive clocks
+		if(self.elide(addr,data)):
+			return
+		self.we.value = 1
+		self.stb.value = 1
+		self.addr.value = addr
+		self.data.value = data
+		self.bus_writes += 1
+		await RisingEdge(self.clk)
+
+	def release_bus(self):
+		self.stb.value = 0
+
+	async def request_rx(self):
+		#keep reading : the next byte is clocked in while the current one is read
+		self.we.value = 1
+		self.stb.value = 1
+		self.addr.value = REG_RX_DATA
+		self.bus_writes += 1
+
+	async def read_rx_reg(self):
+		self.we.value = 0
+		self.stb.value = 1
+		self.addr.value = REG_RX_DATA
+		self.data.value = 0
+		self.bus_reads += 1
+		await RisingEdge(self.ack)
+		await RisingEdge(self.clk)
+		self.stb.value = 0
+		return int(self.rd_data.value)
+
+	async def write_addr(self,addr):
+		#the controller latches A23-A16 right after the command byte,
+		#so the address is always in place before the command is written
+		await self.write_reg(REG_ADDR_H,(addr >> 16) & 0xFF)
+		await self.write_reg(REG_ADDR_M,(addr >> 8) & 0xFF)
+		await self.write_reg(REG_ADDR_L,addr & 0xFF)
+
+	#completion of the spi side, on the controller outputs instead of a number of clocks
+
+	async def wait_cs_release(self):
+		#the current transaction (if any) is over once chip-select is deasserted
+		if(self.cs.value.binstr == "0"):
+			await RisingEdge(self.cs)
+
+	async def wait_tx_done(self):
+		#the controller took the byte to send and started its transfer
+		await FallingEdge(self.byte_tx_done)
+
+	async def wait_rx_done(self):
+		await FallingEdge(self.byte_rx_done)
+
+	async def wait_ready(self,pause=None):
+		#program, erase and write status complete once WIP clears in the status register.
+		#A single RDSR transaction : the status register is clocked out again for every
+		#byte asked for (register 5) while chip-select stays low, the opcode is sent once.
+		#pause(polls) : optional coroutine function awaited between two status bytes, the
+		#spi clock and the register bus are idle meanwhile
+		#returns the number of status bytes read
+		await self.wait_cs_release()
+		await self.write_reg(REG_CMD,RD_STATUS_REG)
+		self.release_bus()
+		await self.wait_rx_done()				# first status byte started transfer
+		polls = 0
+		while(True):
+			await self.request_rx()				# one more status byte after this one
+			await FallingEdge(self.dv)
+			status = await self.read_rx_reg()
+			polls += 1
+			if(not status & WIP):
+				break
+			if(pause is not None):
+				await pause(polls)
+				#the byte clocked in when the pause started is stale, skip it
+				await self.request_rx()
+				await FallingEdge(self.dv)
+		#the byte already asked for closes the transaction
+		await self.write_reg(REG_CMD,NOP)
+		self.release_bus()
+		await FallingEdge(self.dv)
+		await self.wait_cs_release()
+		return polls
+
+	async def nop(self):
+		#park the controller on the NOP pseudo-command so that it does not re-issue
+		#the last command, and wait for the transaction to close
+		await self.write_reg(REG_CMD,NOP)
+		self.release_bus()
+		await self.wait_cs_release()
+
+	async def command(self,cmd):
+		#instructions without address/data (WREN, WRDI, BE)
+		await self.write_reg(REG_CMD,cmd)
+		self.release_bus()
+		await self.wait_tx_done()	# wait for the command byte to be sent
+		await self.write_reg(REG_CMD,NOP)
+		self.release_bus()
+		self.written(cmd)
+		if(self.model is not None):
+			self.model.command(cmd)
+
+	async def write_enable(self):
+		await self.command(WR_ENABLE)
+
+	async def write_disable(self):
+		await self.command(WR_DISABLE)
+
+	async def bulk_erase(self):
+		await self.command(BULK_ERASE)
+
+	async def write_status(self,value):
+		await self.write_reg(REG_CMD,WR_STATUS_REG)
+		await self.write_reg(REG_TX_DATA,value)
+		self.release_bus()
+		await self.wait_tx_done()	# command byte sent
+		await self.write_reg(REG_NONE,NOP)
+		self.release_bus()
+		await self.wait_tx_done()	# status byte started transfer
+		await self.nop()
+		self.written(WR_STATUS_REG)
+		if(self.model is not None):
+			self.model.write_status(value)
+
+	async def read_status(self):
+		await self.write_reg(REG_CMD,RD_STATUS_REG)
+		self.release_bus()
+		await self.wait_tx_done()	# command byte sent
+		await self.write_reg(REG_CMD,NOP)		# single status byte
+		self.release_bus()
+		await FallingEdge(self.dv)
+		return await self.read_rx_reg()
+
+	async def sector_erase(self,addr):
+		await self.write_addr(addr)
+		await self.write_reg(REG_CMD,SECTOR_ERASE)
+		self.release_bus()
+		await self.wait_tx_done()	# command byte sent
+		await self.wait_tx_done()	# address bytes sent
+		await self.nop()
+		self.written(SECTOR_ERASE,addr)
+		if(self.model is not None):
+			self.model.sector_erase(addr)
+
+	async def page_program(self,addr,data):
+		#program 1..PAGE_SIZE bytes in one continuous spi transaction, every byte
+		#written on register 1 asks the controller to keep the transaction going
+		await self.write_addr(addr)
+		await self.write_reg(REG_CMD,PAGE_PROGRAM)
+		self.release_bus()
+		await self.wait_tx_done()	# command byte sent
+		write_reg = self.write_reg
+		tx_done = FallingEdge(self.byte_tx_done)
+		for byte in data:
+			await write_reg(REG_TX_DATA,byte)
+			await write_reg(REG_NONE,NOP)
+			self.release_bus()
+			await tx_done				# data byte started transfer, o_new_tx_req cleared
+		await self.nop()
+		self.written(PAGE_PROGRAM,addr)
+		if(self.model is not None):
+			self.model.page_program(addr,data)
+
+	async def page_program_stream(self,addr,buffer,page_size=None):
+		#program a bytes-like buffer of any length from addr : it is split at the page
+		#boundaries, each page gets its write enable, one continuous PAGE_PROGRAM transaction
+		#(the next byte is written to register 1 as soon as the controller took the current
+		#one) and a WIP poll. page_size defaults to the one of the reference model
+		#returns the achieved rate, in bytes per simulated second
+		if(page_size is None):
+			if(self.model is None):
+				raise ValueError("page_program_stream needs a page size or a reference model")
+			page_size = self.model.page_size
+		data = memoryview(buffer).cast("B")
+		start = self.now()
+		pos = 0
+		while(pos < len(data)):
+			n = min(len(data) - pos,page_size - (addr + pos) % page_size)
+			await self.write_enable()
+			await self.page_program(addr + pos,data[pos:pos + n])
+			await self.wait_ready()
+			pos += n
+		elapsed = self.now() - start
+		rate = len(data) * 10**9 / elapsed if elapsed else 0
+		self.dut._log.info("programmed {} bytes from {:#x} at {:.0f} B/s".format(len(data),addr,rate))
+		return rate
+
+	async def stream_read(self,addr,length,chunk=256,cmd=RD_DATA):
+		#async generator of the length bytes from addr, in bytes chunks of up to chunk bytes,
+		#all from one READ (or FAST_READ) transaction : chip-select stays low for the whole
+		#region. The next byte is requested (register 5) before the current one is taken from
+		#the rx register, the last one is closed with a NOP. While the consumer holds a chunk
+		#the controller waits with sclk stopped. A consumer that stops early should aclose()
+		#the generator, which closes the transaction
+		if(length == 0):
+			return
+		request_rx = self.request_rx
+		read_rx_reg = self.read_rx_reg
+		dv_fall = FallingEdge(self.dv)
+		buf = bytearray()
+		last = length - 1
+		await self.write_addr(addr)
+		await self.write_reg(REG_CMD,cmd)
+		self.release_bus()
+		await self.wait_rx_done()	# first data byte started transfer
+		i = 0
+		try:
+			while(i < length):
+				if(i == last):
+					await self.write_reg(REG_CMD,NOP)
+					self.release_bus()
+				else:
+					await request_rx()
+				await dv_fall
+				buf.append(await read_rx_reg())
+				i += 1
+				if(len(buf) == chunk or i == length):
+					yield bytes(buf)
+					buf.clear()
+		finally:
+			if(i < length):
+				await self.nop()
+
+	async def read(self,addr,n,cmd=RD_DATA):
+		#read n bytes in one continuous spi transaction, or through the page cache
+		if(self.cache is not None):
+			return await self.cached_read(addr,n,cmd)
+		rx = bytearray()
+		async for data in self.stream_read(addr,n,n,cmd):
+			rx += data
+		return bytes(rx)
+
+	async def cached_read(self,addr,n,cmd=RD_DATA):
+		#hits come from the cache, every run of missed pages is filled by one continuous read
+		if(n == 0):
+			return bytes()
+		cache = self.cache
+		ps = cache.page_size
+		(first,last) = (addr // ps,(addr + n - 1) // ps)
+		pages = {}
+		missed = []
+		for index in range(first,last + 1):
+			page = cache.get(index)
+			if(page is None):
+				missed.append(index)
+			else:
+				pages[index] = page
+		while(missed):
+			#the longest run of consecutive missed pages
+			run = 1
+			while(run < len(missed) and missed[run] == missed[0] + run):
+				run += 1
+			index = missed[0]
+			async for page in self.stream_read(index * ps,run * ps,ps,cmd):
+				pages[index] = page
+				cache.put(index,page)
+				index += 1
+			missed = missed[run:]
+		data = b"".join(pages[index] for index in range(first,last + 1))
+		return data[addr - first * ps:addr - first * ps + n]
+
+	async def fast_read(self,addr,n):
+		return await self.read(addr,n,F_RD_DATA)
+
+
+class AxilFlashHost(FlashHost):
+	"""Async host driver for the flash controller behind the AXI4-Lite register map (axil_regs.vhd)"""
+
+	#address/data, response, back to idle
+	write_cycles = 3
+
+	def __init__(self,dut,model=None):
+		self.dut = dut
+		self.model = model
+
+		self.clk = dut.S_AXI_ACLK
+		self.arstn = dut.S_AXI_ARESETN
+		self.awvalid = dut.S_AXI_AWVALID
+		self.awaddr = dut.S_AXI_AWADDR
+		self.wvalid = dut.S_AXI_WVALID
+		self.wdata = dut.S_AXI_WDATA
+		self.bready = dut.S_AXI_BREADY
+		self.bvalid = dut.S_AXI_BVALID
+		self.arvalid = dut.S_AXI_ARVALID
+		self.araddr = dut.S_AXI_ARADDR
+		self.rready = dut.S_AXI_RREADY
+		self.rvalid = dut.S_AXI_RVALID
+		self.rd_data = dut.o_data
+		self.byte_tx_done = dut.o_byte_tx_done
+		self.byte_rx_done = dut.o_byte_rx_done
+		self.dv = dut.o_dv
+		self.cs = dut.o_s_n
+
+		self.bus_writes = 0
+		self.bus_reads = 0
+		self.shadow = {}
+		self.writes_elided = 0
+
+	async def reset(self,cycles=1):
+		self.invalidate_shadow()
+		self.arstn.value = 0
+		self.awvalid.value = 0
+		self.awaddr.value = 0
+		self.wvalid.value = 0
+		self.wdata.value = 0
+		self.dut.S_AXI_WSTRB.value = 15
+		self.bready.value = 0
+		self.arvalid.value = 0
+		self.araddr.value = 0
+		self.rready.value = 0
+		await ClockCycles(self.clk,cycles)
+		self.arstn.value = 1
+		await RisingEdge(self.clk)
+		self.dut._log.info("the core was reset")
+
+	def hold_write(self,addr,data):
+		self.awvalid.value = 1
+		self.awaddr.value = addr
+		self.wvalid.value = 1
+		self.wdata.value = data
+		self.bready.value = 1
+		self.bus_writes += 1
+
+	async def write_reg(self,addr,data):
+		#a whole write transaction (address, data and response), followed
+		#by a clock so that the register file is back to idle
+		if(self.elide(addr,data)):
+			return
+		self.hold_write(addr,data)
+		await RisingEdge(self.clk)
+		await RisingEdge(self.bvalid)
+		self.awvalid.value = 0
+		self.wvalid.value = 0
+		await RisingEdge(self.clk)
+
+	def release_bus(self):
+		#the write transactions are already complete
+		pass
+
+	async def request_rx(self):
+		#the write to register 5 stays valid until the next register access
+		self.hold_write(REG_RX_DATA,0)
+		await RisingEdge(self.clk)
+		await RisingEdge(self.bvalid)
+
+	async def read_rx_reg(self):
+		self.arvalid.value = 1
+		self.araddr.value = REG_RX_DATA
+		self.rready.value = 1
+		self.bus_reads += 1
+		await FallingEdge(self.rvalid)
+		self.arvalid.value = 0
+		return int(self.rd_data.value)
+
+
+def host_for(dut,model=None):
+	#the AXI4-Lite toplevels (flash_top_axi, top_axi) are the ones with an S_AXI_* port
+	cls = AxilFlashHost if dut._name.lower().endswith("_axi") else FlashHost
+	return cls(dut,model)
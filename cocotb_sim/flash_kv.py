@@ -0,0 +1,285 @@
+#Log-structured key-value store on the flash, through the host driver only. An update never
+#erases in place : records are appended at the head of the log, an in-memory hash index maps
+#every key to its latest value, and whole sectors are garbage collected (live records copied
+#to the head, then one SECTOR_ERASE) when the free sectors run low.
+#
+#Layout : a sector in use starts with a header (SECTOR_MAGIC and a 4 byte sequence number,
+#the order the sectors were opened in), followed by records
+#	marker (PUT or DELETE), key length (1 byte), value length (2 bytes), key, value
+#up to the first erased byte. A record never spans two sectors. mount() rebuilds the index
+#from one streaming read of the whole memory, replaying the sectors in sequence order.
+#
+#Appends go through a write-back buffer (flash_writeback.WriteBuffer), sync() makes them
+#durable. The collection runs from the appends, one sector at a time, whenever no more than
+#reserve sectors are free : a put waits for one sector's collection at most.
+#With a single sector (flash_top) there is nowhere to copy to, the collection compacts the
+#sector through host memory (read the live records, erase, write them back) and a power
+#loss in between loses them.
+
+import struct
+from flash_writeback import WriteBuffer
+
+ERASED = 0xFF
+SECTOR_MAGIC = 0x5A
+PUT = 0xA5
+DELETE = 0xA4
+SECTOR_HEADER = struct.Struct(">BI")
+RECORD_HEADER = struct.Struct(">BBH")
+
+
+class StoreFull(Exception):
+	"""No room left for a record, even after garbage collection"""
+
+
+def parse_sector(data):
+	#(offset, marker, key, value) of the records of a sector image, after its header
+	offset = SECTOR_HEADER.size
+	while(offset + RECORD_HEADER.size <= len(data)):
+		(marker,klen,vlen) = RECORD_HEADER.unpack_from(data,offset)
+		end = offset + RECORD_HEADER.size + klen + vlen
+		if(marker not in (PUT,DELETE) or end > len(data)):
+			#erased (end of the log) or torn record
+			return
+		key = bytes(data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + klen])
+		yield (offset,marker,key,bytes(data[end - vlen:end]))
+		offset = end
+
+
+class LogStore:
+	"""Log-structured key-value store over a host driver (flash_host.FlashHost)"""
+
+	def __init__(self,host,geometry=None,reserve=1,buffer_bytes=None):
+		#geometry (memory, page, sector size) defaults to the one of the host's reference model
+		model = host.model
+		(self.mem_size,self.page_size,self.sector_size) = geometry or (model.mem_size,
+			model.page_size,model.sector_size)
+		self.host = host
+		self.sectors = self.mem_size // self.sector_size
+		#free sectors kept for the collection to copy live records to
+		self.reserve = reserve if self.sectors > 1 else 0
+		self.buf = WriteBuffer(host,self.page_size,self.sector_size,max_bytes=buffer_bytes)
+		self.stats = dict(puts=0,gets=0,deletes=0,bytes_appended=0,collections=0,
+			bytes_copied=0,erases=0)
+		self.clear()
+
+	def clear(self):
+		#key -> (page, offset, length) of its latest value
+		self.index = {}
+		#key -> address of the delete record still needed to hide older puts
+		self.tombstones = {}
+		#per sector : sequence number (None when free), bytes used, bytes of live records
+		self.seq = [None] * self.sectors
+		self.used = [0] * self.sectors
+		self.live = [0] * self.sectors
+		self.free = list(range(self.sectors))
+		self.head = None
+		self.next_seq = 0
+		self.collecting = False
+
+	def __len__(self):
+		return len(self.index)
+
+	def __contains__(self,key):
+		return key in self.index
+
+	def keys(self):
+		return self.index.keys()
+
+	def sector_of(self,addr):
+		return addr // self.sector_size
+
+	def location(self,addr,length):
+		(page,offset) = divmod(addr,self.page_size)
+		return (page,offset,length)
+
+	def retire(self,key):
+		#the latest put and delete records of key become garbage
+		loc = self.index.pop(key,None)
+		if(loc is not None):
+			(page,offset,length) = loc
+			addr = page * self.page_size + offset
+			self.live[self.sector_of(addr)] -= RECORD_HEADER.size + len(key) + length
+		addr = self.tombstones.pop(key,None)
+		if(addr is not None):
+			self.live[self.sector_of(addr)] -= RECORD_HEADER.size + len(key)
+
+	async def format(self):
+		await self.buf.bulk_erase()
+		self.clear()
+
+	async def open_sector(self,n):
+		#a head sector with room for n more bytes
+		if(not self.collecting):
+			while(len(self.free) <= self.reserve and await self.collect()):
+				if(self.head is not None and self.used[self.head] + n <= self.sector_size):
+					#the compaction of a single sector made room
+					return
+		if(not self.free):
+			raise StoreFull("no free sector left for a {} byte record".format(n))
+		sector = self.free.pop(0)
+		self.seq[sector] = self.next_seq
+		self.next_seq += 1
+		await self.buf.write(sector * self.sector_size,SECTOR_HEADER.pack(SECTOR_MAGIC,self.seq[sector]))
+		self.used[sector] = SECTOR_HEADER.size
+		self.head = sector
+
+	async def append(self,record):
+		if(len(record) > self.sector_size - SECTOR_HEADER.size):
+			raise ValueError("a {} byte record does not fit in a {} byte sector".format(len(record),self.sector_size))
+		if(self.head is None or self.used[self.head] + len(record) > self.sector_size):
+			await self.open_sector(len(record))
+		addr = self.head * self.sector_size + self.used[self.head]
+		await self.buf.write(addr,record)
+		self.used[self.head] += len(record)
+		self.live[self.head] += len(record)
+		self.stats["bytes_appended"] += len(record)
+		return addr
+
+	async def put(self,key,value):
+		key = bytes(key)
+		value = bytes(value)
+		addr = await self.append(RECORD_HEADER.pack(PUT,len(key),len(value)) + key + value)
+		self.retire(key)
+		self.index[key] = self.location(addr + RECORD_HEADER.size + len(key),len(value))
+		self.stats["puts"] += 1
+
+	async def delete(self,key):
+		key = bytes(key)
+		if(key not in self.index):
+			return False
+		addr = await self.append(RECORD_HEADER.pack(DELETE,len(key),0) + key)
+		self.retire(key)
+		self.tombstones[key] = addr
+		self.stats["deletes"] += 1
+		return True
+
+	async def get(self,key):
+		loc = self.index.get(bytes(key))
+		self.stats["gets"] += 1
+		if(loc is None):
+			return None
+		(page,offset,length) = loc
+		if(length == 0):
+			return b""
+		return await self.buf.read(page * self.page_size + offset,length)
+
+	async def sync(self):
+		await self.buf.flush()
+
+	def garbage(self,sector):
+		return self.used[sector] - self.live[sector] - SECTOR_HEADER.size
+
+	async def erase_sector(self,sector):
+		await self.buf.sector_erase(sector * self.sector_size)
+		self.stats["erases"] += 1
+		(self.seq[sector],self.used[sector],self.live[sector]) = (None,0,0)
+		if(self.head == sector):
+			self.head = None
+
+	def live_records(self,sector,data):
+		#records of the sector image still needed : latest puts and the deletes
+		#that hide puts of older sectors
+		base = sector * self.sector_size
+		older = any(s is not None and s < self.seq[sector] for s in self.seq)
+		for (offset,marker,key,value) in parse_sector(data):
+			addr = base + offset
+			if(marker == PUT):
+				loc = self.index.get(key)
+				if(loc is not None and loc == self.location(addr + RECORD_HEADER.size + len(key),len(value))):
+					yield (key,value)
+			elif(self.tombstones.get(key) == addr):
+				if(older):
+					yield (key,None)
+				else:
+					del self.tombstones[key]
+					self.live[sector] -= RECORD_HEADER.size + len(key)
+
+	async def collect(self):
+		#collect the sector with the most garbage, returns False when nothing can be freed
+		if(self.sectors == 1):
+			return await self.compact()
+		used = [s for s in range(self.sectors) if self.seq[s] is not None and s != self.head]
+		if(not used):
+			return False
+		victim = max(used,key=self.garbage)
+		room = len(self.free) * (self.sector_size - SECTOR_HEADER.size)
+		if(self.head is not None):
+			room += self.sector_size - self.used[self.head]
+		if(self.garbage(victim) <= 0 or self.live[victim] > room):
+			return False
+		self.collecting = True
+		try:
+			data = await self.buf.read(victim * self.sector_size,self.used[victim])
+			for (key,value) in list(self.live_records(victim,data)):
+				await self.copy(key,value)
+			#the copies are durable before the originals are erased
+			await self.buf.flush()
+			await self.erase_sector(victim)
+		finally:
+			self.collecting = False
+		self.free.append(victim)
+		self.stats["collections"] += 1
+		return True
+
+	async def copy(self,key,value):
+		if(value is None):
+			addr = await self.append(RECORD_HEADER.pack(DELETE,len(key),0) + key)
+			self.retire(key)
+			self.tombstones[key] = addr
+		else:
+			await self.put(key,value)
+			self.stats["puts"] -= 1
+		self.stats["bytes_copied"] += RECORD_HEADER.size + len(key) + (0 if value is None else len(value))
+
+	async def compact(self):
+		#single sector : the live records go through host memory
+		sector = 0
+		if(self.seq[sector] is None or self.garbage(sector) <= 0):
+			return False
+		data = await self.buf.read(0,self.used[sector])
+		records = [(key,value) for (key,value) in self.live_records(sector,data) if value is not None]
+		self.index.clear()
+		self.tombstones.clear()
+		await self.erase_sector(sector)
+		self.free = [sector]
+		self.collecting = True
+		try:
+			for (key,value) in records:
+				await self.copy(key,value)
+		finally:
+			self.collecting = False
+		self.stats["collections"] += 1
+		return True
+
+	async def mount(self):
+		#rebuild the index from the flash, with one streaming read of the whole memory
+		self.clear()
+		images = []
+		async for data in self.host.stream_read(0,self.mem_size,self.sector_size):
+			images.append(data)
+		in_use = []
+		for (sector,data) in enumerate(images):
+			if(data[0] == SECTOR_MAGIC):
+				in_use.append((SECTOR_HEADER.unpack_from(data)[1],sector))
+			elif(data != bytes([ERASED]) * self.sector_size):
+				#neither a log sector nor erased (an erase cut short)
+				await self.erase_sector(sector)
+		self.free = sorted(set(range(self.sectors)) - set(s for (q,s) in in_use))
+		for (seq,sector) in sorted(in_use):
+			self.seq[sector] = seq
+			self.used[sector] = SECTOR_HEADER.size
+			base = sector * self.sector_size
+			for (offset,marker,key,value) in parse_sector(images[sector]):
+				size = RECORD_HEADER.size + len(key) + len(value)
+				self.retire(key)
+				if(marker == PUT):
+					self.index[key] = self.location(base + offset + RECORD_HEADER.size + len(key),len(value))
+				else:
+					self.tombstones[key] = base + offset
+				self.live[sector] += size
+				self.used[sector] = offset + size
+			if(images[sector][self.used[sector]:] != bytes([ERASED]) * (self.sector_size - self.used[sector])):
+				#a torn record : no more appends in this sector
+				self.used[sector] = self.sector_size
+			self.head = sector
+			self.next_seq = seq + 1
@@ -0,0 +1,156 @@
+#Python reference model of the M25Pxx serial flash, at the level of flash commands.
+#It follows the command semantics of the VHDL simulation models used by the testbenches
+#(serial_flash_sim_model.vhd behind flash_top and m25p80_sim_model.vhd behind top),
+#so that every byte read back through the controller can be predicted.
+#Like the VHDL models, it does not model timing : WIP never reads as 1.
+
+from flash_host import NOP,WR_ENABLE,WR_DISABLE,RD_STATUS_REG,WR_STATUS_REG,PAGE_PROGRAM,\
+	SECTOR_ERASE,BULK_ERASE,RD_DATA,F_RD_DATA
+from flash_storage import ERASED,DenseMemory,SparseMemory
+
+#status register bits
+WIP = 0x01
+WEL = 0x02
+
+#(memory size, page size, sector size) in bytes
+M25P80_GEOMETRY = (1048576,256,65536)
+#larger parts (M25P16 and up) are kept in sparse storage by default
+DENSE_LIMIT = M25P80_GEOMETRY[0]
+
+#geometry and quirks of the simulation model behind each toplevel
+#serial_flash_sim_model : 256 bytes addressed by A7-A0, one sector, overwrites on program,
+#keeps WEL set after a page program
+#m25p80_sim_model : reduced M25P80 geometry by default (the generics of top/top_axi,
+#see geometry_of), overwrites on program (latch is not ANDed)
+TOPLEVELS = {
+	"flash_top" : dict(geometry=(256,256,256),and_program=False,program_clears_wel=False),
+	"flash_top_axi" : dict(geometry=(256,256,256),and_program=False,program_clears_wel=False),
+	"top" : dict(geometry=(1024,16,64),and_program=False,program_clears_wel=True),
+	"top_axi" : dict(geometry=(1024,16,64),and_program=False,program_clears_wel=True),
+}
+
+
+def geometry_of(top):
+	#top/top_axi give the m25p80_sim_model geometry as generics, the other toplevels
+	#(and the transaction level model) have the fixed one of TOPLEVELS
+	try:
+		return (int(top.g_mem_size),int(top.g_page_size),int(top.g_sector_size))
+	except AttributeError:
+		return TOPLEVELS[top._name.lower()]["geometry"]
+
+
+class FlashRefModel:
+	"""Command level reference model of an M25Pxx serial flash"""
+
+	def __init__(self,geometry=M25P80_GEOMETRY,and_program=True,program_clears_wel=True,storage=None):
+		(self.mem_size,self.page_size,self.sector_size) = geometry
+		#a real device can only clear bits when programming
+		self.and_program = and_program
+		self.program_clears_wel = program_clears_wel
+		#storage class of the image (flash_storage), dense up to DENSE_LIMIT bytes
+		if(storage is None):
+			storage = DenseMemory if self.mem_size <= DENSE_LIMIT else SparseMemory
+		self.mem = storage(self.mem_size,self.page_size)
+		self.status = 0
+
+	@classmethod
+	def for_toplevel(cls,name):
+		return cls(**TOPLEVELS[name.lower()])
+
+	@classmethod
+	def for_dut(cls,dut):
+		config = dict(TOPLEVELS[dut._name.lower()])
+		config["geometry"] = geometry_of(dut)
+		return cls(**config)
+
+	@property
+	def wel(self):
+		return bool(self.status & WEL)
+
+	def write_enable(self):
+		self.status |= WEL
+
+	def write_disable(self):
+		self.status &= ~WEL
+
+	def read_status(self):
+		return self.status
+
+	def write_status(self,value):
+		#both VHDL models store the written byte as is
+		if(self.wel):
+			self.status = value & 0xFF
+
+	def page_program(self,addr,data):
+		data = bytes(data)
+		if(not self.wel or len(data) == 0):
+			return
+		addr %= self.mem_size
+		base = addr - addr % self.page_size
+		offset = addr % self.page_size
+		#bytes past the end of the page wrap around to its start,
+		#only the last PAGE_SIZE bytes sent are kept
+		if(len(data) > self.page_size):
+			offset = (offset + len(data) - self.page_size) % self.page_size
+			data = data[-self.page_size:]
+		head = self.page_size - offset
+		self.mem.program(base + offset,data[:head],self.and_program)
+		self.mem.program(base,data[head:],self.and_program)
+		if(self.program_clears_wel):
+			self.status &= ~(WEL | WIP)
+
+	def sector_erase(self,addr):
+		if(not self.wel):
+			return
+		addr %= self.mem_size
+		base = addr - addr % self.sector_size
+		self.mem.erase(base,self.sector_size)
+		self.status &= ~(WEL | WIP)
+
+	def bulk_erase(self):
+		if(not self.wel):
+			return
+		self.mem.erase(0,self.mem_size)
+		self.status &= ~(WEL | WIP)
+
+	def read(self,addr,n):
+		#reads wrap around at the end of the memory, the bytes are a snapshot
+		addr %= self.mem_size
+		if(addr + n <= self.mem_size):
+			return bytes(self.mem.read(addr,n))
+		rx = bytearray()
+		while(n > 0):
+			chunk = min(n,self.mem_size - addr)
+			rx += self.mem.read(addr,chunk)
+			n -= chunk
+			addr = 0
+		return bytes(rx)
+
+	def view(self,addr,n):
+		#zero-copy read (no wrap around), follows later programs and erases
+		return self.mem.read(addr % self.mem_size,n)
+
+	def fast_read(self,addr,n):
+		return self.read(addr,n)
+
+	def command(self,cmd,addr=0,data=None):
+		#apply a flash command given by its opcode, data holds the bytes to program
+		#(PAGE_PROGRAM), the status value (WR_STATUS_REG) or the byte count (reads)
+		if(cmd == WR_ENABLE):
+			self.write_enable()
+		elif(cmd == WR_DISABLE):
+			self.write_disable()
+		elif(cmd == RD_STATUS_REG):
+			return self.read_status()
+		elif(cmd == WR_STATUS_REG):
+			self.write_status(data)
+		elif(cmd == PAGE_PROGRAM):
+			self.page_program(addr,data)
+		elif(cmd == SECTOR_ERASE):
+			self.sector_erase(addr)
+		elif(cmd == BULK_ERASE):
+			self.bulk_erase()
+		elif(cmd in (RD_DATA,F_RD_DATA)):
+			return self.read(addr,data)
+		elif(cmd != NOP):
+			raise ValueError("unsupported flash command {}".format(cmd))
@@ -0,0 +1,125 @@
+#Completion of the write operations (page program, sector erase, bulk erase, write status)
+#through the WIP bit of the status register, with their latency measured.
+#
+#Every operation is followed by FlashHost.wait_ready : one RD_STATUS_REG transaction that
+#keeps clocking the status register out while chip-select stays low, until WIP clears.
+#The latency of an operation runs from the release of chip-select after its command (the
+#flash starts the internal cycle then) to the end of the status transaction that read WIP
+#at 0, they are kept in one histogram per operation.
+#
+#Back-off : against a timing accurate flash model (tPP ~ms, tSE ~s) polling on every byte
+#keeps the spi clock and the register bus busy for nothing. With backoff_ns, the poller
+#pauses between two status bytes, the pause growing by backoff_factor up to backoff_max_ns
+#while WIP stays set.
+#
+#	poller = WipPoller(host,backoff_ns=1000,backoff_max_ns=64000)
+#	await poller.page_program(addr,data)
+#	poller.report(dut._log.info)
+
+from collections import Counter
+from cocotb.triggers import Timer
+from cocotb.utils import get_sim_time
+
+
+class LatencyHistogram:
+	"""Latencies (ns) of one kind of operation, binned in powers of two"""
+
+	def __init__(self,name):
+		self.name = name
+		self.samples = []
+
+	def __len__(self):
+		return len(self.samples)
+
+	def add(self,latency_ns):
+		self.samples.append(latency_ns)
+
+	def bins(self):
+		#upper bound of the bin (ns) -> count
+		return Counter(1 << max(int(s) - 1,0).bit_length() for s in self.samples)
+
+	def percentile(self,p):
+		if(not self.samples):
+			return None
+		ordered = sorted(self.samples)
+		return ordered[min(len(ordered) - 1,int(p / 100 * len(ordered)))]
+
+	def summary(self):
+		return {
+			"count" : len(self.samples),
+			"min_ns" : min(self.samples,default=None),
+			"p50_ns" : self.percentile(50),
+			"p99_ns" : self.percentile(99),
+			"max_ns" : max(self.samples,default=None),
+			"bins_ns" : dict(sorted(self.bins().items())),
+		}
+
+	def lines(self,width=40):
+		bins = self.bins()
+		peak = max(bins.values(),default=1)
+		yield "{} : {} ops, p50 {} ns, p99 {} ns".format(self.name,len(self),
+			self.percentile(50),self.percentile(99))
+		for (bound,count) in sorted(bins.items()):
+			yield "  <= {:>12} ns {:>6} {}".format(bound,count,"#" * max(1,count * width // peak))
+
+
+class WipPoller:
+	"""Runs write operations through a host driver and waits for WIP to clear after each"""
+
+	OPERATIONS = ("page_program","sector_erase","bulk_erase","write_status")
+
+	def __init__(self,host,backoff_ns=0,backoff_factor=2,backoff_max_ns=None):
+		self.host = host
+		self.backoff_ns = backoff_ns
+		self.backoff_factor = backoff_factor
+		self.backoff_max_ns = backoff_max_ns
+		self.latency = {op : LatencyHistogram(op) for op in self.OPERATIONS}
+		#status bytes read, for all the operations
+		self.polls = 0
+
+	def pause(self):
+		#None (no pause) or the back-off coroutine function for one wait
+		if(not self.backoff_ns):
+			return None
+		delay = self.backoff_ns
+
+		async def backoff(polls):
+			nonlocal delay
+			await Timer(delay,units="ns")
+			delay *= self.backoff_factor
+			if(self.backoff_max_ns is not None):
+				delay = min(delay,self.backoff_max_ns)
+		return backoff
+
+	async def wait_ready(self,op=None):
+		#the operation started when its chip-select window closed
+		await self.host.wait_cs_release()
+		start = get_sim_time("ns")
+		self.polls += await self.host.wait_ready(self.pause())
+		if(op is not None):
+			self.latency[op].add(get_sim_time("ns") - start)
+
+	async def run(self,op,*args):
+		await getattr(self.host,op)(*args)
+		await self.wait_ready(op)
+
+	async def page_program(self,addr,data):
+		await self.run("page_program",addr,data)
+
+	async def sector_erase(self,addr):
+		await self.run("sector_erase",addr)
+
+	async def bulk_erase(self):
+		await self.run("bulk_erase")
+
+	async def write_status(self,value):
+		await self.run("write_status",value)
+
+	def summary(self):
+		return {op : hist.summary() for (op,hist) in self.latency.items() if len(hist)}
+
+	def report(self,log):
+		for hist in self.latency.values():
+			if(len(hist)):
+				for line in hist.lines():
+					log(line)
@@ -0,0 +1,215 @@
+#Command queue of the host driver : several producer coroutines submit reads, programs and
+#erases with priorities, one worker coroutine runs them on the controller (one command at a
+#time).
+#
+#The worker takes the highest priority request it may run :
+#	- reads may overtake pending programs and erases, unless their ranges overlap (read
+#	  after write : the read waits for the data it must see)
+#	- programs and erases keep their submission order, and do not overtake an overlapping read
+#	  submitted before them (write after read)
+#	- a request that holds back a higher priority one runs with that priority (no priority
+#	  inversion behind a stream of reads)
+#	- the runnable reads adjacent to (or overlapping) the one taken are coalesced into one
+#	  continuous READ of up to max_read bytes, each gets its slice back
+#Per class (read, program, erase) : the wait (submission to start) and service (start to
+#completion) times in histograms, and the queue depth seen by every submission.
+#
+#	queue = CommandQueue(host).start()
+#	rx = await queue.read(addr,n)
+#	await queue.program(addr,data,priority=READ)
+#	queue.report(dut._log.info)
+
+import cocotb
+from cocotb.triggers import Event
+from flash_poll import LatencyHistogram
+from flash_sched import READ,PROGRAM,ERASE
+
+
+class Request:
+	"""One submitted command : range, priority, completion"""
+
+	def __init__(self,kind,priority,addr,n,data,seq):
+		self.kind = kind
+		self.priority = priority
+		self.addr = addr
+		self.n = n
+		self.data = data
+		self.seq = seq
+		self.submitted = None
+		self.started = None
+		#held back by a program or erase it overlaps
+		self.blocked = False
+		self.done = Event()
+		self.result = None
+
+	def overlaps(self,other):
+		return self.addr < other.addr + other.n and other.addr < self.addr + self.n
+
+	def __repr__(self):
+		return "{}({:#x},{},p{})".format(self.kind,self.addr,self.n,self.priority)
+
+
+class CommandQueue:
+	"""Prioritised, hazard checked command queue over a host driver (flash_host.FlashHost)"""
+
+	KINDS = ("read","program","erase")
+
+	def __init__(self,host,max_read=None):
+		self.host = host
+		model = host.model
+		self.mem_size = model.mem_size
+		self.sector_size = model.sector_size
+		self.max_read = max_read or model.mem_size
+		#submission order
+		self.pending = []
+		self.seq = 0
+		self.wake = Event()
+		self.task = None
+		self.wait_hist = {kind : LatencyHistogram(kind + " wait") for kind in self.KINDS}
+		self.service_hist = {kind : LatencyHistogram(kind + " service") for kind in self.KINDS}
+		self.depth = {kind : [] for kind in self.KINDS}
+		self.stats = dict(commands=0,reordered=0,coalesced=0,raw_blocked=0,promoted=0)
+
+	def start(self):
+		self.task = cocotb.start_soon(self.run())
+		return self
+
+	def stop(self):
+		if(self.task is not None):
+			self.task.kill()
+			self.task = None
+
+	def push(self,kind,addr,n,data=None,priority=None):
+		#submit without waiting, returns the request to wait() on
+		if(priority is None):
+			priority = dict(read=READ,program=PROGRAM,erase=ERASE)[kind]
+		req = Request(kind,priority,addr,n,data,self.seq)
+		self.seq += 1
+		req.submitted = self.host.now()
+		self.depth[kind].append(len(self.pending))
+		self.pending.append(req)
+		self.wake.set()
+		return req
+
+	async def wait(self,req):
+		await req.done.wait()
+		return req.result
+
+	async def read(self,addr,n,priority=None):
+		return await self.wait(self.push("read",addr,n,priority=priority))
+
+	async def program(self,addr,data,priority=None):
+		return await self.wait(self.push("program",addr,len(data),bytes(data),priority))
+
+	async def erase(self,addr,priority=None):
+		#the sector of addr
+		base = addr - addr % self.sector_size
+		return await self.wait(self.push("erase",base,self.sector_size,priority=priority))
+
+	def blocker(self,req):
+		#the first earlier request that req may not overtake, None when req may run
+		for other in self.pending:
+			if(other.seq >= req.seq):
+				break
+			if(req.kind == "read"):
+				if(other.kind != "read" and req.overlaps(other)):
+					return other
+			elif(other.kind != "read" or req.overlaps(other)):
+				return other
+		return None
+
+	def pick(self):
+		#the request to run next : runnable, by effective priority, then submission order
+		priority = {req.seq : req.priority for req in self.pending}
+		runnable = []
+		for req in self.pending:
+			other = self.blocker(req)
+			if(other is None):
+				runnable.append(req)
+				continue
+			if(req.kind == "read" and not req.blocked):
+				req.blocked = True
+				self.stats["raw_blocked"] += 1
+			#priority inheritance, down the chain of blockers
+			while(other is not None):
+				priority[other.seq] = min(priority[other.seq],priority[req.seq])
+				other = self.blocker(other)
+		best = min(runnable,key=lambda req : (priority[req.seq],req.seq))
+		if(priority[best.seq] < best.priority):
+			self.stats["promoted"] += 1
+		return best
+
+	def coalesce(self,req):
+		#runnable reads that touch the range of req, into one range of up to max_read bytes
+		group = [req]
+		(lo,hi) = (req.addr,req.addr + req.n)
+		grown = True
+		while(grown):
+			grown = False
+			for other in self.pending:
+				if(other.kind != "read" or other in group or self.blocker(other) is not None):
+					continue
+				(l,h) = (min(lo,other.addr),max(hi,other.addr + other.n))
+				if(other.addr <= hi and lo <= other.addr + other.n and h - l <= self.max_read):
+					group.append(other)
+					(lo,hi) = (l,h)
+					grown = True
+		return (group,lo,hi)
+
+	async def run(self):
+		while True:
+			if(not self.pending):
+				self.wake.clear()
+				await self.wake.wait()
+				continue
+			req = self.pick()
+			if(req.kind == "read"):
+				(group,lo,hi) = self.coalesce(req)
+			else:
+				(group,lo,hi) = ([req],req.addr,req.addr + req.n)
+			for r in group:
+				if(any(o.seq < r.seq and o.kind != "read" for o in self.pending)):
+					self.stats["reordered"] += 1
+				self.pending.remove(r)
+				r.started = self.host.now()
+			self.stats["coalesced"] += len(group) - 1
+			self.stats["commands"] += 1
+			data = await self.execute(req,lo,hi)
+			for r in group:
+				if(r.kind == "read"):
+					r.result = data[r.addr - lo:r.addr - lo + r.n]
+				self.wait_hist[r.kind].add(r.started - r.submitted)
+				self.service_hist[r.kind].add(self.host.now() - r.started)
+				r.done.set()
+
+	async def execute(self,req,lo,hi):
+		host = self.host
+		if(req.kind == "read"):
+			return await host.read(lo,hi - lo)
+		elif(req.kind == "program"):
+			await host.page_program_stream(req.addr,req.data)
+		else:
+			await host.write_enable()
+			await host.sector_erase(req.addr)
+			await host.wait_ready()
+
+	def summary(self):
+		summary = dict(self.stats)
+		for kind in self.KINDS:
+			depth = self.depth[kind]
+			if(depth):
+				summary[kind] = dict(requests=len(depth),max_depth=max(depth),
+					mean_depth=sum(depth) / len(depth),wait=self.wait_hist[kind].summary(),
+					service=self.service_hist[kind].summary())
+		return summary
+
+	def report(self,log):
+		log("command queue : " + ", ".join("{} {}".format(k,v) for (k,v) in self.stats.items()))
+		for kind in self.KINDS:
+			depth = self.depth[kind]
+			if(depth):
+				log("{} : {} requests, queue depth mean {:.1f} max {}".format(kind,len(depth),
+					sum(depth) / len(depth),max(depth)))
+				for hist in (self.wait_hist[kind],self.service_hist[kind]):
+					for line in hist.lines():
+						log(line)
@@ -0,0 +1,196 @@
+#Erase-ahead : sector erases taken off the write path. A writer that runs out of erased
+#sectors has to erase one before it can program, the erase latency lands on the write.
+#Here released (dirty) sectors are erased in the background while the bus is idle, so
+#that allocate() finds a pre-erased sector.
+#
+#Every operation on the bus goes through one worker coroutine and a priority queue : reads
+#first, then programs, then the background erases. The controller runs one command at a
+#time and an erase cannot be interrupted once started, a queued erase is held back instead
+#while reads or programs are pending, and (idle_ns) until the bus has been idle that long : a
+#submission in the meantime ends the wait, and the erase goes behind it.
+#Below low_water pre-erased sectors, the erases are queued with the programs so that the
+#pool refills under a steady load. allocate() with no erased sector left erases a dirty one
+#ahead of everything else, that is the latency erase-ahead hides.
+#
+#The coroutines run on the cocotb scheduler (start_soon, Event, First) that also drives the
+#simulator, the time and the idle trigger come from the host (host.now, host.idle).
+#Latencies, from submission to completion, are kept in one histogram per class.
+#
+#	sched = EraseAhead(host,sectors=range(1,16),low_water=2).start()
+#	sector = await sched.allocate()
+#	await sched.program(sector * sched.sector_size,data)
+#	sched.release(old)
+
+import heapq
+import itertools
+from collections import deque
+import cocotb
+from cocotb.triggers import Event,First
+from flash_poll import LatencyHistogram
+
+#priorities, lowest served first
+URGENT = 0
+READ = 1
+PROGRAM = 2
+ERASE = 3
+
+
+class OpQueue:
+	"""Operations by priority, first in first out within a priority"""
+
+	def __init__(self):
+		self.heap = []
+		self.order = itertools.count()
+
+	def __len__(self):
+		return len(self.heap)
+
+	def push(self,priority,op):
+		heapq.heappush(self.heap,(priority,next(self.order),op))
+
+	def pop(self):
+		return heapq.heappop(self.heap)[2]
+
+	def priority(self):
+		#of the next operation, None when empty
+		return self.heap[0][0] if self.heap else None
+
+
+class Op:
+	"""One queued operation and its completion"""
+
+	def __init__(self,kind,fn,args):
+		self.kind = kind
+		self.fn = fn
+		self.args = args
+		self.done = Event()
+		self.result = None
+
+
+class EraseAhead:
+	"""Pre-erases released sectors while the bus is idle, over a host driver (flash_host.FlashHost)"""
+
+	KINDS = ("read","program","allocate","erase")
+
+	def __init__(self,host,sectors=None,low_water=1,idle_ns=0,ahead=True):
+		#sectors : the pool, erased to begin with (all the sectors of the flash by default).
+		#ahead=False erases on demand only, in allocate
+		self.host = host
+		self.sector_size = host.model.sector_size
+		if(sectors is None):
+			sectors = range(host.model.mem_size // self.sector_size)
+		self.erased = deque(sectors)
+		self.dirty = set()
+		self.low_water = low_water
+		self.idle_ns = idle_ns
+		self.ahead = ahead
+		self.queue = OpQueue()
+		self.wake = Event()
+		self.busy = False
+		self.task = None
+		self.latency = {kind : LatencyHistogram(kind) for kind in self.KINDS}
+		self.stats = dict(background_erases=0,foreground_erases=0,promoted=0,held_back=0)
+
+	def start(self):
+		self.task = cocotb.start_soon(self.run())
+		return self
+
+	def stop(self):
+		if(self.task is not None):
+			self.task.kill()
+			self.task = None
+
+	async def run(self):
+		while True:
+			if(not self.queue):
+				self.wake.clear()
+				await self.wake.wait()
+				continue
+			if(self.queue.priority() == ERASE and self.idle_ns):
+				#an erase holds the bus, wait for the foreground to go quiet first
+				self.wake.clear()
+				idle = self.host.idle(self.idle_ns)
+				fired = await First(idle,self.wake.wait())
+				if(self.queue.priority() != ERASE):
+					self.stats["held_back"] += 1
+					continue
+				if(fired is not idle):
+					#a release, the bus is still idle : the wait starts over
+					continue
+			op = self.queue.pop()
+			self.busy = True
+			op.result = await op.fn(*op.args)
+			self.busy = False
+			op.done.set()
+
+	def push(self,priority,kind,fn,*args):
+		op = Op(kind,fn,args)
+		self.queue.push(priority,op)
+		self.wake.set()
+		return op
+
+	async def submit(self,priority,kind,fn,*args):
+		start = self.host.now()
+		op = self.push(priority,kind,fn,*args)
+		await op.done.wait()
+		self.latency[kind].add(self.host.now() - start)
+		return op.result
+
+	async def read(self,addr,n):
+		return await self.submit(READ,"read",self.host.read,addr,n)
+
+	async def program(self,addr,data):
+		return await self.submit(PROGRAM,"program",self.host.page_program_stream,addr,data)
+
+	def release(self,sector):
+		#the content of sector is no longer needed
+		self.dirty.add(sector)
+		if(self.ahead):
+			if(len(self.erased) < self.low_water):
+				self.stats["promoted"] += 1
+				self.push(PROGRAM,"erase",self.erase,sector,True)
+			else:
+				self.push(ERASE,"erase",self.erase,sector,True)
+
+	async def erase(self,sector,background):
+		#runs on the worker. the sector may have been erased already, through a newer
+		#queue entry of it
+		if(sector not in self.dirty):
+			return
+		self.dirty.discard(sector)
+		start = self.host.now()
+		await self.host.write_enable()
+		await self.host.sector_erase(sector * self.sector_size)
+		await self.host.wait_ready()
+		self.latency["erase"].add(self.host.now() - start)
+		self.stats["background_erases" if background else "foreground_erases"] += 1
+		self.erased.append(sector)
+
+	async def allocate(self):
+		#a pre-erased sector, erasing a dirty one first if none is left
+		start = self.host.now()
+		while(not self.erased):
+			if(self.dirty):
+				op = self.push(URGENT,"erase",self.erase,next(iter(self.dirty)),False)
+				await op.done.wait()
+			elif(self.busy or self.queue):
+				#an erase in flight, wait for the worker to get through it
+				op = self.push(URGENT,"sync",self.nothing)
+				await op.done.wait()
+			else:
+				raise RuntimeError("no sector left to allocate, release some first")
+		self.latency["allocate"].add(self.host.now() - start)
+		return self.erased.popleft()
+
+	async def nothing(self):
+		pass
+
+	def summary(self):
+		return dict(self.stats,**{kind : hist.summary() for (kind,hist) in self.latency.items() if len(hist)})
+
+	def report(self,log):
+		log("erase-ahead : " + ", ".join("{} {}".format(k,v) for (k,v) in self.stats.items()))
+		for hist in self.latency.values():
+			if(len(hist)):
+				for line in hist.lines():
+					log(line)
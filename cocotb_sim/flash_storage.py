@@ -0,0 +1,141 @@
+#Storage of the flash image behind the reference model (flash_model.FlashRefModel) or any
+#other python scoreboard. Both classes have the same interface : read (memoryview), program,
+#erase, load, len(), bytes() and bytearray-like indexing/slicing.
+#	DenseMemory : one bytearray of the whole device
+#	SparseMemory : only the pages that were written, a dict of page index -> bytearray,
+#		the other pages are implied erased. The footprint follows the traffic, not the
+#		device size (M25P16/M25P32/M25P128), and erases cost O(touched pages).
+
+ERASED = 0xFF
+
+
+class DenseMemory:
+	"""Flash image held in a single bytearray"""
+
+	def __init__(self,size,page_size):
+		self.size = size
+		self.page_size = page_size
+		self.data = bytearray([ERASED]) * size
+
+	def __len__(self):
+		return self.size
+
+	def __bytes__(self):
+		return bytes(self.data)
+
+	def __getitem__(self,key):
+		return self.data[key]
+
+	def __setitem__(self,key,value):
+		self.data[key] = value
+
+	def read(self,addr,n):
+		#zero-copy : the view follows later programs and erases
+		return memoryview(self.data)[addr:addr + n]
+
+	def program(self,addr,data,and_program=False):
+		if(and_program):
+			mem = self.data
+			for (i,byte) in enumerate(data,addr):
+				mem[i] &= byte
+		else:
+			self.data[addr:addr + len(data)] = data
+
+	def load(self,addr,data):
+		self.program(addr,data)
+
+	def erase(self,addr,n):
+		self.data[addr:addr + n] = bytes([ERASED]) * n
+
+
+class SparseMemory:
+	"""Flash image keeping only the written pages, the others read as erased"""
+
+	def __init__(self,size,page_size):
+		self.size = size
+		self.page_size = page_size
+		self.pages = {}
+		self.erased_page = bytes([ERASED]) * page_size
+
+	def __len__(self):
+		return self.size
+
+	def __bytes__(self):
+		return bytes(self.read(0,self.size))
+
+	def __getitem__(self,key):
+		if(isinstance(key,slice)):
+			(start,stop,step) = key.indices(self.size)
+			data = bytes(self.read(start,max(stop - start,0)))
+			return data if step == 1 else data[::step]
+		if(key < 0):
+			key += self.size
+		page = self.pages.get(key // self.page_size)
+		return ERASED if page is None else page[key % self.page_size]
+
+	def __setitem__(self,key,value):
+		if(isinstance(key,slice)):
+			(start,stop,step) = key.indices(self.size)
+			if(step != 1 or len(value) != stop - start):
+				raise ValueError("only contiguous slices of the same length can be assigned")
+			self.load(start,value)
+		else:
+			self.load(key if key >= 0 else key + self.size,bytes([value]))
+
+	def page(self,index):
+		#writable page, allocated erased on first write
+		page = self.pages.get(index)
+		if(page is None):
+			page = self.pages[index] = bytearray(self.erased_page)
+		return page
+
+	def read(self,addr,n):
+		#zero-copy within a page, pages never written are views of the erased page
+		(index,offset) = divmod(addr,self.page_size)
+		if(offset + n <= self.page_size):
+			page = self.pages.get(index)
+			return memoryview(self.erased_page if page is None else page)[offset:offset + n]
+		out = bytearray()
+		while(n > 0):
+			chunk = min(n,self.page_size - offset)
+			page = self.pages.get(index)
+			out += (self.erased_page if page is None else page)[offset:offset + chunk]
+			n -= chunk
+			index += 1
+			offset = 0
+		return memoryview(out)
+
+	def program(self,addr,data,and_program=False):
+		data = memoryview(bytes(data))
+		(index,offset) = divmod(addr,self.page_size)
+		while(len(data) > 0):
+			chunk = min(len(data),self.page_size - offset)
+			page = self.page(index)
+			if(and_program):
+				for (i,byte) in enumerate(data[:chunk],offset):
+					page[i] &= byte
+			else:
+				page[offset:offset + chunk] = data[:chunk]
+			data = data[chunk:]
+			index += 1
+			offset = 0
+
+	def load(self,addr,data):
+		self.program(addr,data)
+
+	def erase(self,addr,n):
+		ps = self.page_size
+		first = -(-addr // ps)						#first whole page
+		last = (addr + n) // ps						#past the last whole page
+		#partial pages at both ends are erased in place
+		for (start,stop) in ((addr,min(first * ps,addr + n)),(max(last * ps,addr),addr + n)):
+			page = self.pages.get(start // ps)
+			if(start < stop and page is not None):
+				page[start % ps:(stop - 1) % ps + 1] = self.erased_page[:stop - start]
+		#whole pages are dropped, walking whichever is smaller : the range or the written pages
+		if(last - first <= len(self.pages)):
+			for index in range(first,last):
+				self.pages.pop(index,None)
+		else:
+			for index in [i for i in self.pages if first <= i < last]:
+				del self.pages[index]
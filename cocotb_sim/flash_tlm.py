@@ -0,0 +1,262 @@
+#Transaction level model of the register file (wb_regs.vhd / axil_regs.vhd), the spi
+#flash controller and the flash behind them, used to run the testbenches without a simulator.
+#Register accesses are applied in order, a flash command being opened by its command code
+#and closed by the next one (usually NOP). Nothing is clocked : SPI timing, dummy cycles
+#and the re-issue of a command left in the command register are not modeled.
+#TlmFlashHost gives the FlashHost interface at the command level, for the python layers
+#built on the host driver (write buffer, caches ...) to be tested without a simulator.
+#TlmScheduler stands in for the cocotb scheduler there, for the layers that run their own
+#coroutines (start_soon, Event, First), see run_coroutine.
+
+import logging
+import inspect
+from collections import deque
+import cocotb
+from cocotb import outcomes
+from cocotb.decorators import Task
+from cocotb.triggers import NullTrigger,Join,GPITrigger
+from flash_host import FlashHost,NOP,WR_ENABLE,WR_DISABLE,RD_STATUS_REG,WR_STATUS_REG,PAGE_PROGRAM,\
+	SECTOR_ERASE,BULK_ERASE,RD_DATA,F_RD_DATA,REG_CMD,REG_TX_DATA,REG_ADDR_H,REG_ADDR_M,\
+	REG_ADDR_L,REG_RX_DATA
+from flash_model import FlashRefModel
+
+
+class FlashControllerModel:
+	"""Transaction level model of the register file and spi flash controller"""
+
+	def __init__(self,flash):
+		self.flash = flash
+		self.reset()
+
+	def reset(self):
+		self.cmd = NOP
+		self.addr_regs = [0,0,0]
+		self.rx_data = 0
+		self.tx = bytearray()
+		#current read stream : its command, address, next offset and the bytes
+		#clocked in but not read yet
+		self.rx_cmd = NOP
+		self.rx_addr = None
+		self.rx_offset = 0
+		self.rx_pending = 0
+
+	@property
+	def addr(self):
+		(h,m,l) = self.addr_regs
+		return (h << 16) | (m << 8) | l
+
+	def write_reg(self,addr,data):
+		data &= 0xFF
+		if(addr == REG_CMD):
+			self.close()
+			self.open(data)
+		elif(addr == REG_TX_DATA):
+			self.tx.append(data)
+		elif(addr in (REG_ADDR_H,REG_ADDR_M,REG_ADDR_L)):
+			self.addr_regs[addr - REG_ADDR_H] = data
+		elif(addr == REG_RX_DATA):
+			#keep reading : one more byte is clocked in
+			if(self.cmd in (RD_STATUS_REG,RD_DATA,F_RD_DATA)):
+				self.rx_pending += 1
+
+	def read_reg(self,addr):
+		if(addr == REG_RX_DATA and self.rx_pending > 0):
+			self.rx_pending -= 1
+			if(self.rx_cmd == RD_STATUS_REG):
+				self.rx_data = self.flash.read_status()
+			else:
+				if(self.rx_addr is None):
+					self.rx_addr = self.addr
+				self.rx_data = self.flash.read(self.rx_addr + self.rx_offset,1)[0]
+				self.rx_offset += 1
+		return self.rx_data
+
+	def open(self,cmd):
+		self.cmd = cmd
+		self.tx = bytearray()
+		if(cmd == NOP):
+			return
+		#the first byte is clocked in without being asked for, the address
+		#is latched once the command is closed or the first byte is read
+		self.rx_cmd = cmd
+		self.rx_addr = None
+		self.rx_offset = 0
+		self.rx_pending = 1 if cmd in (RD_STATUS_REG,RD_DATA,F_RD_DATA) else 0
+		if(cmd in (WR_ENABLE,WR_DISABLE,BULK_ERASE)):
+			self.flash.command(cmd)
+
+	def close(self):
+		#chip-select is released, commands carrying an address or data take effect
+		cmd = self.cmd
+		if(cmd == PAGE_PROGRAM):
+			self.flash.page_program(self.addr,self.tx)
+		elif(cmd == SECTOR_ERASE):
+			self.flash.sector_erase(self.addr)
+		elif(cmd == WR_STATUS_REG and self.tx):
+			self.flash.write_status(self.tx[0])
+		elif(cmd in (RD_DATA,F_RD_DATA) and self.rx_addr is None):
+			self.rx_addr = self.addr
+		self.cmd = NOP
+
+
+class FlashTlmTop:
+	"""Stands in for cocotb.top when the testbenches run on the transaction level model"""
+
+	def __init__(self,name):
+		self._name = name
+		self._log = logging.getLogger("cocotb.{}".format(name))
+		self.flash = FlashRefModel.for_toplevel(name)
+		self.ctrl = FlashControllerModel(self.flash)
+
+
+class TlmFlashHost(FlashHost):
+	"""FlashHost on the transaction level model : the commands go straight to the flash, in zero time"""
+
+	def __init__(self,dut,model=None):
+		#dut : FlashTlmTop, its flash model stands for the device
+		self.dut = dut
+		self.flash = dut.flash
+		self.model = model
+		self.bus_writes = 0
+		self.bus_reads = 0
+		self.shadow = {}
+		self.writes_elided = 0
+
+	@classmethod
+	def for_toplevel(cls,name):
+		#on the model of toplevel name, with a reference model of the same flash
+		return cls(FlashTlmTop(name),FlashRefModel.for_toplevel(name))
+
+	def now(self):
+		return 0
+
+	def idle(self,ns):
+		#no time here, the coroutines ready to run go first
+		return NullTrigger()
+
+	def apply(self,op,*args):
+		for flash in (self.flash,self.model):
+			if(flash is not None):
+				getattr(flash,op)(*args)
+
+	async def reset(self,cycles=1):
+		pass
+
+	async def wait_cs_release(self):
+		pass
+
+	async def wait_tx_done(self):
+		pass
+
+	async def wait_rx_done(self):
+		pass
+
+	async def wait_ready(self,pause=None):
+		#WIP never reads as 1
+		return 1
+
+	async def nop(self):
+		pass
+
+	async def command(self,cmd):
+		self.written(cmd)
+		self.apply("command",cmd)
+
+	async def write_status(self,value):
+		self.written(WR_STATUS_REG)
+		self.apply("write_status",value)
+
+	async def read_status(self):
+		return self.flash.read_status()
+
+	async def sector_erase(self,addr):
+		self.written(SECTOR_ERASE,addr)
+		self.apply("sector_erase",addr)
+
+	async def page_program(self,addr,data):
+		self.written(PAGE_PROGRAM,addr)
+		self.apply("page_program",addr,bytes(data))
+
+	async def stream_read(self,addr,length,chunk=256,cmd=RD_DATA):
+		for pos in range(0,length,chunk):
+			yield self.flash.read(addr + pos,min(chunk,length - pos))
+
+
+class TlmScheduler:
+	"""Minimal stand-in for the cocotb scheduler : runs tasks that only wait on python triggers
+	(events, queues, joins), there is no simulation time. Drives the cocotb 1.7 Task internals"""
+
+	def __init__(self):
+		self.ready = deque()
+		self.joins = {}
+		self.tasks = set()
+		self._current_task = None
+
+	def create_task(self,coro):
+		return coro if isinstance(coro,Task) else Task(coro)
+
+	def start_soon(self,coro):
+		task = self.create_task(coro)
+		if(not task._started):
+			task._started = True
+			self.tasks.add(task)
+			self.ready.append((task,outcomes.Value(None)))
+		return task
+
+	def _unschedule(self,task):
+		#like cocotb, a running coroutine is not closed : closing a First waiter would run its
+		#callback. a trigger it was primed on may still fire, the wake up is dropped in run
+		self.tasks.discard(task)
+		if(inspect.getcoroutinestate(task._coro) == inspect.CORO_CREATED):
+			task._coro.close()
+
+	def wake(self,task):
+		return lambda trigger : self.ready.append((task,trigger._outcome))
+
+	def run(self,coro):
+		main = self.start_soon(coro)
+		while(self.ready and not main.done()):
+			(task,outcome) = self.ready.popleft()
+			if(task.done()):
+				continue
+			self._current_task = task
+			result = task._advance(outcome)
+			self._current_task = None
+			if(task.done()):
+				self.tasks.discard(task)
+				waiters = self.joins.pop(task,[])
+				for waiter in waiters:
+					self.ready.append((waiter,task._outcome))
+				if(not waiters and task is not main):
+					task._outcome.get()
+				continue
+			if(isinstance(result,Join)):
+				result = result._coroutine
+			if(isinstance(result,Task)):
+				self.start_soon(result)
+				if(result.done()):
+					self.ready.append((task,result._outcome))
+				else:
+					self.joins.setdefault(result,[]).append(task)
+			elif(isinstance(result,GPITrigger)):
+				raise RuntimeError("{} waits on {}, which needs a simulator".format(task,result))
+			else:
+				result.prime(self.wake(task))
+		#the worker and monitor loops never return
+		for task in list(self.tasks):
+			if(task is not main):
+				task.kill()
+		self.tasks.clear()
+		if(not main.done()):
+			raise RuntimeError("the test is blocked, nothing left to run")
+		return main.result()
+
+
+def run_coroutine(coro):
+	#runs coro and the tasks it starts on a TlmScheduler, returns its result
+	saved = cocotb.scheduler
+	cocotb.scheduler = TlmScheduler()
+	try:
+		return cocotb.scheduler.run(coro)
+	finally:
+		cocotb.scheduler = saved
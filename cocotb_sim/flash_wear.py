@@ -0,0 +1,157 @@
+#Wear leveling of the sector erases, in the host layer. The flash models keep no erase
+#counts and a workload that rewrites the same few sectors wears them out while the others
+#stay fresh.
+#
+#WearLeveler exposes logical sectors, spare fewer than the physical ones, remapped to
+#physical sectors by a table in host memory (it is not stored on the flash) :
+#	- erasing a logical sector erases its physical sector, which goes back to the free
+#	  (erased) sectors, and maps the logical sector onto the least worn free one
+#	- when the erase counts spread by more than threshold, the least worn sector in use holds
+#	  cold data (it is not being rewritten) : its content moves to the most worn free sector
+#	  and it goes back into circulation. These moves are the extra write traffic of the
+#	  leveling, counted in stats
+#Reads and programs are split at the sector boundaries and translated sector by sector.
+#
+#	wear = WearLeveler(host,threshold=4)
+#	await wear.format()
+#	await wear.erase(addr)
+#	await wear.write(addr,data)
+
+from array import array
+from collections import Counter
+
+UNMAPPED = 0xFFFF
+ERASED = 0xFF
+
+
+class WearLeveler:
+	"""Logical to physical sector remap with per sector erase counters, over a host driver"""
+
+	def __init__(self,host,geometry=None,spare=1,threshold=8):
+		#geometry (memory, page, sector size) defaults to the one of the host's reference model
+		model = host.model
+		(self.mem_size,self.page_size,self.sector_size) = geometry or (model.mem_size,
+			model.page_size,model.sector_size)
+		self.host = host
+		self.physical = self.mem_size // self.sector_size
+		if(spare < 1 or self.physical <= spare):
+			raise ValueError("wear leveling with {} spare sectors needs more than {} sectors, the flash has {}".format(
+				spare,spare,self.physical))
+		self.sectors = self.physical - spare
+		#None : no migration of cold data, the free sectors rotate only
+		self.threshold = threshold
+		#physical sector -> erase count, logical -> physical, physical -> logical (or UNMAPPED)
+		self.erases = array("I",[0] * self.physical)
+		self.remap = array("H",range(self.sectors))
+		self.owner = array("H",list(range(self.sectors)) + [UNMAPPED] * spare)
+		self.stats = dict(
+			bytes_written=0,			#bytes programmed through write
+			erases=0,					#physical sector erases, the migrations' included
+			migrations=0,				#cold sectors moved
+			bytes_migrated=0,			#bytes programmed by the moves
+			migration_erases=0)			#erases of the moves
+
+	@property
+	def size(self):
+		return self.sectors * self.sector_size
+
+	def free(self):
+		return [p for p in range(self.physical) if self.owner[p] == UNMAPPED]
+
+	def spread(self):
+		return max(self.erases) - min(self.erases)
+
+	def pieces(self,addr,n):
+		#(physical address, offset in the data, length) of a logical range, per sector
+		if(addr < 0 or addr + n > self.size):
+			raise ValueError("{} bytes at {:#x} outside the {} logical bytes".format(n,addr,self.size))
+		pos = 0
+		while(pos < n):
+			(sector,offset) = divmod(addr + pos,self.sector_size)
+			k = min(n - pos,self.sector_size - offset)
+			yield (self.remap[sector] * self.sector_size + offset,pos,k)
+			pos += k
+
+	async def read(self,addr,n):
+		rx = bytearray()
+		for (phys,pos,k) in self.pieces(addr,n):
+			rx += await self.host.read(phys,k)
+		return bytes(rx)
+
+	async def write(self,addr,data):
+		#programs erased logical bytes, like PAGE_PROGRAM
+		data = memoryview(data).cast("B")
+		self.stats["bytes_written"] += len(data)
+		for (phys,pos,k) in self.pieces(addr,len(data)):
+			await self.host.page_program_stream(phys,data[pos:pos + k],self.page_size)
+
+	async def erase_physical(self,sector):
+		await self.host.write_enable()
+		await self.host.sector_erase(sector * self.sector_size)
+		await self.host.wait_ready()
+		self.erases[sector] += 1
+		self.stats["erases"] += 1
+
+	async def format(self):
+		await self.host.write_enable()
+		await self.host.bulk_erase()
+		await self.host.wait_ready()
+		for sector in range(self.physical):
+			self.erases[sector] += 1
+
+	async def erase(self,addr):
+		#erase a logical sector : it moves to the least worn free sector
+		sector = addr // self.sector_size
+		old = self.remap[sector]
+		await self.erase_physical(old)
+		self.owner[old] = UNMAPPED
+		new = min(self.free(),key=lambda p : self.erases[p])
+		(self.remap[sector],self.owner[new]) = (new,sector)
+		await self.level(new)
+
+	async def level(self,hot=None):
+		#at most one move per erase, that bounds the extra latency of an erase. hot : the
+		#sector just erased, it is fresh rather than cold
+		if(self.threshold is None or self.spread() <= self.threshold):
+			return
+		used = [p for p in range(self.physical) if self.owner[p] != UNMAPPED and p != hot]
+		if(not used):
+			#a single logical sector, it is the hot one
+			return
+		cold = min(used,key=lambda p : self.erases[p])
+		target = max(self.free(),key=lambda p : self.erases[p])
+		if(self.erases[target] <= self.erases[cold]):
+			return
+		data = await self.host.read(cold * self.sector_size,self.sector_size)
+		#the erased tail needs no programming
+		data = data.rstrip(bytes([ERASED]))
+		if(data):
+			await self.host.page_program_stream(target * self.sector_size,data,self.page_size)
+		sector = self.owner[cold]
+		(self.remap[sector],self.owner[target]) = (target,sector)
+		await self.erase_physical(cold)
+		self.owner[cold] = UNMAPPED
+		self.stats["migrations"] += 1
+		self.stats["bytes_migrated"] += len(data)
+		self.stats["migration_erases"] += 1
+
+	def histogram(self):
+		#erase count -> physical sectors
+		return Counter(self.erases)
+
+	def summary(self):
+		return dict(self.stats,min_erases=min(self.erases),max_erases=max(self.erases),
+			spread=self.spread(),histogram=dict(sorted(self.histogram().items())))
+
+	def lines(self,width=40):
+		bins = self.histogram()
+		peak = max(bins.values())
+		yield "sector erases : min {} max {} spread {}, {} migrations ({} bytes, {} erases)".format(
+			min(self.erases),max(self.erases),self.spread(),self.stats["migrations"],
+			self.stats["bytes_migrated"],self.stats["migration_erases"])
+		for (count,sectors) in sorted(bins.items()):
+			yield "  {:>8} erases {:>6} {}".format(count,sectors,"#" * max(1,sectors * width // peak))
+
+	def report(self,log):
+		for line in self.lines():
+			log(line)
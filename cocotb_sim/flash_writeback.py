@@ -0,0 +1,159 @@
+#Write-back buffer between many small writes and the flash. Unbuffered, every write costs
+#a write enable, a PAGE_PROGRAM with its command/address header and a WIP poll per page it
+#touches. Here the writes are gathered per page (adjacent and overlapping ranges merged) and
+#a page is programmed once, one continuous PAGE_PROGRAM per run of written bytes (a single
+#one for records appended back to back).
+#
+#A page is flushed when it is completely written, on flush(), when it is older than
+#max_age_ns or, oldest first, while more than max_bytes are buffered. The thresholds are
+#checked in the calls of the buffer, nothing runs on the bus in the background.
+#Reads through the buffer see the buffered bytes, erases drop the buffered pages they cover.
+#
+#	buf = WriteBuffer(host,max_age_ns=100000)
+#	await buf.write(addr,record)
+#	await buf.flush()
+
+from cocotb.utils import get_sim_time
+
+
+class DirtyPage:
+	"""Buffered bytes of one page and the sorted, merged ranges they cover"""
+
+	def __init__(self,size,born):
+		self.size = size
+		self.data = bytearray(size)
+		self.ranges = []
+		self.born = born
+
+	def __len__(self):
+		return sum(end - start for (start,end) in self.ranges)
+
+	def write(self,offset,data):
+		#returns the number of bytes that were already buffered
+		(start,end) = (offset,offset + len(data))
+		self.data[start:end] = data
+		overlap = 0
+		ranges = []
+		for (s,e) in self.ranges:
+			if(e < offset or s > offset + len(data)):
+				ranges.append((s,e))
+			else:
+				#overlapping or adjacent : merged
+				overlap += max(0,min(e,offset + len(data)) - max(s,offset))
+				(start,end) = (min(start,s),max(end,e))
+		ranges.append((start,end))
+		self.ranges = sorted(ranges)
+		return overlap
+
+	def full(self):
+		return self.ranges == [(0,self.size)]
+
+
+class WriteBuffer:
+	"""Write-back buffer of page programs in front of a host driver (flash_host.FlashHost)"""
+
+	def __init__(self,host,page_size=None,sector_size=None,max_age_ns=None,max_bytes=None):
+		self.host = host
+		#the geometry defaults to the one of the host's reference model
+		self.page_size = host.model.page_size if page_size is None else page_size
+		self.sector_size = host.model.sector_size if sector_size is None else sector_size
+		self.max_age_ns = max_age_ns
+		self.max_bytes = max_bytes
+		#page address -> DirtyPage, oldest first
+		self.pages = {}
+		self.stats = dict(
+			writes=0,					#write calls
+			bytes_written=0,			#bytes handed to write
+			bytes_coalesced=0,			#of those, landing on a page already buffered
+			bytes_overwritten=0,		#of those, replacing bytes still buffered
+			flushes=0,					#pages flushed
+			programs=0,					#PAGE_PROGRAM commands issued
+			bytes_programmed=0,
+			commands_saved=0)			#PAGE_PROGRAM commands the writes would have taken unbuffered, minus programs
+
+	def now(self):
+		#ages only need the simulation time when they are checked
+		return 0 if self.max_age_ns is None else get_sim_time("ns")
+
+	@property
+	def buffered(self):
+		return sum(len(page) for page in self.pages.values())
+
+	async def write(self,addr,data):
+		data = memoryview(data).cast("B")
+		self.stats["writes"] += 1
+		self.stats["bytes_written"] += len(data)
+		pos = 0
+		while(pos < len(data)):
+			(base,offset) = divmod(addr + pos,self.page_size)
+			base *= self.page_size
+			n = min(len(data) - pos,self.page_size - offset)
+			page = self.pages.get(base)
+			if(page is None):
+				page = self.pages[base] = DirtyPage(self.page_size,self.now())
+			else:
+				self.stats["bytes_coalesced"] += n
+			self.stats["bytes_overwritten"] += page.write(offset,data[pos:pos + n])
+			#unbuffered, every page a write touches is one program
+			self.stats["commands_saved"] += 1
+			if(page.full()):
+				await self.flush_page(base)
+			pos += n
+		await self.flush_expired()
+
+	async def flush_page(self,base):
+		page = self.pages.pop(base)
+		for (start,end) in page.ranges:
+			await self.host.page_program_stream(base + start,page.data[start:end],self.page_size)
+			self.stats["programs"] += 1
+			self.stats["bytes_programmed"] += end - start
+			self.stats["commands_saved"] -= 1
+		self.stats["flushes"] += 1
+
+	async def flush_expired(self):
+		if(self.max_age_ns is not None):
+			now = self.now()
+			for (base,page) in list(self.pages.items()):
+				if(now - page.born >= self.max_age_ns):
+					await self.flush_page(base)
+		if(self.max_bytes is not None):
+			while(self.pages and self.buffered > self.max_bytes):
+				await self.flush_page(next(iter(self.pages)))
+
+	async def flush(self,addr=None,n=None):
+		#every buffered page, or the ones holding bytes of addr..addr+n
+		for base in list(self.pages):
+			if(addr is None or (base < addr + n and addr < base + self.page_size)):
+				await self.flush_page(base)
+
+	async def read(self,addr,n):
+		#flash content with the buffered bytes laid over it
+		rx = bytearray(await self.host.read(addr,n))
+		for (base,page) in self.pages.items():
+			for (start,end) in page.ranges:
+				lo = max(base + start,addr)
+				hi = min(base + end,addr + n)
+				if(lo < hi):
+					rx[lo - addr:hi - addr] = page.data[lo - base:hi - base]
+		return bytes(rx)
+
+	def drop(self,addr,n):
+		#buffered bytes that an erase would clear anyway
+		for base in [b for b in self.pages if addr <= b < addr + n]:
+			del self.pages[base]
+
+	async def sector_erase(self,addr):
+		sector = addr - addr % self.sector_size
+		self.drop(sector,self.sector_size)
+		await self.host.write_enable()
+		await self.host.sector_erase(addr)
+		await self.host.wait_ready()
+
+	async def bulk_erase(self):
+		self.pages.clear()
+		await self.host.write_enable()
+		await self.host.bulk_erase()
+		await self.host.wait_ready()
+
+	def report(self,log):
+		log("write buffer : " + ", ".join("{} {}".format(k,v) for (k,v) in self.stats.items()))
@@ -0,0 +1,131 @@
+from cocotb_test.simulator import Ghdl
+from cocotb_test.compat import cocotb_config
+import subprocess
+import hashlib
+import fcntl
+import shutil
+import json
+import os
+from failed_tests import failed_tests
+
+# Analysed GHDL libraries are shared by every run with the same VHDL sources, compile flags
+# and GHDL build (version + backend). The generics only come in with "ghdl -r", so a new
+# parameter set only gets a fresh run directory and nothing is re-analysed.
+#
+# Waveforms are off unless WAVES=1. When a test fails, it is re-run alone with the seed of the
+# failing run and --wave=<test>.ghw, restricted to the signals listed in WAVE_SIGNALS (a GHDL
+# --read-wave-opt file) when it is set. The failures are recorded in failed_tests.json.
+
+
+def ghdl_version():
+    return subprocess.run(["ghdl", "--version"], capture_output=True, text=True, check=True).stdout
+
+
+def cache_key(vhdl_sources, compile_args, toplevel):
+    key = hashlib.sha256()
+    key.update(ghdl_version().encode())
+    key.update(" ".join(compile_args).encode())
+    key.update(toplevel.encode())
+    for lib, sources in sorted(vhdl_sources.items()):
+        key.update(lib.encode())
+        for source in sources:
+            key.update(os.path.basename(source).encode())
+            with open(source, "rb") as f:
+                key.update(hashlib.sha256(f.read()).digest())
+    return key.hexdigest()[:16]
+
+
+class CachedGhdl(Ghdl):
+    """Ghdl runner analysing the sources once per content hash, in a directory shared by the runs"""
+
+    def __init__(self, cache_root, wave_signals=None, **kwargs):
+        super().__init__(**kwargs)
+        self.wave_signals = wave_signals if wave_signals is not None else os.getenv("WAVE_SIGNALS")
+        self.wave_file = self.toplevel_module + ".ghw"
+        self.ghdl_args = self.compile_args + self.extra_args + self.vhdl_compile_args
+        key = cache_key(self.vhdl_sources, self.ghdl_args, self.toplevel_module)
+        self.cache_dir = os.path.join(os.path.abspath(cache_root), key)
+
+    def analyse(self):
+        # pytest-xdist workers race for the same cache directory,
+        # the first one to take the lock analyses, the others wait and reuse
+        os.makedirs(self.cache_dir, exist_ok=True)
+        done = os.path.join(self.cache_dir, self.toplevel_module + ".done")
+        with open(os.path.join(self.cache_dir, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.exists(done):
+                return
+            workdir = ["--workdir=" + self.cache_dir]
+            for lib, sources in self.vhdl_sources.items():
+                subprocess.run(["ghdl", "-i"] + self.ghdl_args + workdir + [f"--work={lib}"] + sources,
+                               cwd=self.cache_dir, check=True)
+            subprocess.run(["ghdl", "-m"] + self.ghdl_args + workdir + [f"--work={self.toplevel_library}",
+                           self.toplevel_module], cwd=self.cache_dir, check=True)
+            open(done, "w").close()
+
+    def build_command(self):
+        ghdl_exec = shutil.which("ghdl")
+        if ghdl_exec is None:
+            raise ValueError("GHDL executable not found.")
+
+        self.analyse()
+        if self.compile_only:
+            return []
+
+        # the llvm and gcc backends link an executable, run it from the run directory
+        exe = os.path.join(self.cache_dir, self.toplevel_module)
+        link = os.path.join(self.work_dir, self.toplevel_module)
+        if os.path.isfile(exe):
+            if os.path.lexists(link):
+                os.remove(link)
+            os.symlink(exe, link)
+
+        sim_args = list(self.simulation_args)
+        if self.waves:
+            sim_args.append(f"--wave={self.wave_file}")
+            if self.wave_signals:
+                sim_args.append("--read-wave-opt=" + os.path.abspath(self.wave_signals))
+
+        self.env["PATH"] += os.pathsep + os.path.join(os.path.dirname(os.path.dirname(ghdl_exec)), "lib")
+
+        cmd_run = (
+            ["ghdl", "-r", f"--work={self.toplevel_library}", "--workdir=" + self.cache_dir]
+            + self.ghdl_args
+            + [self.toplevel_module]
+            + ["--vpi=" + str(cocotb_config.lib_name_path("vpi", "ghdl"))]
+            + sim_args
+            + self.get_parameter_commands(self.parameters)
+        )
+
+        return [cmd_run]
+
+    def run(self):
+        __tracebackhide__ = True
+        try:
+            return super().run()
+        except SystemExit:
+            results = self.env.get("COCOTB_RESULTS_FILE")
+            if self.waves or self.compile_only or results is None or not os.path.isfile(results):
+                raise
+            self.rerun_failed(results)
+            raise
+
+    def rerun_failed(self, results):
+        (seed, failed) = failed_tests(results)
+        record = []
+        self.waves = True
+        for test in failed:
+            self.logger.error(f"re-running {test} with RANDOM_SEED={seed} and waveforms")
+            self.env["TESTCASE"] = test
+            self.env["RANDOM_SEED"] = str(seed)
+            self.env.pop("COCOTB_RESULTS_FILE", None)
+            self.wave_file = f"{test}.ghw"
+            try:
+                super().run()
+                reproduced = False
+            except SystemExit:
+                reproduced = True
+            record.append(dict(test=test, seed=seed, reproduced=reproduced,
+                               wave=os.path.join(self.work_dir, self.wave_file)))
+        with open(os.path.join(self.work_dir, "failed_tests.json"), "w") as f:
+            json.dump(record, f, indent=2)
@@ -0,0 +1,146 @@
+#Opt-in profiling of the python side of the testbenches, to see where the CI minutes go
+#(bfm, cocotb_coverage, monitors, the scheduler itself ...). Off unless FLASH_PROFILE=1.
+#
+#Every test decorated with @profiled runs under cProfile, its stats are dumped to
+#$FLASH_PROFILE_DIR/<module>.<test>.<toplevel>.prof (pstats format, e.g. snakeviz) and a row
+#is appended to $FLASH_PROFILE_DIR/summary.txt : wall time, simulated time, their ratio,
+#the triggers that fired and the modules with the most self time.
+#The trigger count is approximate and cocotb 1.7 only : cocotb has no public hook for it, the
+#private Scheduler._react is wrapped for the duration of the test. Triggers primed before the
+#test started are missed, on other cocotb versions the column reads n/a.
+#
+#	@cocotb.test()					@pyuvm.test()
+#	@profiled						@profiled
+#	async def test_x(dut): ...		class Test(uvm_test): ...
+
+import os
+import time
+import pstats
+import cProfile
+import inspect
+import functools
+from collections import Counter
+import cocotb
+from cocotb.utils import get_sim_time
+
+enabled = os.environ.get("FLASH_PROFILE") == "1"
+#the Scheduler._react wrapped to count the triggers is the one of cocotb 1.7
+triggers_countable = cocotb.__version__.startswith("1.7.")
+profile_dir = os.environ.get("FLASH_PROFILE_DIR","profile")
+
+#(column, width) of the summary table
+columns = (("test",40),("toplevel",14),("wall_s",9),("sim_us",11),("sim_us/wall_s",14),
+	("~triggers",10),("top self time",0))
+
+
+def sim_time():
+	#no simulator behind the transaction level runs
+	if(os.environ.get("FLASH_BACKEND") == "tlm"):
+		return 0
+	return get_sim_time("us")
+
+
+def module_of(filename):
+	#group the functions by package (site-packages) or by file (testbench, utils ...)
+	if(filename.startswith("<") or filename == "~"):
+		return "builtins"
+	parts = filename.replace(os.sep,"/").split("/")
+	if("site-packages" in parts):
+		return parts[parts.index("site-packages") + 1].replace(".py","")
+	return parts[-1]
+
+
+def self_time_by_module(stats):
+	total = Counter()
+	for ((filename,line,func),(cc,nc,tt,ct,callers)) in stats.stats.items():
+		total[module_of(filename)] += tt
+	return total
+
+
+class TestProfile:
+	"""cProfile, wall/sim clocks and a fired trigger count around one test"""
+
+	def __init__(self,name):
+		self.name = name
+		self.triggers = Counter()
+
+	def count_triggers(self):
+		#every trigger primed from now on gets the scheduler's _react as its callback
+		#(the TlmScheduler of flash_tlm has none, nothing is counted there)
+		scheduler = cocotb.scheduler
+		react = getattr(scheduler,"_react",None)
+		if(not triggers_countable or react is None):
+			self.triggers = None
+			return lambda : None
+		def counting_react(trigger):
+			self.triggers[type(trigger).__name__] += 1
+			return react(trigger)
+		scheduler._react = counting_react
+		return lambda : delattr(scheduler,"_react")
+
+	def __enter__(self):
+		self.restore = self.count_triggers()
+		self.profile = cProfile.Profile()
+		self.wall = time.perf_counter()
+		self.sim = sim_time()
+		self.profile.enable()
+		return self
+
+	def __exit__(self,*exc):
+		self.profile.disable()
+		self.wall = time.perf_counter() - self.wall
+		self.sim = sim_time() - self.sim
+		self.restore()
+		self.report()
+		return False
+
+	def report(self):
+		toplevel = cocotb.top._name
+		os.makedirs(profile_dir,exist_ok=True)
+		self.profile.dump_stats(os.path.join(profile_dir,"{}.{}.prof".format(self.name,toplevel)))
+
+		by_module = self_time_by_module(pstats.Stats(self.profile))
+		top = ", ".join("{} {:.2f}s".format(m,t) for (m,t) in by_module.most_common(3))
+		row = (self.name,toplevel,"{:.2f}".format(self.wall),"{:.1f}".format(self.sim),
+			"{:.1f}".format(self.sim / self.wall if self.wall else 0),
+			"n/a" if self.triggers is None else str(sum(self.triggers.values())),top)
+
+		summary = os.path.join(profile_dir,"summary.txt")
+		new = not os.path.exists(summary)
+		with open(summary,"a") as f:
+			if(new):
+				f.write(format_row(c for (c,w) in columns) + "\n")
+			f.write(format_row(row) + "\n")
+		cocotb.log.info("profile {} : {:.2f} s wall, {:.1f} us sim, triggers (approximate) {}".format(
+			self.name,self.wall,self.sim,"n/a" if self.triggers is None else dict(self.triggers.most_common())))
+
+
+def format_row(cells):
+	return " ".join(cell.ljust(width) for (cell,(c,width)) in zip(cells,columns)).rstrip()
+
+
+def profiled(test):
+	"""Profile a cocotb test function, or the run phase of a pyuvm test class, when FLASH_PROFILE=1"""
+	if(not enabled):
+		return test
+
+	if(inspect.isclass(test)):
+		name = "{}.{}".format(test.__module__,test.__name__)
+		run_phase = test.run_phase
+
+		@functools.wraps(run_phase)
+		async def profiled_run_phase(self):
+			with TestProfile(name):
+				await run_phase(self)
+
+		test.run_phase = profiled_run_phase
+		return test
+
+	name = "{}.{}".format(test.__module__,test.__name__)
+
+	@functools.wraps(test)
+	async def profiled_test(dut):
+		with TestProfile(name):
+			await test(dut)
+
+	return profiled_test
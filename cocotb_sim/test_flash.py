@@ -1,10 +1,9 @@
-from cocotb_test.simulator import run
+from ghdl_cache import CachedGhdl
 from cocotb.binary import BinaryValue
 import pytest
 import os
 
 vhdl_compile_args = "--std=08"
-sim_args = "--wave=wave.ghw"
 
 
 tests_dir = os.path.abspath(os.path.dirname(__file__)) #gives the path to the test(current) directory in which this test.py file is placed
@@ -32,7 +31,9 @@ def test_flash(g_freq_read,g_freq_rest):
     parameter['g_freq_rest'] = g_freq_rest
 
 
-    run(
+    # analysed once per content hash of the sources and flags, the runs only differ by generics
+    CachedGhdl(
+        cache_root="sim_build/ghdl_cache",
         python_search=[tests_dir],                         #where to search for all the python test files
         vhdl_sources=vhdl_sources,
         toplevel=toplevel,
@@ -44,5 +45,5 @@ def test_flash(g_freq_read,g_freq_rest):
         extra_env=parameter,
         sim_build="sim_build/"
         + "_".join(("{}={}".format(*i) for i in parameter.items())),
-    )
+    ).run()
 
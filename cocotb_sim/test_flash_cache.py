@@ -0,0 +1,82 @@
+from flash_model import FlashRefModel
+from flash_tlm import TlmFlashHost
+from flash_cache import PageCache
+import random
+import pytest
+
+# the page cache of the host reads, on the transaction level host : reads through the
+# cache must always match the flash, whatever was programmed or erased in between
+
+
+def new_host(toplevel, budget):
+    host = TlmFlashHost.for_toplevel(toplevel)
+    host.enable_cache(budget)
+    return host
+
+
+def test_lru_budget():
+    cache = PageCache(16, 64, 3 * 16)
+    for index in range(3):
+        cache.put(index, bytes(16))
+    assert cache.get(0) is not None    # 0 becomes the most recently used
+    cache.put(3, bytes(16))
+    assert list(cache.pages) == [2, 0, 3]
+    assert cache.evictions == 1
+    assert cache.get(1) is None
+    cache.invalidate(20, 30)           # pages 1 to 3
+    assert list(cache.pages) == [0]
+    assert (cache.hits, cache.misses, cache.invalidations) == (1, 1, 2)
+
+
+@pytest.mark.parametrize("toplevel", ["top", "flash_top"])
+@pytest.mark.parametrize("budget_pages", [2, 64])
+async def test_cache_matches_flash(toplevel, budget_pages):
+    rng = random.Random(5)
+    page = FlashRefModel.for_toplevel(toplevel).page_size
+    host = new_host(toplevel, budget_pages * page)
+    flash = host.flash
+    size = flash.mem_size
+    for i in range(1000):
+        op = rng.random()
+        addr = rng.randrange(size)
+        if op < 0.8:
+            n = rng.randint(1, 3 * page)
+            if op < 0.5:
+                # hot region at the start of the memory
+                addr = rng.randrange(2 * page)
+            rx = await host.read(addr, n) if op < 0.7 else await host.fast_read(addr, n)
+            assert rx == flash.read(addr, n)
+        elif op < 0.9:
+            await host.write_enable()
+            await host.page_program(addr, rng.randbytes(rng.randint(1, 8)))
+        elif op < 0.97:
+            await host.write_enable()
+            await host.sector_erase(addr)
+        elif op < 0.99:
+            await host.write_enable()
+            await host.write_status(0)
+        else:
+            await host.write_enable()
+            await host.bulk_erase()
+    stats = host.cache.stats()
+    assert stats["hits"] > 0 and stats["misses"] > 0
+    assert stats["bytes"] <= budget_pages * page
+    if budget_pages * page < size:
+        assert stats["evictions"] > 0
+
+
+async def test_invalidation_is_precise():
+    host = new_host("top", 4096)
+    page = host.model.page_size
+    sector = host.model.sector_size
+    await host.read(0, 2 * sector)
+    cached = len(host.cache)
+    await host.write_enable()
+    await host.page_program(page + 3, b"\x00")
+    assert len(host.cache) == cached - 1
+    await host.write_enable()
+    await host.sector_erase(sector + 5)
+    assert len(host.cache) == cached - 1 - sector // page
+    misses = host.cache.misses
+    assert await host.read(0, page) == host.flash.read(0, page)
+    assert host.cache.misses == misses
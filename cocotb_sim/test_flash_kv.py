@@ -0,0 +1,98 @@
+from flash_kv import LogStore, StoreFull, parse_sector, SECTOR_HEADER
+from flash_tlm import TlmFlashHost
+import random
+import pytest
+
+# the log-structured store on the transaction level host, checked against a dict : through
+# updates, deletes, garbage collection and a remount from the flash content alone
+
+
+async def check(store, expected):
+    assert set(store.keys()) == set(expected)
+    for (key, value) in expected.items():
+        assert await store.get(key) == value
+
+
+@pytest.mark.parametrize("toplevel", ["top", "flash_top"])
+async def test_store_matches_dict(toplevel):
+    rng = random.Random(5)
+    store = LogStore(TlmFlashHost.for_toplevel(toplevel))
+    keys = [b"k%d" % i for i in range(12)]
+    expected = {}
+    await store.format()
+    for i in range(600):
+        op = rng.random()
+        key = rng.choice(keys)
+        if op < 0.6:
+            value = rng.randbytes(rng.randint(0, 6))
+            await store.put(key, value)
+            expected[key] = value
+        elif op < 0.7:
+            assert await store.delete(key) == (key in expected)
+            expected.pop(key, None)
+        else:
+            assert await store.get(key) == expected.get(key)
+    await check(store, expected)
+    await store.sync()
+    # a new store over the same flash : the index comes back from the log
+    mounted = LogStore(store.host)
+    await mounted.mount()
+    await check(mounted, expected)
+    # and keeps going from where the log ended
+    await mounted.put(b"new", b"value")
+    expected[b"new"] = b"value"
+    await check(mounted, expected)
+    # far more bytes appended than the flash holds : the collection kept up
+    assert store.stats["bytes_appended"] > store.mem_size
+    assert store.stats["collections"] > 0
+
+
+async def test_collection_erases_whole_sectors():
+    store = LogStore(TlmFlashHost.for_toplevel("top"))
+    await store.format()
+    for i in range(200):
+        await store.put(b"hot", bytes([i & 0xFF]) * 8)
+    await store.put(b"cold", b"c" * 8)
+    for i in range(200):
+        await store.put(b"hot", bytes([i & 0xFF]) * 8)
+    await store.sync()
+    flash = store.host.flash
+    # every sector is either erased or a log sector, and the live records survived
+    for sector in range(store.sectors):
+        data = flash.read(sector * store.sector_size, store.sector_size)
+        assert data[0] in (0xFF, 0x5A)
+        if data[0] == 0xFF:
+            assert data == bytes([0xFF]) * store.sector_size
+    assert store.stats["erases"] == store.stats["collections"]
+    # the cold record was moved out of the collected sectors, not lost
+    records = [record for sector in range(store.sectors) if store.seq[sector] is not None
+               for record in parse_sector(flash.read(sector * store.sector_size, store.sector_size))]
+    assert [value for (_, _, key, value) in records if key == b"cold"] == [b"c" * 8]
+
+
+async def test_deleted_key_stays_deleted_after_remount():
+    store = LogStore(TlmFlashHost.for_toplevel("top"))
+    await store.format()
+    await store.put(b"gone", b"x" * 8)
+    await store.delete(b"gone")
+    # push the put out of its sector's lifetime, the delete record must outlive it
+    for i in range(300):
+        await store.put(b"k%d" % (i % 3), bytes([i & 0xFF]) * 8)
+    await store.sync()
+    mounted = LogStore(store.host)
+    await mounted.mount()
+    assert b"gone" not in mounted
+    assert await mounted.get(b"gone") is None
+
+
+async def test_store_full():
+    store = LogStore(TlmFlashHost.for_toplevel("flash_top"))
+    await store.format()
+    with pytest.raises(StoreFull):
+        for i in range(1000):
+            await store.put(b"%04d" % i, b"v" * 8)
+    # what fitted is still there
+    assert len(store) > 0
+    for key in list(store.keys())[:4]:
+        assert await store.get(key) == b"v" * 8
+    assert store.used[0] + 4 + 4 + 8 > store.sector_size - SECTOR_HEADER.size
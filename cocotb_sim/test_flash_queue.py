@@ -0,0 +1,130 @@
+from flash_model import FlashRefModel
+from flash_tlm import TlmFlashHost
+from flash_queue import CommandQueue
+from flash_sched import URGENT, READ, ERASE
+import cocotb
+import random
+import pytest
+
+# the choices of the command queue worker (hazards, priorities, coalescing) on pending
+# requests, then the worker itself with concurrent producers on the scheduler of flash_tlm
+# (no simulator), the testbench (test_command_queue) runs it on the RTL
+
+
+def test_reads_overtake_writes():
+    queue = CommandQueue(TlmFlashHost.for_toplevel("top"))
+    queue.push("program", 0x40, 16, bytes(16))
+    read = queue.push("read", 0x100, 8)
+    assert queue.blocker(read) is None
+    assert queue.pick() is read
+
+
+def test_read_after_write():
+    queue = CommandQueue(TlmFlashHost.for_toplevel("top"))
+    program = queue.push("program", 0x40, 16, bytes(16))
+    read = queue.push("read", 0x48, 8)
+    assert queue.blocker(read) is program
+    assert queue.pick() is program
+    assert queue.stats["raw_blocked"] == 1
+
+
+def test_writes_keep_their_order():
+    queue = CommandQueue(TlmFlashHost.for_toplevel("top"))
+    read = queue.push("read", 0x0, 8)
+    erase = queue.push("erase", 0x0, 64)
+    program = queue.push("program", 0x80, 4, bytes(4), priority=URGENT)
+    # write after read, and the program stays behind the erase whatever its priority
+    assert queue.blocker(erase) is read
+    assert queue.blocker(program) is erase
+    assert queue.pick() is read
+
+
+def test_priority_inheritance():
+    queue = CommandQueue(TlmFlashHost.for_toplevel("top"))
+    erase = queue.push("erase", 0x0, 64)
+    for i in range(3):
+        queue.push("read", 0x100 + 8 * i, 8, priority=READ)
+    queue.push("read", 0x10, 4, priority=URGENT)
+    # the erase holds back the urgent read, it goes before the other reads
+    assert queue.pick() is erase
+    assert queue.stats["promoted"] == 1
+
+
+def test_coalesce_adjacent_reads():
+    queue = CommandQueue(TlmFlashHost.for_toplevel("top"), max_read=24)
+    first = queue.push("read", 0x10, 8)
+    queue.push("program", 0x20, 4, bytes(4))
+    overlapping = queue.push("read", 0x14, 8)
+    adjacent = queue.push("read", 0x1C, 4)
+    # behind the program, and beyond it
+    queue.push("read", 0x20, 4)
+    queue.push("read", 0x80, 4)
+    (group, lo, hi) = queue.coalesce(first)
+    assert group == [first, overlapping, adjacent]
+    assert (lo, hi) == (0x10, 0x20)
+    # within max_read only
+    queue = CommandQueue(TlmFlashHost.for_toplevel("top"), max_read=12)
+    first = queue.push("read", 0x10, 8)
+    queue.push("read", 0x18, 8)
+    assert queue.coalesce(first) == ([first], 0x10, 0x18)
+
+
+@pytest.mark.tlm_scheduler
+async def test_queue_matches_model():
+    # a writer (programs, a sector erase every 5th batch) and two readers (bursts of adjacent
+    # reads) on the same 128 bytes : every read sees the programs and erases submitted
+    # before it and none submitted after, whatever the order the worker ran them in
+    rng = random.Random(7)
+    queue = CommandQueue(TlmFlashHost.for_toplevel("top"))
+    shadow = FlashRefModel.for_toplevel("top")
+    (page_size, sector_size) = (shadow.page_size, shadow.sector_size)
+
+    def push_program():
+        offset = rng.randrange(page_size)
+        addr = rng.randrange(128 // page_size) * page_size + offset
+        data = rng.randbytes(rng.randint(1, page_size - offset))
+        shadow.write_enable()
+        shadow.page_program(addr, data)
+        return queue.push("program", addr, len(data), data)
+
+    def push_erase():
+        base = rng.randrange(128 // sector_size) * sector_size
+        shadow.write_enable()
+        shadow.sector_erase(base)
+        return queue.push("erase", base, sector_size)
+
+    async def writer():
+        for i in range(40):
+            batch = [push_erase() if i % 5 == 4 and j == 0 else push_program() for j in range(3)]
+            for req in batch:
+                await queue.wait(req)
+
+    async def reader(burst):
+        for i in range(40):
+            addr = rng.randrange(128 - 4 * burst)
+            reads = [(queue.push("read", addr + 4 * j, 4), shadow.read(addr + 4 * j, 4)) for j in range(burst)]
+            for (req, expected) in reads:
+                assert await queue.wait(req) == expected
+
+    queue.start()
+    producers = [cocotb.start_soon(writer()), cocotb.start_soon(reader(2)), cocotb.start_soon(reader(4))]
+    for producer in producers:
+        await producer
+    # read after write, at a higher priority than the write
+    data = rng.randbytes(8)
+    shadow.write_enable()
+    shadow.sector_erase(0x200)
+    shadow.write_enable()
+    shadow.page_program(0x200, data)
+    queue.push("erase", 0x200, sector_size)
+    write = queue.push("program", 0x200, len(data), data, priority=ERASE)
+    assert await queue.read(0x200, len(data), priority=URGENT) == data
+    await queue.wait(write)
+    queue.stop()
+    assert queue.host.flash.read(0, 0x240) == shadow.read(0, 0x240)
+    assert not queue.pending
+    for key in ("coalesced", "raw_blocked", "reordered", "promoted"):
+        assert queue.stats[key] > 0, key
+    summary = queue.summary()
+    assert summary["read"]["requests"] == 40 * 6 + 1
+    assert summary["program"]["wait"]["count"] > 0
@@ -0,0 +1,101 @@
+from flash_tlm import TlmFlashHost
+from flash_sched import EraseAhead, OpQueue, URGENT, READ, PROGRAM, ERASE
+from cocotb.triggers import NullTrigger
+import pytest
+
+# the priority queue of the erase-ahead worker, then the worker on the scheduler of
+# flash_tlm (no simulator, no time : an idle wait lasts until the other ready coroutines
+# ran), the testbench (test_erase_ahead) runs it on the RTL
+
+
+async def settle(sched):
+    # let the worker get through its queue
+    for i in range(20):
+        if not sched.queue and not sched.busy:
+            return
+        await NullTrigger()
+    raise AssertionError("the worker is stuck")
+
+
+def test_queue_order():
+    queue = OpQueue()
+    for (priority, op) in [(ERASE, "e1"), (PROGRAM, "p1"), (READ, "r1"), (ERASE, "e2"),
+                           (READ, "r2"), (URGENT, "u"), (PROGRAM, "p2")]:
+        queue.push(priority, op)
+    assert queue.priority() == URGENT
+    order = [queue.pop() for i in range(len(queue))]
+    # by priority, first in first out within one
+    assert order == ["u", "r1", "r2", "p1", "p2", "e1", "e2"]
+    assert queue.priority() is None and not queue
+
+
+def test_queue_promotion():
+    # an erase queued again at a higher priority is served with that one, its first
+    # entry comes out last
+    queue = OpQueue()
+    queue.push(ERASE, ("erase", 3))
+    queue.push(PROGRAM, "p")
+    queue.push(URGENT, ("erase", 3))
+    assert [queue.pop() for i in range(3)] == [("erase", 3), "p", ("erase", 3)]
+
+
+@pytest.mark.tlm_scheduler
+async def test_allocate_erases_on_demand():
+    sched = EraseAhead(TlmFlashHost.for_toplevel("top"), sectors=[3, 5], ahead=False)
+    size = sched.sector_size
+    sched.start()
+    assert [await sched.allocate(), await sched.allocate()] == [3, 5]
+    await sched.program(3 * size, b"\x00" * size)
+    with pytest.raises(RuntimeError):
+        await sched.allocate()
+    # released, nothing erases it ahead : allocate does, ahead of everything else
+    sched.release(3)
+    assert not sched.queue
+    assert await sched.allocate() == 3
+    assert await sched.read(3 * size, size) == b"\xff" * size
+    sched.stop()
+    assert sched.stats == dict(background_erases=0, foreground_erases=1, promoted=0, held_back=0)
+    assert len(sched.latency["allocate"]) == 3
+
+
+@pytest.mark.tlm_scheduler
+async def test_erase_ahead_and_low_water():
+    sched = EraseAhead(TlmFlashHost.for_toplevel("top"), sectors=range(4), low_water=2)
+    size = sched.sector_size
+    sched.start()
+    placed = [await sched.allocate() for i in range(3)]
+    for sector in placed:
+        await sched.program(sector * size, b"\x00" * 4)
+    # one erased sector left, below low_water : the erase goes with the programs
+    sched.release(placed[0])
+    assert sched.queue.priority() == PROGRAM
+    await settle(sched)
+    # back at low_water : a background erase
+    sched.release(placed[1])
+    assert sched.queue.priority() == ERASE
+    await settle(sched)
+    assert sorted(sched.erased) == [placed[0], placed[1], 3]
+    for sector in sched.erased:
+        assert await sched.read(sector * size, size) == b"\xff" * size
+    sched.stop()
+    assert sched.stats == dict(background_erases=2, foreground_erases=0, promoted=1, held_back=0)
+
+
+@pytest.mark.tlm_scheduler
+async def test_idle_hold_back():
+    sched = EraseAhead(TlmFlashHost.for_toplevel("top"), sectors=[0, 1], low_water=0, idle_ns=1000)
+    size = sched.sector_size
+    sched.start()
+    placed = [await sched.allocate() for i in range(2)]
+    await sched.program(placed[0] * size, b"\x00" * 4)
+    sched.release(placed[0])
+    # the worker holds the erase back, a read submitted meanwhile ends the wait and
+    # runs first
+    await NullTrigger()
+    assert await sched.read(placed[0] * size, 4) == b"\x00" * 4
+    assert sched.stats["held_back"] == 1
+    assert sched.stats["background_erases"] == 0
+    await settle(sched)
+    assert list(sched.erased) == [placed[0]]
+    sched.stop()
+    assert sched.stats["background_erases"] == 1
@@ -0,0 +1,65 @@
+from flash_model import FlashRefModel
+from flash_storage import DenseMemory, SparseMemory
+import random
+import pytest
+
+# the sparse storage must behave exactly like the dense one, on the reference model commands
+
+
+M25P16_GEOMETRY = (2*1024*1024, 256, 65536)
+
+
+def models(geometry, and_program):
+    return [FlashRefModel(geometry, and_program=and_program, storage=storage)
+            for storage in (DenseMemory, SparseMemory)]
+
+
+@pytest.mark.parametrize("and_program", [False, True])
+@pytest.mark.parametrize("geometry", [(1024, 16, 64), M25P16_GEOMETRY])
+def test_sparse_matches_dense(geometry, and_program):
+    rng = random.Random(1)
+    (size, page, sector) = geometry
+    (dense, sparse) = models(geometry, and_program)
+    # keep the traffic in a few sectors so that the erases hit written pages
+    hot = [rng.randrange(0, size, sector) for i in range(4)]
+    for i in range(2000):
+        addr = rng.choice(hot) + rng.randrange(sector + page)
+        op = rng.random()
+        for model in (dense, sparse):
+            model.write_enable()
+        if op < 0.5:
+            data = rng.randbytes(rng.randint(1, 2 * page))
+            for model in (dense, sparse):
+                model.page_program(addr, data)
+        elif op < 0.55:
+            for model in (dense, sparse):
+                model.sector_erase(addr)
+        elif op < 0.56:
+            for model in (dense, sparse):
+                model.bulk_erase()
+        n = rng.randint(1, 3 * page)
+        assert dense.read(addr, n) == sparse.read(addr, n)
+    assert dense.read(size - 5, 10) == sparse.read(size - 5, 10)
+    assert bytes(dense.mem) == bytes(sparse.mem)
+
+
+def test_sparse_footprint():
+    (size, page, sector) = M25P16_GEOMETRY
+    model = FlashRefModel(M25P16_GEOMETRY, storage=SparseMemory)
+    for addr in (0, 5 * page + 3, sector + 1):
+        model.write_enable()
+        model.page_program(addr, b"\x00" * 4)
+    assert len(model.mem.pages) == 3
+    # a read inside a page is a view of it, not a copy
+    view = model.view(5 * page, 8)
+    assert view.obj is model.mem.pages[5] and bytes(view) == b"\xff\xff\xff\x00\x00\x00\x00\xff"
+    model.write_enable()
+    model.sector_erase(0)
+    assert sorted(model.mem.pages) == [sector // page]
+    # erases that do not cover whole pages clear the bytes in place
+    model.mem.erase(sector + 2, 1)
+    assert model.read(sector, 6) == b"\xff\x00\xff\x00\x00\xff"
+    model.write_enable()
+    model.bulk_erase()
+    assert model.mem.pages == {}
+    assert model.read(0, 4) == b"\xff" * 4
@@ -0,0 +1,64 @@
+from flash_tlm import TlmFlashHost
+from flash_wear import WearLeveler
+import random
+import pytest
+
+# the wear leveler on the transaction level host : the logical content must follow a plain
+# reference through the remaps and migrations, and a skewed workload must wear the physical
+# sectors evenly
+
+
+async def skewed(wear, rng, ops, expected):
+    # 90% of the rewrites hit the first two logical sectors, the rest keep their data
+    size = wear.sector_size
+    for i in range(ops):
+        sector = rng.randrange(2) if rng.random() < 0.9 else rng.randrange(wear.sectors)
+        data = rng.randbytes(rng.randint(1, size))
+        await wear.erase(sector * size)
+        await wear.write(sector * size, data)
+        expected[sector * size:(sector + 1) * size] = data + bytes([0xFF]) * (size - len(data))
+
+
+@pytest.mark.parametrize("threshold", [None, 2, 8])
+async def test_logical_content_survives_remaps(threshold):
+    rng = random.Random(22)
+    wear = WearLeveler(TlmFlashHost.for_toplevel("top"), threshold=threshold)
+    expected = bytearray([0xFF]) * wear.size
+    await wear.format()
+    await skewed(wear, rng, 300, expected)
+    assert await wear.read(0, wear.size) == bytes(expected)
+    # every logical sector on its own physical sector
+    assert sorted(wear.remap) == sorted(p for p in range(wear.physical) if wear.owner[p] != 0xFFFF)
+    if threshold is not None:
+        assert wear.spread() <= threshold + 1
+        assert wear.stats["migrations"] > 0
+
+
+async def test_migration_evens_the_wear():
+    rotated = WearLeveler(TlmFlashHost.for_toplevel("top"), threshold=None)
+    leveled = WearLeveler(TlmFlashHost.for_toplevel("top"), threshold=4)
+    for wear in (rotated, leveled):
+        await wear.format()
+        await skewed(wear, random.Random(7), 400, bytearray(wear.size))
+    # the free sectors alone rotate the hot data among a few sectors, the migration of the
+    # cold data spreads it over all of them
+    assert rotated.spread() > 4 * leveled.spread()
+    assert max(leveled.erases) < max(rotated.erases) // 2
+    assert leveled.stats["migration_erases"] == leveled.stats["migrations"]
+    assert leveled.stats["bytes_migrated"] > 0
+
+
+def test_single_sector_flash():
+    with pytest.raises(ValueError):
+        WearLeveler(TlmFlashHost.for_toplevel("flash_top"))
+
+
+async def test_single_logical_sector():
+    # 2 physical sectors and a spare : nothing but the hot sector to migrate, it alternates
+    wear = WearLeveler(TlmFlashHost.for_toplevel("top"), geometry=(128, 16, 64), threshold=0)
+    await wear.format()
+    for i in range(5):
+        await wear.erase(0)
+        await wear.write(0, bytes([i]) * 8)
+    assert await wear.read(0, 8) == bytes([4]) * 8
+    assert list(wear.erases) == [4, 3] and wear.stats["migrations"] == 0
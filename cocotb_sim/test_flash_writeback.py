@@ -0,0 +1,87 @@
+from flash_model import FlashRefModel
+from flash_tlm import TlmFlashHost
+from flash_writeback import DirtyPage, WriteBuffer
+import random
+import pytest
+
+# the write buffer on the transaction level host : whatever gets buffered, merged or
+# dropped, the flash must end up as if every write had been programmed on its own
+
+
+def direct_write(model, addr, data):
+    # a write without the buffer : one page program per page it touches
+    pos = 0
+    while pos < len(data):
+        n = min(len(data) - pos, model.page_size - (addr + pos) % model.page_size)
+        model.write_enable()
+        model.page_program(addr + pos, data[pos:pos + n])
+        pos += n
+
+
+def test_dirty_page_merge():
+    page = DirtyPage(16, 0)
+    assert page.write(2, b"ab") == 0
+    assert page.write(6, b"cd") == 0
+    assert page.ranges == [(2, 4), (6, 8)]
+    # adjacent to the first range, overlapping the second
+    assert page.write(4, b"xyz") == 1
+    assert page.ranges == [(2, 8)]
+    assert bytes(page.data[2:8]) == b"abxyzd"
+    assert len(page) == 6 and not page.full()
+    page.write(0, bytes(16))
+    assert page.full()
+
+
+@pytest.mark.parametrize("toplevel", ["top", "flash_top"])
+@pytest.mark.parametrize("max_bytes", [None, 40])
+async def test_write_buffer_matches_model(toplevel, max_bytes):
+    rng = random.Random(3)
+    host = TlmFlashHost.for_toplevel(toplevel)
+    expected = FlashRefModel.for_toplevel(toplevel)
+    size = expected.mem_size
+    buf = WriteBuffer(host, max_bytes=max_bytes)
+    cursor = 0
+    for i in range(500):
+        op = rng.random()
+        if op < 0.85:
+            # small records, mostly appended, sometimes rewritten anywhere
+            data = rng.randbytes(rng.randint(1, 8))
+            if op < 0.7:
+                addr = cursor
+                cursor = (cursor + len(data)) % (size - 8)
+            else:
+                addr = rng.randrange(size - 8)
+            await buf.write(addr, data)
+            direct_write(expected, addr, data)
+        elif op < 0.95:
+            addr = rng.randrange(size - 32)
+            assert await buf.read(addr, 32) == expected.read(addr, 32)
+        elif op < 0.98:
+            await buf.flush()
+        else:
+            addr = rng.randrange(size)
+            await buf.sector_erase(addr)
+            expected.write_enable()
+            expected.sector_erase(addr)
+    await buf.flush()
+    assert not buf.pages
+    assert host.flash.read(0, size) == expected.read(0, size)
+    stats = buf.stats
+    assert stats["programs"] < stats["writes"]
+    assert stats["commands_saved"] > 0
+    if max_bytes is not None:
+        assert buf.buffered <= max_bytes
+
+
+async def test_write_buffer_full_page():
+    host = TlmFlashHost.for_toplevel("top")
+    buf = WriteBuffer(host)
+    page = host.model.page_size
+    # records back to back : the page goes out as one program once it is complete
+    for i in range(0, page, 4):
+        await buf.write(page + i, bytes([i]) * 4)
+    assert not buf.pages
+    await buf.write(3 * page, b"\x11")
+    assert buf.stats["programs"] == 1 and buf.stats["flushes"] == 1
+    assert buf.stats["commands_saved"] == page // 4
+    assert list(buf.pages) == [3 * page]
@@ -0,0 +1,54 @@
+from ghdl_cache import CachedGhdl
+import pytest
+import json
+import os
+
+# Key-value store benchmark : bench_kv.py on both flash models, the log-structured store
+# against in-place updates. Each run writes its numbers to sim_build/kv/<toplevel>.json.
+#
+#   pytest -s cocotb_sim/test_kv_bench.py  (KV_BENCH_OPS : puts and gets per store, default 96)
+
+vhdl_compile_args = "--std=08"
+
+tests_dir = os.path.abspath(os.path.dirname(__file__))
+rtl_dir = tests_dir
+
+results_dir = os.path.join(tests_dir, "sim_build", "kv")
+
+common_sources = ["flash_controller_pkg.vhd", "sclk_gen.vhd", "spi_flash_controller.vhd"]
+toplevel_sources = {
+    "flash_top": ["wb_regs.vhd", "serial_flash_sim_model.vhd", "flash_top.vhd"],
+    "top": ["wb_regs.vhd", "m25p80_sim_model.vhd", "top.vhd"],
+}
+
+
+@pytest.mark.parametrize("toplevel", list(toplevel_sources))
+def test_kv_bench(toplevel):
+
+    vhdl_sources = [os.path.join(rtl_dir, "../rtl", f) for f in common_sources + toplevel_sources[toplevel]]
+
+    os.makedirs(results_dir, exist_ok=True)
+    json_path = os.path.join(results_dir, toplevel + ".json")
+    if os.path.exists(json_path):
+        os.remove(json_path)
+
+    CachedGhdl(
+        cache_root="sim_build/ghdl_cache",
+        python_search=[tests_dir],
+        vhdl_sources=vhdl_sources,
+        toplevel=toplevel,
+        module="bench_kv",
+
+        vhdl_compile_args=[vhdl_compile_args],
+        toplevel_lang="vhdl",
+        extra_env=dict(KV_BENCH_JSON=json_path),
+        sim_build="sim_build/kv_" + toplevel,
+    ).run()
+
+    with open(json_path) as f:
+        results = json.load(f)["results"]
+
+    for (name, stats) in results.items():
+        print("{} {}: {:.0f} puts/s, {:.0f} gets/s".format(toplevel, name, stats["puts_per_s"], stats["gets_per_s"]))
+    # appending beats a read, erase and reprogram of the sector per update
+    assert results["log"]["puts_per_s"] > results["in_place"]["puts_per_s"]
@@ -0,0 +1,150 @@
+from ghdl_cache import CachedGhdl
+import pytest
+import fcntl
+import json
+import os
+
+# SPI throughput regression : bench_throughput.py runs on every toplevel for a matrix of
+# generics, each run writes its numbers to sim_build/throughput/<run>.json and is compared
+# with throughput_baseline.json. A run fails when bytes/s drops, or the command overhead
+# or chip-select idle time grows, by more than THROUGHPUT_TOLERANCE (relative, default 5%).
+# THROUGHPUT_UPDATE_BASELINE=1 stores the measured numbers as the new baseline instead, a run
+# with no baseline recorded fails.
+#
+#   pytest -n auto test_throughput.py
+
+vhdl_compile_args = "--std=08"
+
+tests_dir = os.path.abspath(os.path.dirname(__file__))
+rtl_dir = tests_dir
+
+baseline_path = os.path.join(tests_dir, "throughput_baseline.json")
+results_dir = os.path.join(tests_dir, "sim_build", "throughput")
+tolerance = float(os.environ.get("THROUGHPUT_TOLERANCE", "0.05"))
+
+common_sources = ["flash_controller_pkg.vhd", "sclk_gen.vhd", "spi_flash_controller.vhd"]
+toplevel_sources = {
+    "flash_top": ["wb_regs.vhd", "serial_flash_sim_model.vhd", "flash_top.vhd"],
+    "flash_top_axi": ["axil_regs.vhd", "serial_flash_sim_model.vhd", "flash_top_axi.vhd"],
+    "top": ["wb_regs.vhd", "m25p80_sim_model.vhd", "top.vhd"],
+    "top_axi": ["axil_regs.vhd", "m25p80_sim_model.vhd", "top_axi.vhd"],
+}
+
+# (g_freq_read, g_freq_rest, g_sys_clk), sclk must stay at or below a quarter of the system clock
+generics = [
+    (25*10**6, 50*10**6, 200*10**6),
+    (20*10**6, 25*10**6, 200*10**6),
+    (20*10**6, 25*10**6, 100*10**6),
+]
+
+# metrics where higher is better, the others must not grow
+higher_is_better = {"bytes_per_s"}
+checked = ("bytes_per_s", "overhead_cycles", "cs_idle_ns")
+
+
+def run_key(toplevel, parameter):
+    return "_".join([toplevel] + ["{}={}".format(*i) for i in parameter.items()])
+
+
+def regressions(measured, baseline, tolerance):
+    """List the metrics of measured that are worse than baseline by more than tolerance"""
+    found = []
+    for op, stats in baseline.items():
+        for metric in checked:
+            if op not in measured or metric not in stats:
+                continue
+            (new, old) = (measured[op][metric], stats[metric])
+            if metric in higher_is_better:
+                worse = new < old * (1 - tolerance)
+            else:
+                worse = new > old * (1 + tolerance) and new - old > 1
+            if worse:
+                found.append("{} {}: {:.1f} (baseline {:.1f})".format(op, metric, new, old))
+    return found
+
+
+def update_baseline(key, measured):
+    # xdist workers update the shared file one at a time
+    with open(baseline_path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        baseline = {}
+        if os.path.exists(baseline_path):
+            with open(baseline_path) as f:
+                baseline = json.load(f)
+        baseline[key] = measured
+        with open(baseline_path, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+
+
+def test_regressions():
+    # synthetic numbers, no simulator : the comparison itself
+    baseline = {
+        "read": {"bytes_per_s": 1000.0, "overhead_cycles": 40, "cs_idle_ns": 100.0},
+        "page_program": {"bytes_per_s": 500.0, "overhead_cycles": 60, "cs_idle_ns": 0.5},
+    }
+    same = {op: dict(stats) for (op, stats) in baseline.items()}
+    assert regressions(same, baseline, 0.05) == []
+    # within the tolerance, better, or grown by 1 or less : not a regression
+    measured = {
+        "read": {"bytes_per_s": 960.0, "overhead_cycles": 30, "cs_idle_ns": 104.0},
+        "page_program": {"bytes_per_s": 900.0, "overhead_cycles": 60, "cs_idle_ns": 1.5},
+    }
+    assert regressions(measured, baseline, 0.05) == []
+    measured["read"]["bytes_per_s"] = 940.0
+    measured["read"]["cs_idle_ns"] = 110.0
+    measured["page_program"]["overhead_cycles"] = 70
+    found = regressions(measured, baseline, 0.05)
+    assert [line.split(":")[0] for line in found] == [
+        "read bytes_per_s", "read cs_idle_ns", "page_program overhead_cycles"]
+    # a looser tolerance lets them through, an operation missing from the run is not checked
+    assert regressions(measured, baseline, 0.2) == []
+    assert regressions({"read": measured["read"]}, baseline, 0.05) == found[:2]
+
+
+@pytest.mark.parametrize("toplevel", list(toplevel_sources))
+@pytest.mark.parametrize("g_freq_read,g_freq_rest,g_sys_clk", generics)
+def test_throughput(toplevel, g_freq_read, g_freq_rest, g_sys_clk):
+
+    vhdl_sources = [os.path.join(rtl_dir, "../rtl", f) for f in common_sources + toplevel_sources[toplevel]]
+
+    parameter = {}
+    parameter['g_freq_read'] = str(g_freq_read)
+    parameter['g_freq_rest'] = str(g_freq_rest)
+    parameter['g_sys_clk'] = str(g_sys_clk)
+
+    key = run_key(toplevel, parameter)
+    os.makedirs(results_dir, exist_ok=True)
+    json_path = os.path.join(results_dir, key + ".json")
+    if os.path.exists(json_path):
+        os.remove(json_path)
+
+    CachedGhdl(
+        cache_root="sim_build/ghdl_cache",
+        python_search=[tests_dir],
+        vhdl_sources=vhdl_sources,
+        toplevel=toplevel,
+        module="bench_throughput",
+
+        vhdl_compile_args=[vhdl_compile_args],
+        toplevel_lang="vhdl",
+        parameters=parameter,
+        extra_env=dict(parameter, THROUGHPUT_JSON=json_path),
+        sim_build="sim_build/throughput_" + key,
+    ).run()
+
+    with open(json_path) as f:
+        measured = json.load(f)["results"]
+
+    if os.environ.get("THROUGHPUT_UPDATE_BASELINE") == "1":
+        update_baseline(key, measured)
+        return
+
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+    # a run without a baseline would pass unchecked
+    assert key in baseline, "no baseline for {}, run with THROUGHPUT_UPDATE_BASELINE=1 to record one".format(key)
+
+    found = regressions(measured, baseline[key], tolerance)
+    assert not found, "throughput regression on {} :\n".format(key) + "\n".join(found)
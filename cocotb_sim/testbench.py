@@ -1,14 +1,27 @@
 import cocotb
 from cocotb.clock import Clock
-from cocotb.triggers import Timer,RisingEdge,FallingEdge,ClockCycles,ReadWrite
+from cocotb.triggers import Timer,RisingEdge,FallingEdge,ReadWrite
 from cocotb.result import TestFailure
 import random
 from cocotb_coverage.coverage import CoverPoint,coverage_db
 from cocotb.binary import BinaryValue
+from cocotb.utils import get_sim_time
+from flash_host import FlashHost,F_RD_DATA
+from flash_model import FlashRefModel,geometry_of
+from coverage_closure import UncoveredBins
+from sim_profile import profiled
+from flash_backdoor import FlashBackdoor
+from flash_poll import WipPoller,LatencyHistogram
+from flash_writeback import WriteBuffer
+from flash_kv import LogStore
+from flash_wear import WearLeveler
+from flash_sched import EraseAhead,URGENT,ERASE
+from flash_queue import CommandQueue
 
 covered_valued = []
 g_sys_clk = int(cocotb.top.g_sys_clk)
 period_ns = 10**9 / g_sys_clk
+(mem_size,page_size,sector_size) = geometry_of(cocotb.top)
 
 full = False
 def notify():
@@ -19,170 +32,65 @@ def notify():
 # at_least = value is superfluous, just shows how you can determine the amount of times that
 # a bin must be hit to considered covered
 
-# 2**4 is the number of bytes in a page in the sim. model. Change this number (range) accrodinlgy.
-@CoverPoint("top.i_data",xf = lambda x : x, bins = list(range(2**4)), at_least=1)
+# one bin per byte of a page of the sim. model, the page size comes from the toplevel
+@CoverPoint("top.i_data",xf = lambda x : x, bins = list(range(page_size)), at_least=1)
 def number_cover(data):
 	covered_valued.append(int(data))
 
-async def reset(dut,cycles=1):
-	dut.i_arstn.value = 0
-	dut.i_we.value = 0
-	dut.i_stb.value = 0
-	dut.i_addr.value = 0
-	dut.i_data.value = 0
-	dut.i_dq.value = 0  
-	await ClockCycles(dut.i_clk,cycles)
-	dut.i_arstn.value = 1
-	await RisingEdge(dut.i_clk)
-	dut._log.info("the core was reset")
-
-
-	# 					USER REGISTER MAP
-
-	# 			Address 		| 		Functionality
-	#			   0 			|	write flash command code
-	#			   1 			|	write data to tx / keep programming data bytes
-	#			   2 			|	write A23-A16
-	#			   3 			|	write A15-A8
-	#			   4 			|	write A7-A0
-	#			   5 			|	keep reading data bytes
-
-	
-	#supported flash commands 
-	#command set codes for serial embedded memory , eg any from ST M25Pxx series
-	#NOP  				255		#pseudo-cmd, not actual flash cmd
-	#WR_ENABLE  		6
-	#WR_DISABLE  		4
-	#RD_STATUS_REG  	5
-	#WR_STATUS_REG  	1
-	#PAGE_PROGRAM  		2
-	#SECTOR_ERASE  		216
-	#BULK_ERASE  		199
-	#RD_DATA  			3
-
-	#fast read corrsponds to simple read, but it requires dummy cycles (operates at higher freq.)
-	#following the address bytes and can operate at a higher frequency.
-	#F_RD_DATA  		11
+def new_host(dut):
+	#host driver with a reference model of the flash behind the current toplevel
+	return FlashHost(dut,FlashRefModel.for_dut(dut))
+
+def program_unbuffered(model,addr,data):
+	#every page a write touches is one page program
+	pos = 0
+	while(pos < len(data)):
+		n = min(len(data) - pos,model.page_size - (addr + pos) % model.page_size)
+		model.write_enable()
+		model.page_program(addr + pos,data[pos:pos + n])
+		pos += n
+
+def random_status():
+	data = random.randint(100,2**8-1)
+	bin_data = BinaryValue(value=data)
+	while(bin_data.binstr[-1] == '1'):			#don't write a value in status reg. with WIP=1
+		data = random.randint(100,2**8-1)
+		bin_data = BinaryValue(value=data)
+	return data
+
+
+# the register map and the command set codes driven by FlashHost
+# are documented in flash_host.py (and wb_regs.vhd / flash_controller_pkg.vhd)
 
 @cocotb.test()
+@profiled
 async def test_enable_disasble(dut):
 	"""Check results for serial flash controller write enable/disable operations"""
 	# write enable -> write disable -> write random data to status reg -> read status reg
 	# write enable -> write random data to status reg -> read status reg
-	# check that first read data is 0 (default value of status reg) and 
+	# check that first read data is 0 (default value of status reg) and
 	# second read data is the random data you have writen to the status reg the second repetition
 
 	# commands exercized : write enable, write disable, write status register, read status register
 	cocotb.start_soon(Clock(dut.i_clk, period_ns, units="ns").start())
-	await reset(dut,5)	
-
-	lst = []
+	host = new_host(dut)
+	await host.reset(5)
 
-	dut.i_we.value = 1
-	dut.i_stb.value = 1
-	dut.i_addr.value = 0 
-	dut.i_data.value = 6		# cmd WR ENABLE
-
-	await RisingEdge(dut.i_clk)
-	dut.i_stb.value = 0
-
-	await FallingEdge(dut.o_byte_tx_done)	# wait for the data byte to start transfer
-
-	dut.i_we.value = 1
-	dut.i_stb.value = 1
-	dut.i_addr.value = 0 
-	dut.i_data.value = 4		# cmd WR disable
-
-	await RisingEdge(dut.i_clk)
-	dut.i_stb.value = 0
-
-	await FallingEdge(dut.o_byte_tx_done)	# wait for the data byte to start transfer
+	await host.write_enable()
+	await host.write_disable()
 
 	for i in range(2):
-	
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 0 
-		dut.i_data.value = 1		# cmd write status register
+		data = random_status()
+		await host.write_status(data)
+		status = await host.read_status()
+		assert not (host.model.read_status() != status),"Different expected to actual read data"
+		await host.wait_cs_release()
+		await host.write_enable()
 
-		await RisingEdge(dut.i_clk)
-
-		data = random.randint(100,2**8-1)
-		bin_data = BinaryValue(value=data)
-		while(bin_data.binstr[-1] == '1'):			#don't write a value in status reg. with WIP=1
-			data = random.randint(100,2**8-1)
-			bin_data = BinaryValue(value=data)
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 1
-		dut.i_data.value = data
-		 
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-		await FallingEdge(dut.o_byte_tx_done)	# wait for the data byte to start transfer
-
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 7
-		dut.i_data.value = 255
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-
-		await FallingEdge(dut.o_byte_tx_done)	# wait for the data byte to start transfer
-
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 0
-		dut.i_data.value = 255
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-
-		await ClockCycles(dut.i_clk,5)
-
-
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 0 
-		dut.i_data.value = 5		# cmd read status register
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-		await FallingEdge(dut.o_byte_tx_done)	# wait for the data byte to start transfer
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 0 
-		dut.i_data.value = 255		# NOP command
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-		await FallingEdge(dut.o_dv)
-
-		dut.i_we.value = 0
-		dut.i_stb.value = 1
-		dut.i_addr.value = 5 		# read rx data
-		dut.i_data.value = 0
-		await RisingEdge(dut.o_ack)				
-		lst.append(dut.o_data.value)
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-		await ClockCycles(dut.i_clk,5)
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 0 
-		dut.i_data.value = 6		# cmd WR ENABLE
-
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-		await FallingEdge(dut.o_byte_tx_done)	# wait for the data byte to start transfer
-
-	assert not (0 != lst[0]),"Different expected to actual read data"
-	assert not (data != lst[1]),"Different expected to actual read data"
+	assert not (data != status),"Different expected to actual read data"
 
 @cocotb.test()
+@profiled
 async def test_status_reg(dut):
 	"""Check results for serial flash controller writing and reading the status register"""
 	# write random data to status reg -> read status reg (5 repetitions)
@@ -190,96 +98,21 @@ async def test_status_reg(dut):
 
 	# commands exercized : write enable, write status register, read status register
 	cocotb.start_soon(Clock(dut.i_clk, period_ns, units="ns").start())
-	await reset(dut,5)	
-
-
-
+	host = new_host(dut)
+	await host.reset(5)
 
 	for i in range(5):
-	
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 0 
-		dut.i_data.value = 6		# cmd WR ENABLE
-
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-
-		await FallingEdge(dut.o_byte_tx_done)	# wait for the data byte to start transfer
-	
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 0 
-		dut.i_data.value = 1		# cmd write status register
-
-		await RisingEdge(dut.i_clk)
-
-		data = random.randint(100,2**8-1)
-		bin_data = BinaryValue(value=data)
-		while(bin_data.binstr[-1] == '1'):			#don't write a value in status reg. with WIP=1
-			data = random.randint(100,2**8-1)
-			bin_data = BinaryValue(value=data)
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 1
-		dut.i_data.value = data
-		 
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-		await FallingEdge(dut.o_byte_tx_done)	# wait for the data byte to start transfer
-
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 7
-		dut.i_data.value = 255
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-		await FallingEdge(dut.o_byte_tx_done)	# wait for the data byte to start transfer
-
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 0
-		dut.i_data.value = 255
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-		await ClockCycles(dut.i_clk,5)
-
-
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 0 
-		dut.i_data.value = 5		# cmd read status register
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-		await FallingEdge(dut.o_byte_tx_done)	# wait for the data byte to start transfer
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 0 
-		dut.i_data.value = 255		# NOP command
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-		await FallingEdge(dut.o_dv)
-
-		dut.i_we.value = 0
-		dut.i_stb.value = 1
-		dut.i_addr.value = 5 		# read rx data
-		dut.i_data.value = 0
-		await RisingEdge(dut.o_ack)				
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-
-		assert not (data != int(dut.o_data.value)),"Different expected to actual read data"
-		await ClockCycles(dut.i_clk,5)
-
+		await host.write_enable()
+		data = random_status()
+		await host.write_status(data)
+		status = await host.read_status()
 
+		assert not (host.model.read_status() != status),"Different expected to actual read data"
+		await host.wait_cs_release()
 
 
 @cocotb.test()
+@profiled
 async def test_erase(dut):
 	"""Check results for serial flash controller of bulk erase command after writing and reading the flash"""
 	# write enable -> write random data to random address -> read data from that random address
@@ -290,657 +123,559 @@ async def test_erase(dut):
 	# commands exercized : write enable, page program, read, sector erase (bulk erase in comments)
 
 	cocotb.start_soon(Clock(dut.i_clk, period_ns, units="ns").start())
-	await reset(dut,5)	
-
-	lst = []
-
-
+	host = new_host(dut)
+	await host.reset(5)
 
 	for i in range(5):
-	
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 0 
-		dut.i_data.value = 6		# cmd WR ENABLE
-
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-		await FallingEdge(dut.o_byte_tx_done)	# wait for the data byte to start transfer
-	
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 0 
-		dut.i_data.value = 2		# cmd page program
-
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-		await FallingEdge(dut.o_byte_tx_done)	# wait for the data byte to start transfer
-
 		addr = random.randint(165,2**8-1)
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 2 
-		dut.i_data.value = 0		# addr high
-
-		await RisingEdge(dut.i_clk)
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 3 
-		dut.i_data.value = 0		# addr m
-
-		await RisingEdge(dut.i_clk)
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 4 
-		dut.i_data.value = addr		# addr low
-
-		await RisingEdge(dut.i_clk)
-
 		data = random.randint(165,2**8-1)
-		lst.append(data)
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 1
-		dut.i_data.value = data 
-		await RisingEdge(dut.i_clk)
-
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 7
-		dut.i_data.value = 255
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-		await FallingEdge(dut.o_byte_tx_done)	# wait for the data byte to start transfer
-
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 0
-		dut.i_data.value = 255
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-		await ClockCycles(dut.i_clk,5)
-
-
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 0 
-		dut.i_data.value = 3		# cmd RD data
-		await RisingEdge(dut.i_clk)
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 2 
-		dut.i_data.value = 0		# addr high
-
-		await RisingEdge(dut.i_clk)
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 3 
-		dut.i_data.value = 0		# addr m
 
-		await RisingEdge(dut.i_clk)
+		await host.write_enable()
+		await host.page_program(addr,[data])
+		rx = await host.read(addr,1)
 
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 4 
-		dut.i_data.value = addr		# addr low
+		assert not (host.model.read(addr,1) != rx),"Different expected to actual read data"
 
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
+	await host.wait_cs_release()
 
-		await FallingEdge(dut.o_byte_rx_done)	# wait for the data byte to start transfer
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 0 
-		dut.i_data.value = 255		# NOP command
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-		await FallingEdge(dut.o_dv)
-
-		dut.i_we.value = 0
-		dut.i_stb.value = 1
-		dut.i_addr.value = 5 		# read rx data
-		dut.i_data.value = 0
-		await RisingEdge(dut.o_ack)				
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-
-		assert not (data != int(dut.o_data.value)),"Different expected to actual read data"
-
-	await ClockCycles(dut.i_clk,5)
-
-	
-	dut.i_we.value = 1
-	dut.i_stb.value = 1
-	dut.i_addr.value = 0 
-	dut.i_data.value = 6		# cmd WR ENABLE
-
-	await RisingEdge(dut.i_clk)
-	dut.i_stb.value = 0
-
-	await FallingEdge(dut.o_byte_tx_done)	# wait for the data byte to start transfer
-
-	# dut.i_we.value = 1
-	# dut.i_stb.value = 1
-	# dut.i_addr.value = 0 
-	# dut.i_data.value = 199		# cmd bulk erase (no need to specify A23-A0)
+	await host.write_enable()
+	# await host.bulk_erase()
 
 	#or go for an erase of a specific sector (specify sector by A23-A0)
-
-	dut.i_we.value = 1
-	dut.i_stb.value = 1
-	dut.i_addr.value = 0 
-	dut.i_data.value = 216		# cmd sector erase
-
-	await RisingEdge(dut.i_clk)
-	dut.i_stb.value = 0
-	await FallingEdge(dut.o_byte_tx_done)	# wait for the data byte to start transfer
-
 	addr = random.randint(165,2**8-1)
+	await host.sector_erase(addr)
+	await host.wait_ready()
+	rx = await host.read(addr,1)
 
-	dut.i_we.value = 1
-	dut.i_stb.value = 1
-	dut.i_addr.value = 2 
-	dut.i_data.value = 0		# addr high
-
-	await RisingEdge(dut.i_clk)
-
-	dut.i_we.value = 1
-	dut.i_stb.value = 1
-	dut.i_addr.value = 3 
-	dut.i_data.value = 0		# addr m
-
-	await RisingEdge(dut.i_clk)
-
-	dut.i_we.value = 1
-	dut.i_stb.value = 1
-	dut.i_addr.value = 4 
-	dut.i_data.value = addr		# addr low
-
-
-
-	await RisingEdge(dut.i_clk)
-	dut.i_stb.value = 0
-
-	await FallingEdge(dut.o_byte_tx_done)	# wait for the data byte to start transfer
-
-
-	dut.i_we.value = 1
-	dut.i_stb.value = 1
-	dut.i_addr.value = 0 
-	dut.i_data.value = 3		# cmd RD data
-	await RisingEdge(dut.i_clk)
-
-	dut.i_we.value = 1
-	dut.i_stb.value = 1
-	dut.i_addr.value = 2 
-	dut.i_data.value = 0		# addr high
-
-	await RisingEdge(dut.i_clk)
-
-	dut.i_we.value = 1
-	dut.i_stb.value = 1
-	dut.i_addr.value = 3 
-	dut.i_data.value = 0		# addr m
-
-	await RisingEdge(dut.i_clk)
-
-	dut.i_we.value = 1
-	dut.i_stb.value = 1
-	dut.i_addr.value = 4 
-	dut.i_data.value = addr		# addr low
-
-	await RisingEdge(dut.i_clk)
-	dut.i_stb.value = 0
-
-	await FallingEdge(dut.o_byte_rx_done)	# wait for the data byte to start transfer
-	dut.i_we.value = 1
-	dut.i_stb.value = 1
-	dut.i_addr.value = 0 
-	dut.i_data.value = 255		# NOP command
-	await RisingEdge(dut.i_clk)
-	dut.i_stb.value = 0
-	await FallingEdge(dut.o_dv)
-
-	dut.i_we.value = 0
-	dut.i_stb.value = 1
-	dut.i_addr.value = 5 		# read rx data
-	dut.i_data.value = 0
-	await RisingEdge(dut.o_ack)				
-	await RisingEdge(dut.i_clk)
-	dut.i_stb.value = 0
-
-	assert not (255 != int(dut.o_data.value)),"Different expected to actual read data"
-
-	await ClockCycles(dut.i_clk,5)
+	assert not (host.model.read(addr,1) != rx),"Different expected to actual read data"
+	assert not (255 != rx[0]),"Different expected to actual read data"
 
+	await host.wait_cs_release()
 
 
 @cocotb.test()
+@profiled
 async def test_single_r_w(dut):
 	"""Check results for serial flash controller writing and reading 1 item at a time"""
 	# write enable -> write random data to random address -> read data from that random address
-	# check that we have read correct data (50 repetitions) 
+	# check that we have read correct data (50 repetitions)
 	# write and reads here are single, they do not occur in burst like fashion
 
 	# commands exercized : write enable, page program, read
 	cocotb.start_soon(Clock(dut.i_clk, period_ns, units="ns").start())
-	await reset(dut,5)	
-
-	lst = []
-
+	host = new_host(dut)
+	await host.reset(5)
 
 	for i in range(50):
-	
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 0 
-		dut.i_data.value = 6		# cmd WR ENABLE
-
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-
-		await FallingEdge(dut.o_byte_tx_done)	# wait for the data byte to start transfer
-
-	
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 0 
-		dut.i_data.value = 2		# cmd page program
-
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-		await FallingEdge(dut.o_byte_tx_done)	# wait for the data byte to start transfer
-
 		addr = random.randint(165,2**8-1)
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 2 
-		dut.i_data.value = 0		# addr high
-
-		await RisingEdge(dut.i_clk)
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 3 
-		dut.i_data.value = 0		# addr m
-
-		await RisingEdge(dut.i_clk)
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 4 
-		dut.i_data.value = addr		# addr low
-
-		await RisingEdge(dut.i_clk)
-
 		data = random.randint(165,2**8-1)
-		lst.append(data)
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 1
-		dut.i_data.value = data 
-		await RisingEdge(dut.i_clk)
-
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 7
-		dut.i_data.value = 255
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-		await FallingEdge(dut.o_byte_tx_done)	# wait for the data byte to start transfer
-
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 0
-		dut.i_data.value = 255
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-		await ClockCycles(dut.i_clk,5)
-
-
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 0 
-		dut.i_data.value = 3		# cmd RD data
-		await RisingEdge(dut.i_clk)
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 2 
-		dut.i_data.value = 0		# addr high
-
-		await RisingEdge(dut.i_clk)
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 3 
-		dut.i_data.value = 0		# addr m
 
-		await RisingEdge(dut.i_clk)
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 4 
-		dut.i_data.value = addr		# addr low
-
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-
-		await FallingEdge(dut.o_byte_rx_done)	# wait for the data byte to start transfer
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 0 
-		dut.i_data.value = 255		# NOP command
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-		await FallingEdge(dut.o_dv)
-
-		dut.i_we.value = 0
-		dut.i_stb.value = 1
-		dut.i_addr.value = 5 		# read rx data
-		dut.i_data.value = 0
-		await RisingEdge(dut.o_ack)				
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-
-		assert not (data != int(dut.o_data.value)),"Different expected to actual read data"
+		await host.write_enable()
+		await host.page_program(addr,[data])
+		rx = await host.read(addr,1)
 
+		assert not (host.model.read(addr,1) != rx),"Different expected to actual read data"
 
+	#the high and middle address bytes stay 0 for the whole run
+	host.report_bus(dut._log.info)
+	assert not (host.writes_elided == 0),"No unchanged register write was skipped"
 
 
 @cocotb.test()
+@profiled
 async def test_fast_read_single_r_w(dut):
 	"""Check results for serial flash controller writing and reading (fast read) 1 item at a time"""
 	# write enable -> write random data to random address -> fast read data from that random address
-	# check that we have read correct data (50 repetitions) 
+	# check that we have read correct data (50 repetitions)
 	# write and reads (fast) here are single, they do not occur in burst like fashion
 
 	# commands exercized : write enable, page program, read
 	cocotb.start_soon(Clock(dut.i_clk, period_ns, units="ns").start())
-	await reset(dut,5)	
-
-	lst = []
-
+	host = new_host(dut)
+	await host.reset(5)
 
 	for i in range(50):
-	
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 0 
-		dut.i_data.value = 6		# cmd WR ENABLE
-
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-
-		await FallingEdge(dut.o_byte_tx_done)	# wait for the data byte to start transfer
-
-	
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 0 
-		dut.i_data.value = 2		# cmd page program
-
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-		await FallingEdge(dut.o_byte_tx_done)	# wait for the data byte to start transfer
-
 		addr = random.randint(165,2**8-1)
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 2 
-		dut.i_data.value = 0		# addr high
-
-		await RisingEdge(dut.i_clk)
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 3 
-		dut.i_data.value = 0		# addr m
-
-		await RisingEdge(dut.i_clk)
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 4 
-		dut.i_data.value = addr		# addr low
-
-		await RisingEdge(dut.i_clk)
-
 		data = random.randint(165,2**8-1)
-		lst.append(data)
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 1
-		dut.i_data.value = data 
-		await RisingEdge(dut.i_clk)
-
 
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 7
-		dut.i_data.value = 255
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-		await FallingEdge(dut.o_byte_tx_done)	# wait for the data byte to start transfer
-
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 0
-		dut.i_data.value = 255
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-		await ClockCycles(dut.i_clk,5)
-
-
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 0 
-		dut.i_data.value = 11		# cmd RD data
-		await RisingEdge(dut.i_clk)
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 2 
-		dut.i_data.value = 0		# addr high
-
-		await RisingEdge(dut.i_clk)
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 3 
-		dut.i_data.value = 0		# addr m
-
-		await RisingEdge(dut.i_clk)
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 4 
-		dut.i_data.value = addr		# addr low
-
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-
-		await FallingEdge(dut.o_byte_rx_done)	# wait for the data byte to start transfer
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 0 
-		dut.i_data.value = 255		# NOP command
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-		await FallingEdge(dut.o_dv)
-
-		dut.i_we.value = 0
-		dut.i_stb.value = 1
-		dut.i_addr.value = 5 		# read rx data
-		dut.i_data.value = 0
-		await RisingEdge(dut.o_ack)				
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-	
-		assert not (data != int(dut.o_data.value)),"Different expected to actual read data"
+		await host.write_enable()
+		await host.page_program(addr,[data])
+		rx = await host.fast_read(addr,1)
 
+		assert not (host.model.read(addr,1) != rx),"Different expected to actual read data"
 
+	host.report_bus(dut._log.info)
 
 
 @cocotb.test()
+@profiled
 async def test_page_r_w(dut):
 	"""Check results and coverage for serial flash controller writing and reading whole pages"""
 	# write enable -> write random data to a page (progr. whole page) ->
 	# read data from that page (read whole page)
-	# check that we have read correct data  
+	# check that we have read correct data
 	# write and reads here occur a page at a time
 
 	# commands exercized : write enable, page program, read
 
 	cocotb.start_soon(Clock(dut.i_clk, period_ns, units="ns").start())
-	await reset(dut,5)	
+	host = new_host(dut)
+	await host.reset(5)
 
 	lst = []
 
+	# while(full != True):
+	for data in UncoveredBins(page_size):		#number of bytes in page in sim. model
+		number_cover(data)
+		coverage_db["top.i_data"].add_threshold_callback(notify, 100)
+		lst.append(data)
 
-	dut.i_we.value = 1
-	dut.i_stb.value = 1
-	dut.i_addr.value = 0 
-	dut.i_data.value = 6		# cmd WR ENABLE
+	await host.page_program_stream(0,bytes(lst))
 
-	await RisingEdge(dut.i_clk)
-	dut.i_stb.value = 0
+	rx = await host.read(0,page_size)
+	expected = host.model.read(0,page_size)
 
-	await FallingEdge(dut.o_byte_tx_done)	# wait for the data byte to start transfer
-	
-	dut.i_we.value = 1
-	dut.i_stb.value = 1
-	dut.i_addr.value = 0 
-	dut.i_data.value = 2		# cmd page program
+	for i in range(page_size):
+		assert not (expected[i] != rx[i]),"Different expected to actual read data"
+	host.report_bus(dut._log.info)
 
-	await RisingEdge(dut.i_clk)
-	dut.i_stb.value = 0
-	await FallingEdge(dut.o_byte_tx_done)	# wait for the data byte to start transfer
+	#the whole memory image, in one backdoor dump
+	if(FlashBackdoor.available(dut)):
+		FlashBackdoor(dut).check(host.model.mem)
 
-	dut.i_we.value = 1
-	dut.i_stb.value = 1
-	dut.i_addr.value = 2 
-	dut.i_data.value = 0		# addr high
+	# coverage_db.report_coverage(cocotb.log.info,bins=True)
+	coverage_db.export_to_xml(filename="coverage.xml")
 
-	await RisingEdge(dut.i_clk)
 
-	dut.i_we.value = 1
-	dut.i_stb.value = 1
-	dut.i_addr.value = 3 
-	dut.i_data.value = 0		# addr m
+@cocotb.test(skip=not FlashBackdoor.available(cocotb.top))
+@profiled
+async def test_preload(dut):
+	"""Check reads of a flash image preloaded through the backdoor"""
+	# preload a random image in the simulation model memory (no spi traffic) ->
+	# read a page through the controller -> check it and the whole image against the model
 
-	await RisingEdge(dut.i_clk)
+	# commands exercized : read, fast read
+	cocotb.start_soon(Clock(dut.i_clk, period_ns, units="ns").start())
+	host = new_host(dut)
+	await host.reset(5)
 
-	dut.i_we.value = 1
-	dut.i_stb.value = 1
-	dut.i_addr.value = 4 
-	dut.i_data.value = 0		# addr low
+	backdoor = FlashBackdoor(dut,host.model)
+	backdoor.load(random.randbytes(backdoor.size))
 
-	await RisingEdge(dut.i_clk)
+	page = host.model.page_size
+	addr = random.randrange(0,host.model.mem_size,page)
+	rx = await host.read(addr,page)
+	assert not (host.model.read(addr,page) != rx),"Different expected to actual read data"
+	rx = await host.fast_read(addr,page)
+	assert not (host.model.read(addr,page) != rx),"Different expected to actual read data"
 
+	backdoor.check(host.model.mem)
 
 
-	# while(full != True):
-	for i in range(16):				#number of bytes in page in sim. model
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 1
-		data = random.randint(0,2**4-1)
-		while(data in covered_valued):
-			data = random.randint(0,2**4-1) 
-		dut.i_data.value = data		# data to tx
-		number_cover(data)
-		coverage_db["top.i_data"].add_threshold_callback(notify, 100)
-		lst.append(data)
-		await RisingEdge(dut.i_clk)
-
-
-		dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_addr.value = 7
-		dut.i_data.value = 255
-		await RisingEdge(dut.i_clk)
-		dut.i_stb.value = 0
-		await FallingEdge(dut.o_byte_tx_done)	# wait for the data byte to start transfer
+@cocotb.test()
+@profiled
+async def test_wip_poll(dut):
+	"""Check program and erase completion through the WIP bit of the status register"""
+	# write enable -> program a random page -> poll WIP -> read the page back (5 repetitions)
+	# write enable -> sector erase -> poll WIP, with back-off -> read back
+	# write enable -> bulk erase -> poll WIP -> read back
+	# the latency histograms of the three operations are reported
+
+	# commands exercized : write enable, page program, sector erase, bulk erase, read status, read
+	cocotb.start_soon(Clock(dut.i_clk, period_ns, units="ns").start())
+	host = new_host(dut)
+	await host.reset(5)
+	poller = WipPoller(host)
 
+	for i in range(5):
+		addr = random.randrange(0,mem_size,page_size)
+		await host.write_enable()
+		await poller.page_program(addr,random.randbytes(page_size))
+		rx = await host.read(addr,page_size)
+		assert not (host.model.read(addr,page_size) != rx),"Different expected to actual read data"
+
+	#one status byte per poll is 8 spi clocks of at least 4 system clocks
+	poller.backoff_ns = 32 * period_ns
+	await host.write_enable()
+	await poller.sector_erase(addr)
+	rx = await host.read(addr,page_size)
+	assert not (host.model.read(addr,page_size) != rx),"Different expected to actual read data"
+
+	poller.backoff_ns = 0
+	await host.write_enable()
+	await poller.page_program(addr,random.randbytes(page_size))
+	await host.write_enable()
+	await poller.bulk_erase()
+	rx = await host.read(addr,page_size)
+	assert not (host.model.read(addr,page_size) != rx),"Different expected to actual read data"
+
+	for op in ("page_program","sector_erase","bulk_erase"):
+		assert len(poller.latency[op]) > 0,"No latency recorded for {}".format(op)
+	poller.report(dut._log.info)
 
 
-	dut.i_we.value = 1
-	dut.i_stb.value = 1
-	dut.i_addr.value = 0
-	dut.i_data.value = 255
-	await RisingEdge(dut.i_clk)
-	dut.i_stb.value = 0
-	await ClockCycles(dut.i_clk,100)
+@cocotb.test()
+@profiled
+async def test_stream_read(dut):
+	"""Check a streaming read of the whole memory in a single chip-select window"""
+	# write enable -> program random data to random pages (4 repetitions) ->
+	# stream the whole memory with one read command, page sized chunks -> check it
+	# stream a region with one fast read command and stop half way -> check the chunks read
+
+	# commands exercized : write enable, page program, read, fast read
+	cocotb.start_soon(Clock(dut.i_clk, period_ns, units="ns").start())
+	host = new_host(dut)
+	await host.reset(5)
+
+	for i in range(4):
+		addr = random.randrange(0,mem_size,page_size)
+		await host.write_enable()
+		await host.page_program(addr,random.randbytes(page_size))
+		await host.wait_ready()
+
+	#at most the first 4 KiB of a full size memory
+	n = min(mem_size,4096)
+	offset = 0
+	async for data in host.stream_read(0,n,page_size):
+		assert not (host.model.read(offset,len(data)) != data),"Different expected to actual read data"
+		offset += len(data)
+	assert not (offset != n),"Streaming read returned {} bytes instead of {}".format(offset,n)
+
+	addr = random.randrange(0,n)
+	rx = host.stream_read(addr,n,7,F_RD_DATA)
+	async for data in rx:
+		assert not (host.model.read(addr,len(data)) != data),"Different expected to actual read data"
+		addr += len(data)
+		if(addr >= n // 2):
+			break
+	await rx.aclose()
+	rx = await host.read(addr,page_size)
+	assert not (host.model.read(addr,page_size) != rx),"Different expected to actual read data"
 
 
+@cocotb.test()
+@profiled
+async def test_program_stream(dut):
+	"""Check a streaming program of several pages from an address inside a page"""
+	# bulk erase -> program random data from a random address for three and a half pages,
+	# split at the page boundaries -> stream the region back -> check it
 
-	dut.i_we.value = 1
-	dut.i_stb.value = 1
-	dut.i_addr.value = 0 
-	dut.i_data.value = 3		# cmd RD data
-	await RisingEdge(dut.i_clk)
+	# commands exercized : write enable, bulk erase, page program, read status, read
+	cocotb.start_soon(Clock(dut.i_clk, period_ns, units="ns").start())
+	host = new_host(dut)
+	await host.reset(5)
 
-	dut.i_we.value = 1
-	dut.i_stb.value = 1
-	dut.i_addr.value = 2 
-	dut.i_data.value = 0		# addr high
+	await host.write_enable()
+	await host.bulk_erase()
+	await host.wait_ready()
 
-	await RisingEdge(dut.i_clk)
+	n = 3 * page_size + page_size // 2
+	addr = random.randrange(0,mem_size - n)
+	data = random.randbytes(n)
+	rate = await host.page_program_stream(addr,data)
+	assert not (rate <= 0),"No bytes programmed"
 
-	dut.i_we.value = 1
-	dut.i_stb.value = 1
-	dut.i_addr.value = 3 
-	dut.i_data.value = 0		# addr m
+	rx = bytearray()
+	async for chunk in host.stream_read(addr,n,page_size):
+		rx += chunk
+	assert not (host.model.read(addr,n) != rx),"Different expected to actual read data"
+	assert not (data != rx),"Different programmed to read data"
 
-	await RisingEdge(dut.i_clk)
 
-	dut.i_we.value = 1
-	dut.i_stb.value = 1
-	dut.i_addr.value = 4 
-	dut.i_data.value = 0		# addr low
+@cocotb.test()
+@profiled
+async def test_write_buffer(dut):
+	"""Check small record writes merged into page programs by the write buffer"""
+	# bulk erase -> append small random records through the write buffer, with some
+	# rewrites and reads in between -> flush -> stream the memory back -> check it against
+	# a reference model where every record was programmed on its own
+
+	# commands exercized : write enable, bulk erase, page program, read status, read
+	cocotb.start_soon(Clock(dut.i_clk, period_ns, units="ns").start())
+	host = new_host(dut)
+	await host.reset(5)
+	expected = FlashRefModel.for_dut(dut)
+
+	await host.write_enable()
+	await host.bulk_erase()
+	await host.wait_ready()
+
+	#pages older than 200 spi bytes are flushed
+	buf = WriteBuffer(host,max_age_ns=200 * 32 * period_ns,max_bytes=4 * page_size)
+	n = min(mem_size,1024)
+	cursor = 0
+	for i in range(100):
+		data = random.randbytes(random.randint(1,8))
+		if(random.random() < 0.8):
+			addr = cursor
+			cursor = (cursor + len(data)) % (n - 8)
+		else:
+			addr = random.randrange(0,n - 8)
+		await buf.write(addr,data)
+		program_unbuffered(expected,addr,data)
+		if(i % 10 == 9):
+			rx = await buf.read(addr,8)
+			assert not (expected.read(addr,8) != rx),"Different expected to actual read data"
+	await buf.flush()
+	buf.report(dut._log.info)
+
+	rx = bytearray()
+	async for chunk in host.stream_read(0,n,page_size):
+		rx += chunk
+	assert not (expected.read(0,n) != rx),"Different expected to actual read data"
+	assert not (buf.stats["programs"] >= buf.stats["writes"]),"The write buffer did not merge any write"
 
-	await RisingEdge(dut.i_clk)
-	dut.i_stb.value = 0
-	await FallingEdge(dut.o_byte_rx_done)	# wait for the data byte to start transfer
 
-	for i in range(16):
-		# dut.i_we.value = 1
-		dut.i_stb.value = 1
-		dut.i_we.value = 1
-		dut.i_addr.value = 5 
-		dut.i_data.value = 0		# data to rx
+@cocotb.test()
+@profiled
+async def test_read_cache(dut):
+	"""Check reads through the page cache, across programs and erases of the cached pages"""
+	# read a hot page repeatedly through a cache of 4 pages -> program a byte of it ->
+	# read it again -> erase its sector -> read it again, with reads of other pages in
+	# between to make the cache evict. every read is checked against the model
+
+	# commands exercized : write enable, page program, sector erase, read status, read, fast read
+	cocotb.start_soon(Clock(dut.i_clk, period_ns, units="ns").start())
+	host = new_host(dut)
+	await host.reset(5)
+	cache = host.enable_cache(4 * page_size)
+
+	hot = random.randrange(0,mem_size,page_size)
+	for i in range(20):
+		addr = hot + random.randrange(page_size)
+		n = random.randint(1,hot + page_size - addr)
+		rx = await host.read(addr,n) if i % 2 else await host.fast_read(addr,n)
+		assert not (host.model.read(addr,n) != rx),"Different expected to actual read data"
+		if(i % 5 == 4):
+			#a run of other pages, filled by one read
+			await host.read(random.randrange(0,mem_size,page_size),3 * page_size)
+		elif(i % 5 == 2):
+			await host.write_enable()
+			await host.page_program(addr,[random.randint(0,255)])
+			await host.wait_ready()
+		elif(i == 13):
+			await host.write_enable()
+			await host.sector_erase(hot)
+			await host.wait_ready()
+
+	dut._log.info("page cache : {}".format(cache.stats()))
+	assert not (cache.hits == 0),"No read hit the page cache"
+	assert not (cache.size > 4 * page_size),"The page cache is over its budget"
 
-		await RisingEdge(dut.o_dv)
-		await RisingEdge(dut.i_clk)
-		
-		dut.i_we.value = 0
-		dut.i_stb.value = 1
-		dut.i_addr.value = 5 		# read rx data
-		dut.i_data.value = 0
-		await RisingEdge(dut.i_clk)
-		await RisingEdge(dut.i_clk)	
 
+@cocotb.test()
+@profiled
+async def test_kv_store(dut):
+	"""Check the log-structured key-value store through puts, deletes, garbage collection and a remount"""
+	# format -> 384 random puts and deletes of a few keys in a window of up to 4 sectors ->
+	# get every key -> sync -> mount a second store from the flash alone -> get every key
+	# again. on the small geometries the puts overrun the window many times and the collection
+	# erases whole sectors, the values are checked against a dict
+
+	# commands exercized : write enable, page program, sector erase, bulk erase, read status, read
+	cocotb.start_soon(Clock(dut.i_clk, period_ns, units="ns").start())
+	host = new_host(dut)
+	await host.reset(5)
+
+	#a fixed window and record budget : the run stays short on the full geometry
+	geometry = (min(mem_size,4 * sector_size),page_size,sector_size)
+	store = LogStore(host,geometry)
+	await store.format()
+	expected = {}
+	keys = [b"key%d" % i for i in range(6)]
+	for i in range(384):
+		key = random.choice(keys)
+		if(random.random() < 0.8):
+			expected[key] = random.randbytes(random.randint(1,8))
+			await store.put(key,expected[key])
+		else:
+			await store.delete(key)
+			expected.pop(key,None)
+	for key in keys:
+		rx = await store.get(key)
+		assert not (expected.get(key) != rx),"Different expected to actual read data"
+	await store.sync()
+
+	mounted = LogStore(host,geometry)
+	await mounted.mount()
+	for key in keys:
+		rx = await mounted.get(key)
+		assert not (expected.get(key) != rx),"Different expected to actual read data"
+	dut._log.info("kv store : {}".format(store.stats))
+	if(store.stats["bytes_appended"] > 2 * store.mem_size):
+		assert not (store.stats["collections"] == 0),"The store never collected a sector"
+
+
+@cocotb.test(skip=mem_size // sector_size < 2)
+@profiled
+async def test_wear_leveling(dut):
+	"""Check the wear leveling of a skewed rewrite workload, with the wear and the migration traffic reported"""
+	# format -> rewrite logical sectors (erase, program up to 2 pages), 90% of them the first
+	# two -> read the start of every rewritten sector back. the erase counts must stay within
+	# the threshold where in-place rewrites would have worn the two hot sectors only
+
+	# commands exercized : write enable, bulk erase, sector erase, page program, read status, read
+	cocotb.start_soon(Clock(dut.i_clk, period_ns, units="ns").start())
+	host = new_host(dut)
+	await host.reset(5)
+
+	threshold = 4
+	wear = WearLeveler(host,threshold=threshold)
+	await wear.format()
+	#two pages per write at most : the erases are the point, not the program time
+	payload = min(sector_size,2 * page_size)
+	expected = {}
+	in_place = [0] * wear.sectors
+	for i in range(12 * wear.physical):
+		sector = random.randrange(2) if random.random() < 0.9 else random.randrange(wear.sectors)
+		data = random.randbytes(random.randint(1,payload))
+		addr = sector * sector_size
+		await wear.erase(addr)
+		await wear.write(addr,data)
+		expected[sector] = data + bytes([0xFF]) * (payload - len(data))
+		in_place[sector] += 1
+
+	for (sector,data) in sorted(expected.items()):
+		rx = await wear.read(sector * sector_size,payload)
+		assert not (data != rx),"Different expected to actual read data"
+
+	dut._log.info("in place : sector erases min {} max {}".format(min(in_place),max(in_place)))
+	wear.report(dut._log.info)
+	dut._log.info("migration traffic : {} of {} bytes programmed, {} of {} erases".format(
+		wear.stats["bytes_migrated"],wear.stats["bytes_migrated"] + wear.stats["bytes_written"],
+		wear.stats["migration_erases"],wear.stats["erases"]))
+	assert not (wear.spread() > threshold + 1),"The erase counts spread beyond the threshold"
+	assert not (max(wear.erases) >= max(in_place)),"Wear leveling did not lower the peak erase count"
+
+
+@cocotb.test(skip=mem_size // sector_size < 2)
+@profiled
+async def test_erase_ahead(dut):
+	"""Compare the write latency with sector erases on demand and erased ahead in the background"""
+	# time one sector erase -> the same rewrites (up to 2 pages) of half the sectors, with idle
+	# gaps of up to two erases between them and a reader in the background, first erasing on
+	# demand, then erasing ahead : every write takes a fresh sector (allocate, program) and
+	# releases the old one. every write and read is checked, the p50/p99 write latencies are
+	# reported
+
+	# commands exercized : write enable, bulk erase, sector erase, page program, read status, read
+	cocotb.start_soon(Clock(dut.i_clk, period_ns, units="ns").start())
+	host = new_host(dut)
+	await host.reset(5)
+
+	start = get_sim_time("ns")
+	await host.write_enable()
+	await host.sector_erase(0)
+	await host.wait_ready()
+	erase_ns = int(get_sim_time("ns") - start)
+
+	sectors = mem_size // sector_size
+	slots = max(2,sectors // 2)
+	#two pages per write at most : the erase latency is the point, not the program time
+	payload = min(sector_size,2 * page_size)
+	plan = [(random.randrange(1,slots),random.randbytes(random.randint(1,payload)),
+		random.randint(1,2 * erase_ns)) for i in range(6 * sectors)]
+	static = random.randbytes(payload)
+
+	latency = {}
+	for ahead in (False,True):
+		await host.write_enable()
+		await host.bulk_erase()
+		await host.wait_ready()
+		sched = EraseAhead(host,low_water=1,idle_ns=erase_ns // 4,ahead=ahead).start()
+		placed = [await sched.allocate() for slot in range(slots)]
+		await sched.program(placed[0] * sector_size,static)
+		done = False
+
+		async def reader():
+			#foreground reads of the slot that is never rewritten
+			while(not done):
+				await Timer(random.randint(1,2 * erase_ns),units="ns")
+				rx = await sched.read(placed[0] * sector_size,8)
+				assert not (static[:8] != rx),"Different expected to actual read data"
+		reads = cocotb.start_soon(reader())
+
+		hist = latency[ahead] = LatencyHistogram("write, erase " + ("ahead" if ahead else "on demand"))
+		for (slot,data,gap) in plan:
+			await Timer(gap,units="ns")
+			start = get_sim_time("ns")
+			sector = await sched.allocate()
+			await sched.program(sector * sector_size,data)
+			hist.add(get_sim_time("ns") - start)
+			sched.release(placed[slot])
+			placed[slot] = sector
+			rx = await sched.read(sector * sector_size,len(data))
+			assert not (data != rx),"Different expected to actual read data"
+		done = True
+		await reads
+		sched.stop()
+		sched.report(dut._log.info)
+		for line in hist.lines():
+			dut._log.info(line)
+
+	dut._log.info("write latency p50 {} -> {} ns, p99 {} -> {} ns".format(latency[False].percentile(50),
+		latency[True].percentile(50),latency[False].percentile(99),latency[True].percentile(99)))
+	assert not (latency[True].percentile(50) >= latency[False].percentile(50)),"Erasing ahead did not lower the write latency"
 
-		expected_value = lst.pop(0)
-		assert not (expected_value != int(dut.o_data.value)),"Different expected to actual read data"
 
-	
-	# coverage_db.report_coverage(cocotb.log.info,bins=True)
-	coverage_db.export_to_xml(filename="coverage.xml")
+@cocotb.test()
+@profiled
+async def test_command_queue(dut):
+	"""Check reads, programs and erases submitted by several producers through the command queue"""
+	# bulk erase -> a writer (programs, a sector erase every 6th) and two readers (bursts of
+	# adjacent reads submitted together) run concurrently through the queue -> a low priority
+	# program followed by an urgent read of the same bytes. every read is checked against a
+	# model updated in submission order : the queue may reorder, never past a hazard
+
+	# commands exercized : write enable, bulk erase, sector erase, page program, read status, read
+	cocotb.start_soon(Clock(dut.i_clk, period_ns, units="ns").start())
+	host = new_host(dut)
+	await host.reset(5)
+	await host.write_enable()
+	await host.bulk_erase()
+	await host.wait_ready()
+	shadow = FlashRefModel.for_dut(dut)
+	shadow.write_enable()
+	shadow.bulk_erase()
+
+	queue = CommandQueue(host).start()
+
+	async def writer():
+		for i in range(24):
+			await Timer(random.randint(1,200),units="ns")
+			addr = random.randrange(mem_size - 16)
+			if(i % 6 == 5):
+				shadow.write_enable()
+				shadow.sector_erase(addr)
+				await queue.erase(addr)
+			else:
+				data = bytes(random.randint(0,255) for j in range(random.randint(1,16)))
+				program_unbuffered(shadow,addr,data)
+				await queue.program(addr,data)
+
+	async def reader(burst):
+		for i in range(12):
+			await Timer(random.randint(1,200),units="ns")
+			addr = random.randrange(mem_size - 8 * burst)
+			reads = [(queue.push("read",addr + 8 * j,8),shadow.read(addr + 8 * j,8)) for j in range(burst)]
+			for (req,expected) in reads:
+				rx = await queue.wait(req)
+				assert not (expected != rx),"Different expected to actual read data"
+
+	producers = [cocotb.start_soon(writer()),cocotb.start_soon(reader(2)),cocotb.start_soon(reader(4))]
+	for producer in producers:
+		await producer
+
+	#read after write, at a higher priority than the write
+	addr = random.randrange(mem_size - 16)
+	data = bytes(random.randint(0,255) for j in range(16))
+	program_unbuffered(shadow,addr,data)
+	write = queue.push("program",addr,len(data),data,priority=ERASE)
+	rx = await queue.read(addr,len(data),priority=URGENT)
+	assert not (data != rx),"Different expected to actual read data"
+	await queue.wait(write)
+	queue.stop()
+
+	queue.report(dut._log.info)
+	assert not (queue.stats["coalesced"] == 0),"No adjacent reads were coalesced"
+	assert not (queue.stats["raw_blocked"] == 0),"No read waited for an overlapping program"
@@ -5,10 +5,14 @@ from cocotb.result import TestFailure
 import random
 from cocotb_coverage.coverage import CoverPoint,coverage_db
 from cocotb.binary import BinaryValue
+from coverage_closure import UncoveredBins
+from flash_model import geometry_of
+from sim_profile import profiled
 
 covered_valued = []
 g_sys_clk = int(cocotb.top.g_sys_clk)
 period_ns = 10**9 / g_sys_clk
+(mem_size,page_size,sector_size) = geometry_of(cocotb.top)
 
 full = False
 def notify():
@@ -19,8 +23,8 @@ def notify():
 # at_least = value is superfluous, just shows how you can determine the amount of times that
 # a bin must be hit to considered covered
 
-# 2**4 is the number of bytes in a page in the sim. model. Change this number (range) accrodinlgy.
-@CoverPoint("top.i_data",xf = lambda x : x, bins = list(range(2**4)), at_least=1)
+# one bin per byte of a page of the sim. model, the page size comes from the toplevel
+@CoverPoint("top.i_data",xf = lambda x : x, bins = list(range(page_size)), at_least=1)
 def number_cover(data):
 	covered_valued.append(int(data))
 
@@ -88,6 +92,7 @@ async def driver_read(dut,araddr):
 	#F_RD_DATA  		11
 
 @cocotb.test()
+@profiled
 async def test_enable_disasble(dut):
 	"""Check results for serial flash controller write enable/disable operations"""
 	# write enable -> write disable -> write random data to status reg -> read status reg
@@ -224,6 +229,7 @@ async def test_enable_disasble(dut):
 	assert not (data != lst[1]),"Different expected to actual read data"
 
 @cocotb.test()
+@profiled
 async def test_status_reg(dut):
 	"""Check results for serial flash controller writing and reading the status register"""
 	# write random data to status reg -> read status reg (5 repetitions)
@@ -334,6 +340,7 @@ async def test_status_reg(dut):
 
 
 @cocotb.test()
+@profiled
 async def test_erase(dut):
 	"""Check results for serial flash controller of bulk erase command after writing and reading the flash"""
 	# write enable -> write random data to random address -> read data from that random address
@@ -625,6 +632,7 @@ async def test_erase(dut):
 
 
 @cocotb.test()
+@profiled
 async def test_single_r_w(dut):
 	"""Check results for serial flash controller writing and reading 1 item at a time"""
 	# write enable -> write random data to random address -> read data from that random address
@@ -787,6 +795,7 @@ async def test_single_r_w(dut):
 
 
 @cocotb.test()
+@profiled
 async def test_fast_read_single_r_w(dut):
 	"""Check results for serial flash controller writing and reading (fast read) 1 item at a time"""
 	# write enable -> write random data to random address -> fast read data from that random address
@@ -950,6 +959,7 @@ async def test_fast_read_single_r_w(dut):
 
 
 @cocotb.test()
+@profiled
 async def test_page_r_w(dut):
 	"""Check results and coverage for serial flash controller writing and reading whole pages"""
 	# write enable -> write random data to a page (progr. whole page) ->
@@ -1018,14 +1028,11 @@ async def test_page_r_w(dut):
 
 
 	# while(full != True):
-	for i in range(16):				#number of bytes in page in sim. model
+	for data in UncoveredBins(page_size):		#number of bytes in page in sim. model
 
 		# dut.i_we.value = 1
 		# dut.i_stb.value = 1
 		# dut.i_addr.value = 1
-		data = random.randint(0,2**4-1)
-		while(data in covered_valued):
-			data = random.randint(0,2**4-1) 
 		# dut.i_data.value = data		# data to tx
 
 		await driver_write(dut,1,data)
@@ -1094,7 +1101,7 @@ async def test_page_r_w(dut):
 	# dut.i_stb.value = 0
 	await FallingEdge(dut.o_byte_rx_done)	# wait for the data byte to start transfer
 
-	for i in range(16):
+	for i in range(page_size):
 			
 
 		dut.S_AXI_AWVALID.value = 1
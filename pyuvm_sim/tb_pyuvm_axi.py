@@ -1,4 +1,4 @@
-from cocotb.triggers import FallingEdge,RisingEdge,ClockCycles
+from cocotb.triggers import FallingEdge,RisingEdge
 from cocotb_coverage import crv
 from cocotb.clock import Clock
 from pyuvm import *
@@ -6,13 +6,22 @@ import random
 import cocotb
 import pyuvm
 from utils import AxilFlashBfm
+from flash_model import FlashRefModel,geometry_of
+from flash_host import WR_ENABLE,PAGE_PROGRAM,RD_DATA,F_RD_DATA
 from cocotb_coverage.coverage import CoverPoint,coverage_db
+from coverage_closure import UncoveredBins
+from sim_profile import profiled
 
 covered_values = []
 covered_values_fast_read = []
 covered_values_page_rw = []
 
 
+def page_size():
+    # page of the flash model behind the current toplevel
+    return geometry_of(cocotb.top)[1]
+
+
 full = False
 def notify():
     global full
@@ -51,38 +60,38 @@ class SeqItem(uvm_sequence_item):
 class RandomSeq(uvm_sequence):
         
     async def body(self):
-        while(len(covered_values) != 2**8):
+        # one item per tx_data bin, drawn from the bins not covered yet
+        for tx_data in UncoveredBins(2**8):
             data_tr = SeqItem("data_tr", None,None)
             await self.start_item(data_tr)
             data_tr.randomize_operands()
-            while(data_tr.i_crv.tx_data in covered_values):
-                data_tr.randomize_operands()
-            covered_values.append(data_tr.i_crv.tx_data)
+            data_tr.i_crv.tx_data = tx_data
+            covered_values.append(tx_data)
             await self.finish_item(data_tr)
 
 class RandomSeq_sequential(uvm_sequence):
         
     async def body(self):
-        while(len(covered_values_fast_read) != 2**8):
+        # one item per tx_data bin, drawn from the bins not covered yet
+        for tx_data in UncoveredBins(2**8):
             data_tr = SeqItem("data_tr", None,None)
             await self.start_item(data_tr)
             data_tr.randomize_operands()
-            while(data_tr.i_crv.tx_data in covered_values_fast_read):
-                data_tr.randomize_operands()
-            covered_values_fast_read.append(data_tr.i_crv.tx_data)
+            data_tr.i_crv.tx_data = tx_data
+            covered_values_fast_read.append(tx_data)
             await self.finish_item(data_tr)
 
 
 class RandomSeq_page_rw(uvm_sequence):
         
     async def body(self):
-        while(len(covered_values_page_rw) != 16):
+        # one item per tx_data bin, drawn from the bins not covered yet
+        for tx_data in UncoveredBins(page_size()):
             data_tr = SeqItem("data_tr", None,None)
             await self.start_item(data_tr)
             data_tr.randomize_operands()
-            while(data_tr.i_crv.tx_data in covered_values_page_rw):
-                data_tr.randomize_operands()
-            covered_values_page_rw.append(data_tr.i_crv.tx_data)
+            data_tr.i_crv.tx_data = tx_data
+            covered_values_page_rw.append(tx_data)
             await self.finish_item(data_tr)
 
 class TestAllSeq(uvm_sequence):
@@ -109,6 +118,8 @@ class TestPageRW(uvm_sequence):
 class Driver(uvm_driver):
     def build_phase(self):
         self.ap = uvm_analysis_port("ap", self)
+        # flash commands issued, replayed by the scoreboard on the reference model
+        self.op_ap = uvm_analysis_port("op_ap", self)
 
     def start_of_simulation_phase(self):
         self.bfm = AxilFlashBfm()
@@ -122,26 +133,14 @@ class Driver(uvm_driver):
         while True:
            
 
-            self.bfm.dut.S_AXI_AWVALID.value = 1
-            self.bfm.dut.S_AXI_AWADDR.value = 0
-            self.bfm.dut.S_AXI_WVALID.value = 1
-            self.bfm.dut.S_AXI_WDATA.value = 6
-            self.bfm.dut.S_AXI_BREADY.value = 1
-            
-            await FallingEdge(self.bfm.dut.o_s_n)
-            await ClockCycles(self.bfm.dut.S_AXI_ACLK,100)
-
-            await RisingEdge(self.bfm.dut.S_AXI_ACLK)
-            # await RisingEdge(self.bfm.dut.S_AXI_BVALID)
-            self.bfm.dut.S_AXI_AWVALID.value = 0
-            self.bfm.dut.S_AXI_WVALID.value = 0
+            await self.bfm.send_held_write(0,6)
 
 
-            await FallingEdge(self.bfm.dut.o_byte_tx_done)
+            await self.bfm.wait_tx_done()
       
             await self.bfm.send_data_write((1,0,1,2,1))
 
-            await FallingEdge(self.bfm.dut.o_byte_tx_done)  
+            await self.bfm.wait_tx_done()  
 
             await self.bfm.send_data_write((1,2,1,0,1))
 
@@ -153,10 +152,10 @@ class Driver(uvm_driver):
             await self.bfm.send_data_write((1,1,1,data.i_crv.tx_data,1))
 
             await self.bfm.send_data_write((1,7,1,255,1))
-            await FallingEdge(self.bfm.dut.o_byte_tx_done)     
+            await self.bfm.wait_tx_done()     
 
             await self.bfm.send_data_write((1,0,1,255,1))
-            await ClockCycles(self.bfm.dut.S_AXI_ACLK,5)
+            await self.bfm.wait_cs_release()
             
             await self.bfm.send_data_write((1,0,1,3,1))
 
@@ -166,12 +165,15 @@ class Driver(uvm_driver):
 
             await self.bfm.send_data_write((1,4,1,data.i_crv.tx_addr,1))
 
-            await FallingEdge(self.bfm.dut.o_byte_rx_done)
+            await self.bfm.wait_rx_done()
 
             await self.bfm.send_data_write((1,0,1,255,1))
-            await FallingEdge(self.bfm.dut.o_dv)  
+            await self.bfm.wait_dv()  
             await self.bfm.send_data_read((1,5,1))
             
+            self.op_ap.write((WR_ENABLE,0,None))
+            self.op_ap.write((PAGE_PROGRAM,data.i_crv.tx_addr,[data.i_crv.tx_data]))
+            self.op_ap.write((RD_DATA,data.i_crv.tx_addr,1))
             result = await self.bfm.get_result()
             self.ap.write(result)
             data.result = result
@@ -182,6 +184,8 @@ class Driver(uvm_driver):
 class Driver_Fast_Read(uvm_driver):
     def build_phase(self):
         self.ap = uvm_analysis_port("ap", self)
+        # flash commands issued, replayed by the scoreboard on the reference model
+        self.op_ap = uvm_analysis_port("op_ap", self)
 
     def start_of_simulation_phase(self):
         self.bfm = AxilFlashBfm()
@@ -194,26 +198,14 @@ class Driver_Fast_Read(uvm_driver):
         await self.launch_tb()
         while True:
 
-            self.bfm.dut.S_AXI_AWVALID.value = 1
-            self.bfm.dut.S_AXI_AWADDR.value = 0
-            self.bfm.dut.S_AXI_WVALID.value = 1
-            self.bfm.dut.S_AXI_WDATA.value = 6
-            self.bfm.dut.S_AXI_BREADY.value = 1
-            
-            await FallingEdge(self.bfm.dut.o_s_n)
-            await ClockCycles(self.bfm.dut.S_AXI_ACLK,100)
-
-            await RisingEdge(self.bfm.dut.S_AXI_ACLK)
-        
-            self.bfm.dut.S_AXI_AWVALID.value = 0
-            self.bfm.dut.S_AXI_WVALID.value = 0
+            await self.bfm.send_held_write(0,6)
 
 
-            await FallingEdge(self.bfm.dut.o_byte_tx_done)
+            await self.bfm.wait_tx_done()
       
             await self.bfm.send_data_write((1,0,1,2,1))
 
-            await FallingEdge(self.bfm.dut.o_byte_tx_done)  
+            await self.bfm.wait_tx_done()  
 
             await self.bfm.send_data_write((1,2,1,0,1))
 
@@ -224,10 +216,10 @@ class Driver_Fast_Read(uvm_driver):
             await self.bfm.send_data_write((1,1,1,data.i_crv.tx_data,1))
 
             await self.bfm.send_data_write((1,7,1,255,1))
-            await FallingEdge(self.bfm.dut.o_byte_tx_done)     
+            await self.bfm.wait_tx_done()     
 
             await self.bfm.send_data_write((1,0,1,255,1))
-            await ClockCycles(self.bfm.dut.S_AXI_ACLK,5)
+            await self.bfm.wait_cs_release()
             
             await self.bfm.send_data_write((1,0,1,11,1))
 
@@ -237,12 +229,15 @@ class Driver_Fast_Read(uvm_driver):
 
             await self.bfm.send_data_write((1,4,1,data.i_crv.tx_addr,1))
 
-            await FallingEdge(self.bfm.dut.o_byte_rx_done)
+            await self.bfm.wait_rx_done()
 
             await self.bfm.send_data_write((1,0,1,255,1))
-            await FallingEdge(self.bfm.dut.o_dv)  
+            await self.bfm.wait_dv()  
             await self.bfm.send_data_read((1,5,1))
             
+            self.op_ap.write((WR_ENABLE,0,None))
+            self.op_ap.write((PAGE_PROGRAM,data.i_crv.tx_addr,[data.i_crv.tx_data]))
+            self.op_ap.write((F_RD_DATA,data.i_crv.tx_addr,1))
             result = await self.bfm.get_result()
             self.ap.write(result)
             data.result = result
@@ -253,6 +248,8 @@ class Driver_Fast_Read(uvm_driver):
 class Driver_Page_RW(uvm_driver):
     def build_phase(self):
         self.ap = uvm_analysis_port("ap", self)
+        # flash commands issued, replayed by the scoreboard on the reference model
+        self.op_ap = uvm_analysis_port("op_ap", self)
 
     def start_of_simulation_phase(self):
         self.bfm = AxilFlashBfm()
@@ -265,23 +262,11 @@ class Driver_Page_RW(uvm_driver):
         await self.launch_tb()
         while True:
 
-            self.bfm.dut.S_AXI_AWVALID.value = 1
-            self.bfm.dut.S_AXI_AWADDR.value = 0
-            self.bfm.dut.S_AXI_WVALID.value = 1
-            self.bfm.dut.S_AXI_WDATA.value = 6
-            self.bfm.dut.S_AXI_BREADY.value = 1
-            
-            await FallingEdge(self.bfm.dut.o_s_n)
-            await ClockCycles(self.bfm.dut.S_AXI_ACLK,100)
-
-            await RisingEdge(self.bfm.dut.S_AXI_ACLK)
-            # await RisingEdge(self.bfm.dut.S_AXI_BVALID)
-            self.bfm.dut.S_AXI_AWVALID.value = 0
-            self.bfm.dut.S_AXI_WVALID.value = 0
-            await FallingEdge(self.bfm.dut.o_byte_tx_done)
+            await self.bfm.send_held_write(0,6)
+            await self.bfm.wait_tx_done()
       
             await self.bfm.send_data_write((1,0,1,2,1))
-            await FallingEdge(self.bfm.dut.o_byte_tx_done)  
+            await self.bfm.wait_tx_done()  
 
             await self.bfm.send_data_write((1,2,1,0,1))
 
@@ -290,17 +275,19 @@ class Driver_Page_RW(uvm_driver):
             await self.bfm.send_data_write((1,4,1,0,1))
 
 
-            for i in range(16):
+            page = []
+            for i in range(page_size()):
 
                 data = await self.seq_item_port.get_next_item()
+                page.append(data.i_crv.tx_data)
                 await self.bfm.send_data_write((1,1,1,data.i_crv.tx_data,1))
                 
                 await self.bfm.send_data_write((1,7,1,255,1))
-                await FallingEdge(self.bfm.dut.o_byte_tx_done)     
+                await self.bfm.wait_tx_done()     
                 self.seq_item_port.item_done()
 
             await self.bfm.send_data_write((1,0,1,255,1))
-            await ClockCycles(self.bfm.dut.S_AXI_ACLK,10)
+            await self.bfm.wait_cs_release()
             
             await self.bfm.send_data_write((1,0,1,3,1))
 
@@ -309,13 +296,15 @@ class Driver_Page_RW(uvm_driver):
             await self.bfm.send_data_write((1,3,1,0,1))
 
             await self.bfm.send_data_write((1,4,1,0,1))
-            await FallingEdge(self.bfm.dut.o_byte_rx_done)
+            await self.bfm.wait_rx_done()
+            self.op_ap.write((WR_ENABLE,0,None))
+            self.op_ap.write((PAGE_PROGRAM,0,page))
+            self.op_ap.write((RD_DATA,0,page_size()))
 
-            for i in range(16):
+            for i in range(page_size()):
 
                 await self.bfm.send_data_write((1,5,1,0,1))
-                await RisingEdge(self.bfm.dut.o_dv)
-                await RisingEdge(self.bfm.dut.S_AXI_ACLK)
+                await self.bfm.wait_rx_byte()
                 await self.bfm.send_data_read((1,5,1))
 
                 result = await self.bfm.get_result()
@@ -369,7 +358,7 @@ class CoveragePage(uvm_subscriber):
             disable_errors = False
         if not disable_errors:
             # if len(set(covered_values) - self.cvg) > 0:
-            if len(self.cvg) != 16:
+            if len(self.cvg) != page_size():
                 self.logger.error(
                     f"Functional coverage error. Missed: {set(covered_values)-self.cvg}")   
                 assert False
@@ -386,30 +375,65 @@ class Scoreboard(uvm_component):
         self.result_get_port = uvm_get_port("result_get_port", self)
         self.data_export = self.data_fifo.analysis_export
         self.result_export = self.result_fifo.analysis_export
+        self.op_fifo = uvm_tlm_analysis_fifo("op_fifo", self)
+        self.op_get_port = uvm_get_port("op_get_port", self)
+        self.op_export = self.op_fifo.analysis_export
+        self.spi_fifo = uvm_tlm_analysis_fifo("spi_fifo", self)
+        self.spi_get_port = uvm_get_port("spi_get_port", self)
+        self.spi_export = self.spi_fifo.analysis_export
 
     def connect_phase(self):
         self.data_get_port.connect(self.data_fifo.get_export)
         self.result_get_port.connect(self.result_fifo.get_export)
+        self.op_get_port.connect(self.op_fifo.get_export)
+        self.spi_get_port.connect(self.spi_fifo.get_export)
+
+    def predict(self):
+        # replay the driven flash commands on the reference model of the flash
+        # behind the toplevel, every read gives the bytes the dut must return
+        model = FlashRefModel.for_dut(cocotb.top)
+        predicted = []
+        while self.op_get_port.can_get():
+            _, (cmd, addr, payload) = self.op_get_port.try_get()
+            rx = model.command(cmd, addr, payload)
+            if cmd in (RD_DATA, F_RD_DATA):
+                predicted.extend(rx)
+        return predicted
+
+    def spi_summary(self):
+        # what went out on the spi pins, as seen by the spi monitor
+        opcodes = {}
+        while self.spi_get_port.can_get():
+            _, spi = self.spi_get_port.try_get()
+            self.logger.debug(str(spi))
+            opcodes[spi.opcode] = opcodes.get(spi.opcode, 0) + 1
+        self.logger.info(f"spi transactions per opcode : {opcodes}")
 
     def check_phase(self):
         passed = True
+        self.spi_summary()
         try:
             self.errors = ConfigDB().get(self, "", "CREATE_ERRORS")
         except UVMConfigItemNotFound:
             self.errors = False
+        predicted = self.predict()
         while self.result_get_port.can_get():
             _, actual_result = self.result_get_port.try_get()
             data_success, data = self.data_get_port.try_get()
             if not data_success:
                 self.logger.critical(f"result {actual_result} had no command")
+            elif not predicted:
+                self.logger.critical(f"result {actual_result} had no prediction")
+                passed = False
             else:
                 # (i_wr,i_rd,i_tx_data) = data
-                if int(data) == int(actual_result):
+                expected = predicted.pop(0)
+                if expected == int(actual_result):
                     self.logger.info("PASSED")
-                    print("i_tx_data is {}, rx_data is {}".format(int(data),int(actual_result)))
+                    print("i_tx_data is {}, expected is {}, rx_data is {}".format(int(data),expected,int(actual_result)))
                 else:
                     self.logger.error("FAILED")
-                    print("i_tx_data is {}, rx_data is {}".format(int(data),int(actual_result)))
+                    print("i_tx_data is {}, expected is {}, rx_data is {}".format(int(data),expected,int(actual_result)))
                     passed = False
         assert passed
 
@@ -438,6 +462,7 @@ class Env(uvm_env):
         ConfigDB().set(None, "*", "SEQR", self.seqr)
         self.driver = Driver.create("driver", self)
         self.data_mon = Monitor("data_mon", self, "get_data")
+        self.spi_mon = Monitor("spi_mon", self, "get_spi")
         self.coverage = Coverage("coverage", self)
         self.scoreboard = Scoreboard("scoreboard", self)
 
@@ -446,6 +471,8 @@ class Env(uvm_env):
         self.data_mon.ap.connect(self.scoreboard.data_export)
         self.data_mon.ap.connect(self.coverage.analysis_export)
         self.driver.ap.connect(self.scoreboard.result_export)
+        self.driver.op_ap.connect(self.scoreboard.op_export)
+        self.spi_mon.ap.connect(self.scoreboard.spi_export)
 
 
 class Env_Fast_Read(uvm_env):
@@ -455,6 +482,7 @@ class Env_Fast_Read(uvm_env):
         ConfigDB().set(None, "*", "SEQR", self.seqr)
         self.driver = Driver_Fast_Read.create("driver", self)
         self.data_mon = Monitor("data_mon", self, "get_data")
+        self.spi_mon = Monitor("spi_mon", self, "get_spi")
         self.coverage = Coverage("coverage", self)
         self.scoreboard = Scoreboard("scoreboard", self)
 
@@ -463,6 +491,8 @@ class Env_Fast_Read(uvm_env):
         self.data_mon.ap.connect(self.scoreboard.data_export)
         self.data_mon.ap.connect(self.coverage.analysis_export)
         self.driver.ap.connect(self.scoreboard.result_export)
+        self.driver.op_ap.connect(self.scoreboard.op_export)
+        self.spi_mon.ap.connect(self.scoreboard.spi_export)
 
 class Env_Page_RW(uvm_env):
 
@@ -471,6 +501,7 @@ class Env_Page_RW(uvm_env):
         ConfigDB().set(None, "*", "SEQR", self.seqr)
         self.driver = Driver_Page_RW.create("driver", self)
         self.data_mon = Monitor("data_mon", self, "get_data")
+        self.spi_mon = Monitor("spi_mon", self, "get_spi")
         self.coverage = CoveragePage("coverage", self)
         self.scoreboard = Scoreboard("scoreboard", self)
 
@@ -479,8 +510,11 @@ class Env_Page_RW(uvm_env):
         self.data_mon.ap.connect(self.scoreboard.data_export)
         self.data_mon.ap.connect(self.coverage.analysis_export)
         self.driver.ap.connect(self.scoreboard.result_export)
+        self.driver.op_ap.connect(self.scoreboard.op_export)
+        self.spi_mon.ap.connect(self.scoreboard.spi_export)
 
 @pyuvm.test()
+@profiled
 class Test(uvm_test):
     """Check results for serial flash controller writing and reading 1 item at a time"""
     # write enable -> write random data to random address -> read data from that random address
@@ -498,8 +532,10 @@ class Test(uvm_test):
 
     async def run_phase(self):
         self.raise_objection()
-        cocotb.start_soon(Clock(self.bfm.dut.S_AXI_ACLK, 10, units="ns").start())
+        self.bfm.start_clock(10)
         await self.test_all.start()
+        self.logger.info(f"driver skipped {self.bfm.avoided_edges} idle clock edges")
+        self.logger.info(f"driver elided {self.bfm.writes_elided} unchanged register writes")
 
         coverage_db.report_coverage(cocotb.log.info,bins=True)
         coverage_db.export_to_xml(filename="coverage.xml")
@@ -507,6 +543,7 @@ class Test(uvm_test):
 
 
 @pyuvm.test()
+@profiled
 class Test_Fast_Read(uvm_test):
     """Check results for serial flash controller writing and reading (fast read) 1 item at a time"""
     # write enable -> write random data to random address -> fast read data from that random address
@@ -524,8 +561,10 @@ class Test_Fast_Read(uvm_test):
 
     async def run_phase(self):
         self.raise_objection()
-        cocotb.start_soon(Clock(self.bfm.dut.S_AXI_ACLK, 10, units="ns").start())
+        self.bfm.start_clock(10)
         await self.test_all.start()
+        self.logger.info(f"driver skipped {self.bfm.avoided_edges} idle clock edges")
+        self.logger.info(f"driver elided {self.bfm.writes_elided} unchanged register writes")
 
         coverage_db.report_coverage(cocotb.log.info,bins=True)
         coverage_db.export_to_xml(filename="coverage_fast_read.xml")
@@ -533,6 +572,7 @@ class Test_Fast_Read(uvm_test):
 
 
 @pyuvm.test()
+@profiled
 class Test_Page_RW(uvm_test):
     """Check results and coverage for serial flash controller writing and reading whole pages"""
     # write enable -> write random data to a page (progr. whole page) ->
@@ -551,8 +591,10 @@ class Test_Page_RW(uvm_test):
 
     async def run_phase(self):
         self.raise_objection()
-        cocotb.start_soon(Clock(self.bfm.dut.S_AXI_ACLK, 10, units="ns").start())
+        self.bfm.start_clock(10)
         await self.test_all.start()
+        self.logger.info(f"driver skipped {self.bfm.avoided_edges} idle clock edges")
+        self.logger.info(f"driver elided {self.bfm.writes_elided} unchanged register writes")
 
         coverage_db.report_coverage(cocotb.log.info,bins=True)
         coverage_db.export_to_xml(filename="coverage_page_rw.xml")
@@ -0,0 +1,27 @@
+import importlib
+import pytest
+import tlm_runner
+
+
+# the pyuvm tests on the transaction level model, no simulator involved
+@pytest.mark.parametrize("module,toplevel", [
+    ("tb_pyuvm", "top"),
+    ("tb_pyuvm", "flash_top"),
+    ("tb_pyuvm_axi", "top_axi"),
+    ("tb_pyuvm_axi", "flash_top_axi")])
+@pytest.mark.parametrize("test", ["Test", "Test_Fast_Read", "Test_Page_RW"])
+def test_tlm(module, toplevel, test):
+    tb = importlib.import_module(module)
+    tlm_runner.run_test(getattr(tb, test), toplevel)
+
+
+@pytest.mark.parametrize("module,toplevel,bfm", [
+    ("tb_pyuvm", "top", "FlashBfm"),
+    ("tb_pyuvm_axi", "top_axi", "AxilFlashBfm")])
+@pytest.mark.parametrize("test", ["Test", "Test_Page_RW"])
+def test_tlm_elided_writes(module, toplevel, bfm, test):
+    # the high and middle address bytes stay 0 for the whole run, their writes after the
+    # first one are dropped by the bfm
+    tb = importlib.import_module(module)
+    tlm_runner.run_test(getattr(tb, test), toplevel)
+    assert getattr(tb, bfm)().writes_elided > 0
@@ -0,0 +1,39 @@
+# Runs the pyuvm tests on the transaction level model of the flash controller
+# (cocotb_sim/flash_tlm.py) instead of the GHDL simulation, for sequence debugging.
+# GHDL runs (make) stay the reference for signoff.
+#
+#   python tlm_runner.py tb_pyuvm Test top
+#   python tlm_runner.py tb_pyuvm_axi Test_Page_RW flash_top_axi
+import os
+import sys
+import time
+import logging
+import importlib
+
+os.environ["FLASH_BACKEND"] = "tlm"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cocotb_sim"))
+
+import cocotb
+from pyuvm import uvm_root
+from flash_tlm import FlashTlmTop, TlmScheduler
+
+
+def run_test(test, toplevel):
+    """Run a pyuvm test class on the transaction level model of toplevel"""
+    cocotb.top = FlashTlmTop(toplevel)
+    cocotb.log = logging.getLogger("cocotb")
+    cocotb.scheduler = TlmScheduler()
+    cocotb.scheduler.run(uvm_root().run_test(test))
+
+
+def main():
+    (module, test, toplevel) = sys.argv[1:4]
+    logging.basicConfig(level=logging.INFO)
+    tb = importlib.import_module(module)
+    start = time.perf_counter()
+    run_test(getattr(tb, test), toplevel)
+    print(f"{module}.{test} on {toplevel} : {time.perf_counter() - start:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,99 @@
 
-from cocotb.triggers import Timer,RisingEdge,FallingEdge,ClockCycles
+from cocotb.triggers import Timer,RisingEdge,FallingEdge,ClockCycles,Event
 from cocotb.clock import Clock
 from cocotb.queue import QueueEmpty, Queue
+from cocotb.utils import get_sim_time
 import cocotb
 import enum
+import os
 import random
 from cocotb_coverage import crv 
 from cocotb_coverage.coverage import CoverCross,CoverPoint,coverage_db
 from pyuvm import utility_classes
-
+from flash_host import RD_STATUS_REG,PAGE_PROGRAM,SECTOR_ERASE,RD_DATA,F_RD_DATA,SHADOWED_REGS
+
+
+
+class SpiTransaction:
+    """One chip-select window of the spi bus, decoded into a flash command"""
+    # opcodes followed by a 24 bit address, and those whose data comes from the flash
+    ADDR_OPCODES = (PAGE_PROGRAM, SECTOR_ERASE, RD_DATA, F_RD_DATA)
+    READ_OPCODES = (RD_STATUS_REG, RD_DATA, F_RD_DATA)
+
+    def __init__(self, mosi, miso, nbits, start=None, end=None):
+        # mosi / miso hold the bits of the window, first bit sent as the msb,
+        # a trailing partial byte is dropped
+        nbytes = nbits // 8
+        extra = nbits - 8 * nbytes
+        self.nbits = nbits
+        self.start = start
+        self.end = end
+        self.mosi = (mosi >> extra).to_bytes(nbytes, "big")
+        self.miso = (miso >> extra).to_bytes(nbytes, "big")
+        self.opcode = self.mosi[0] if nbytes else None
+        self.addr = None
+        self.dummy = b""
+        pos = 1
+        if self.opcode in self.ADDR_OPCODES:
+            self.addr = int.from_bytes(self.mosi[1:4], "big")
+            pos = 4
+        if self.opcode == F_RD_DATA:
+            self.dummy = self.mosi[4:5]
+            pos = 5
+        if self.opcode in self.READ_OPCODES:
+            self.data = self.miso[pos:]
+        else:
+            self.data = self.mosi[pos:]
+
+    def __str__(self):
+        addr = "" if self.addr is None else f" addr 0x{self.addr:06x}"
+        return f"spi opcode {self.opcode}{addr} dummy {self.dummy.hex()} data {self.data.hex()}"
+
+
+class SpiMonitor:
+    # passive monitor of the spi bus (mode 3 : both sides sample on the rising edge
+    # of o_c). bits are shifted into integers, the bytes are only cut out once
+    # chip-select is released
+    def __init__(self, dut, queue):
+        self.dut = dut
+        self.queue = queue
+        self.active = False
+        self.mosi = 0
+        self.miso = 0
+        self.nbits = 0
+        self.start = None
+
+    async def sample(self):
+        sclk_edge = RisingEdge(self.dut.o_c)
+        mosi_pin = self.dut.o_dq
+        # the toplevel i_dq is not used, the flash drives the controller's i_dq
+        miso_pin = self.dut.spi_flash_controller.i_dq
+        while True:
+            await sclk_edge
+            if self.active:
+                miso = miso_pin.value
+                self.mosi = (self.mosi << 1) | int(mosi_pin.value)
+                self.miso = (self.miso << 1) | (int(miso) if miso.is_resolvable else 1)
+                self.nbits += 1
+
+    async def window(self):
+        cs_fall = FallingEdge(self.dut.o_s_n)
+        cs_rise = RisingEdge(self.dut.o_s_n)
+        while True:
+            await cs_fall
+            self.mosi = 0
+            self.miso = 0
+            self.nbits = 0
+            self.start = get_sim_time("ns")
+            self.active = True
+            await cs_rise
+            self.active = False
+            self.queue.put_nowait(SpiTransaction(
+                self.mosi, self.miso, self.nbits, self.start, get_sim_time("ns")))
+
+    def start_monitor(self):
+        cocotb.start_soon(self.sample())
+        cocotb.start_soon(self.window())
 
 
 class FlashBfm(metaclass=utility_classes.Singleton):
@@ -17,9 +102,55 @@ class FlashBfm(metaclass=utility_classes.Singleton):
         self.driver_queue = Queue(maxsize=1)
         self.data_mon_queue = Queue(maxsize=0)
         self.result_mon_queue = Queue(maxsize=0)
+        self.spi_mon_queue = Queue(maxsize=0)
+        self.burst_done = Event()
+        self.driver_wake = Event()
+        # clock edges the driver slept through instead of polling the queue
+        self.avoided_edges = 0
+        self.clk_period = None
+        # register -> value last written (flash_host.SHADOWED_REGS), writes of the same
+        # value again are dropped
+        self.shadow = {}
+        self.writes_elided = 0
+
+    def elide(self, item):
+        # True when the (i_we,i_stb,i_addr,i_data) entry would leave a shadowed register as it is
+        (i_we,i_stb,i_addr,i_data) = item
+        if not (i_we and i_stb) or i_addr not in SHADOWED_REGS:
+            return False
+        if self.shadow.get(i_addr) == i_data:
+            self.writes_elided += 1
+            return True
+        self.shadow[i_addr] = i_data
+        return False
 
     async def send_data(self, data):
+        if self.elide(data):
+            return
         await self.driver_queue.put(data)
+        self.driver_wake.set()
+
+    async def send_burst(self, vectors):
+        # hand a whole list of (i_we,i_stb,i_addr,i_data) entries to the driver,
+        # which applies them on consecutive clocks. returns once the last entry is applied
+        vectors = [item for item in vectors if not self.elide(item)]
+        if not vectors:
+            return
+        self.burst_done.clear()
+        await self.driver_queue.put(vectors)
+        self.driver_wake.set()
+        await self.burst_done.wait()
+
+    async def send_page(self, data):
+        # data phase of a page program : every byte goes to register 1 as soon as the
+        # controller took the previous one (o_byte_tx_done, which clears o_new_tx_req),
+        # keeping the spi transaction continuous. returns the bytes per second achieved
+        start = get_sim_time("ns")
+        for byte in data:
+            await self.send_burst([(1,1,1,byte),(1,1,7,255),(1,0,7,255)])
+            await self.wait_tx_done()
+        elapsed = get_sim_time("ns") - start
+        return len(data) * 10**9 / elapsed if elapsed else 0
 
     async def get_data(self):
         data = await self.data_mon_queue.get()
@@ -29,7 +160,12 @@ class FlashBfm(metaclass=utility_classes.Singleton):
         result = await self.result_mon_queue.get()
         return result
 
+    async def get_spi(self):
+        transaction = await self.spi_mon_queue.get()
+        return transaction
+
     async def reset(self):
+        self.shadow = {}
         await RisingEdge(self.dut.i_clk)
         self.dut.i_arstn.value = 0
         self.dut.i_we.value = 0
@@ -39,22 +175,74 @@ class FlashBfm(metaclass=utility_classes.Singleton):
         self.dut.i_dq.value = 0  
         await ClockCycles(self.dut.i_clk,5)
         self.dut.i_arstn.value = 1
+        start = get_sim_time("step")
+        await RisingEdge(self.dut.i_clk)
+        self.clk_period = get_sim_time("step") - start
+
+    def start_clock(self, period_ns):
+        cocotb.start_soon(Clock(self.dut.i_clk, period_ns, units="ns").start())
+
+    async def wait_clocks(self, cycles):
+        await ClockCycles(self.dut.i_clk, cycles)
+
+    async def wait_cs_release(self):
+        # the spi transaction closed by the last NOP is over
+        if self.dut.o_s_n.value.binstr == "0":
+            await RisingEdge(self.dut.o_s_n)
+
+    async def wait_tx_done(self):
+        # the controller took the current byte and started sending it
+        await FallingEdge(self.dut.o_byte_tx_done)
+
+    async def wait_rx_done(self):
+        await FallingEdge(self.dut.o_byte_rx_done)
+
+    async def wait_dv(self):
+        await FallingEdge(self.dut.o_dv)
+
+    async def wait_rx_byte(self):
+        await RisingEdge(self.dut.o_dv)
         await RisingEdge(self.dut.i_clk)
 
 
+    async def wait_for_item(self, queue, wake):
+        # sleep until something is queued instead of polling on every clock edge,
+        # the item itself is still taken from the queue on the next rising edge
+        if queue.empty():
+            wake.clear()
+            start = get_sim_time("step")
+            await wake.wait()
+            if self.clk_period:
+                self.avoided_edges += (get_sim_time("step") - start) // self.clk_period
+
     async def driver_bfm(self):
+        we = self.dut.i_we
+        stb = self.dut.i_stb
+        addr = self.dut.i_addr
+        data = self.dut.i_data
+        clk_edge = RisingEdge(self.dut.i_clk)
 
         while True:
-            await RisingEdge(self.dut.i_clk)
-            try:
-                (i_we,i_stb,i_addr,i_data) = self.driver_queue.get_nowait()
-                self.dut.i_we.value = i_we
-                self.dut.i_stb.value = i_stb
-                self.dut.i_addr.value = i_addr
-                self.dut.i_data.value = i_data
-
-            except QueueEmpty:
-                pass
+            await self.wait_for_item(self.driver_queue, self.driver_wake)
+            await clk_edge
+            item = self.driver_queue.get_nowait()
+
+            if isinstance(item, list):
+                # burst : one entry per clock, no queue round-trip in between
+                for i, (i_we,i_stb,i_addr,i_data) in enumerate(item):
+                    if i:
+                        await clk_edge
+                    we.value = i_we
+                    stb.value = i_stb
+                    addr.value = i_addr
+                    data.value = i_data
+                self.burst_done.set()
+            else:
+                (i_we,i_stb,i_addr,i_data) = item
+                we.value = i_we
+                stb.value = i_stb
+                addr.value = i_addr
+                data.value = i_data
 
     async def data_mon_bfm(self):
         while True:
@@ -75,6 +263,7 @@ class FlashBfm(metaclass=utility_classes.Singleton):
         cocotb.start_soon(self.driver_bfm())
         cocotb.start_soon(self.data_mon_bfm())
         cocotb.start_soon(self.result_mon_bfm())
+        SpiMonitor(self.dut, self.spi_mon_queue).start_monitor()
 
 
 
@@ -85,12 +274,35 @@ class AxilFlashBfm(metaclass=utility_classes.Singleton):
         self.driver_queue_read = Queue(maxsize=1)
         self.data_mon_queue = Queue(maxsize=0)
         self.result_mon_queue = Queue(maxsize=0)
+        self.spi_mon_queue = Queue(maxsize=0)
+        self.driver_wake_write = Event()
+        self.driver_wake_read = Event()
+        # clock edges the drivers slept through instead of polling the queues
+        self.avoided_edges = 0
+        self.clk_period = None
+        self.shadow = {}
+        self.writes_elided = 0
+
+    def elide(self, awaddr, wdata):
+        # True when the write would leave a shadowed register as it is
+        if awaddr not in SHADOWED_REGS:
+            return False
+        if self.shadow.get(awaddr) == wdata:
+            self.writes_elided += 1
+            return True
+        self.shadow[awaddr] = wdata
+        return False
 
     async def send_data_write(self, data):
+        (awvalid,awaddr,wvalid,wdata,bready) = data
+        if awvalid and wvalid and self.elide(awaddr, wdata):
+            return
         await self.driver_queue_write.put(data)
+        self.driver_wake_write.set()
 
     async def send_data_read(self, data):
         await self.driver_queue_read.put(data)
+        self.driver_wake_read.set()
 
     async def get_data(self):
         data = await self.data_mon_queue.get()
@@ -100,8 +312,13 @@ class AxilFlashBfm(metaclass=utility_classes.Singleton):
         result = await self.result_mon_queue.get()
         return result
 
+    async def get_spi(self):
+        transaction = await self.spi_mon_queue.get()
+        return transaction
+
     async def reset(self):
         # await RisingEdge(self.dut.S_AXI_ACLK)
+        self.shadow = {}
         self.dut.S_AXI_ARESETN.value = 0
         self.dut.S_AXI_AWVALID.value = 0
         self.dut.S_AXI_AWADDR.value = 0
@@ -114,48 +331,93 @@ class AxilFlashBfm(metaclass=utility_classes.Singleton):
         self.dut.S_AXI_RREADY.value = 0
         await ClockCycles(self.dut.S_AXI_ACLK,5)
         self.dut.S_AXI_ARESETN.value = 1
+        start = get_sim_time("step")
         await RisingEdge(self.dut.S_AXI_ACLK)
+        self.clk_period = get_sim_time("step") - start
+
+    def start_clock(self, period_ns):
+        cocotb.start_soon(Clock(self.dut.S_AXI_ACLK, period_ns, units="ns").start())
+
+    async def wait_clocks(self, cycles):
+        await ClockCycles(self.dut.S_AXI_ACLK, cycles)
+
+    async def wait_cs_release(self):
+        if self.dut.o_s_n.value.binstr == "0":
+            await RisingEdge(self.dut.o_s_n)
+
+    async def wait_tx_done(self):
+        await FallingEdge(self.dut.o_byte_tx_done)
+
+    async def wait_rx_done(self):
+        await FallingEdge(self.dut.o_byte_rx_done)
+
+    async def wait_dv(self):
+        await FallingEdge(self.dut.o_dv)
+
+    async def wait_rx_byte(self):
+        await RisingEdge(self.dut.o_dv)
+        await RisingEdge(self.dut.S_AXI_ACLK)
+
+    async def send_held_write(self, awaddr, wdata):
+        # keep the write valid until the flash is selected and for 100 more clocks. it waits
+        # for the spi side, so it always goes out, the shadow only follows it
+        if awaddr in SHADOWED_REGS:
+            self.shadow[awaddr] = wdata
+        self.dut.S_AXI_AWVALID.value = 1
+        self.dut.S_AXI_AWADDR.value = awaddr
+        self.dut.S_AXI_WVALID.value = 1
+        self.dut.S_AXI_WDATA.value = wdata
+        self.dut.S_AXI_BREADY.value = 1
+
+        await FallingEdge(self.dut.o_s_n)
+        await ClockCycles(self.dut.S_AXI_ACLK,100)
+
+        await RisingEdge(self.dut.S_AXI_ACLK)
+        self.dut.S_AXI_AWVALID.value = 0
+        self.dut.S_AXI_WVALID.value = 0
+
+    async def wait_for_item(self, queue, wake):
+        if queue.empty():
+            wake.clear()
+            start = get_sim_time("step")
+            await wake.wait()
+            if self.clk_period:
+                self.avoided_edges += (get_sim_time("step") - start) // self.clk_period
 
 
     async def driver_bfm_write(self):
 
         while True:
+            await self.wait_for_item(self.driver_queue_write, self.driver_wake_write)
             await RisingEdge(self.dut.S_AXI_ACLK)
-            try:
-
-                (awvalid,awaddr,wvalid,wdata,bready) = self.driver_queue_write.get_nowait()
-                self.dut.S_AXI_AWVALID.value = awvalid
-                self.dut.S_AXI_AWADDR.value = awaddr
-                self.dut.S_AXI_WVALID.value = wvalid
-                self.dut.S_AXI_WDATA.value = wdata
-                self.dut.S_AXI_BREADY.value = bready
 
-                await RisingEdge(self.dut.S_AXI_ACLK)
-                await RisingEdge(self.dut.S_AXI_BVALID)
-                self.dut.S_AXI_AWVALID.value = 0
-                self.dut.S_AXI_WVALID.value = 0
-                await RisingEdge(self.dut.S_AXI_ACLK)
+            (awvalid,awaddr,wvalid,wdata,bready) = self.driver_queue_write.get_nowait()
+            self.dut.S_AXI_AWVALID.value = awvalid
+            self.dut.S_AXI_AWADDR.value = awaddr
+            self.dut.S_AXI_WVALID.value = wvalid
+            self.dut.S_AXI_WDATA.value = wdata
+            self.dut.S_AXI_BREADY.value = bready
 
-            except QueueEmpty:
-                pass
+            await RisingEdge(self.dut.S_AXI_ACLK)
+            await RisingEdge(self.dut.S_AXI_BVALID)
+            self.dut.S_AXI_AWVALID.value = 0
+            self.dut.S_AXI_WVALID.value = 0
+            await RisingEdge(self.dut.S_AXI_ACLK)
 
     async def driver_bfm_read(self):
 
         while True:
+            await self.wait_for_item(self.driver_queue_read, self.driver_wake_read)
             await RisingEdge(self.dut.S_AXI_ACLK)
-            try:
-
-                (arvalid,araddr,rready) = self.driver_queue_read.get_nowait()
-                self.dut.S_AXI_ARVALID.value = arvalid
-                self.dut.S_AXI_ARADDR.value = araddr
-                self.dut.S_AXI_RREADY.value = rready
 
-                await FallingEdge(self.dut.S_AXI_RVALID)
-                self.dut.S_AXI_ARVALID.value = 0
-                await RisingEdge(self.dut.S_AXI_ACLK)
+            (arvalid,araddr,rready) = self.driver_queue_read.get_nowait()
+            self.dut.S_AXI_ARVALID.value = arvalid
+            self.dut.S_AXI_ARADDR.value = araddr
+            self.dut.S_AXI_RREADY.value = rready
 
-            except QueueEmpty:
-                pass
+            await FallingEdge(self.dut.S_AXI_RVALID)
+            self.dut.S_AXI_ARVALID.value = 0
+            await RisingEdge(self.dut.S_AXI_ACLK)
 
 
     async def data_mon_bfm(self):
@@ -178,4 +440,123 @@ class AxilFlashBfm(metaclass=utility_classes.Singleton):
         cocotb.start_soon(self.driver_bfm_write())
         cocotb.start_soon(self.driver_bfm_read())
         cocotb.start_soon(self.data_mon_bfm())
-        cocotb.start_soon(self.result_mon_bfm())
\ No newline at end of file
+        cocotb.start_soon(self.result_mon_bfm())
+        SpiMonitor(self.dut, self.spi_mon_queue).start_monitor()
+
+
+
+class TlmFlashBfm(FlashBfm):
+    # transaction level backend : register accesses go straight to the python model of
+    # the controller and flash (cocotb_sim/flash_tlm.py), waits on the controller return at once
+    def __init__(self):
+        super().__init__()
+        self.ctrl = self.dut.ctrl
+
+    def access(self, item):
+        (i_we,i_stb,i_addr,i_data) = item
+        if not i_stb:
+            return
+        if i_we:
+            self.ctrl.write_reg(i_addr, i_data)
+            if i_addr == 1:
+                self.data_mon_queue.put_nowait(i_data)
+        else:
+            self.result_mon_queue.put_nowait(self.ctrl.read_reg(i_addr))
+
+    async def send_data(self, data):
+        if not self.elide(data):
+            self.access(data)
+
+    async def send_burst(self, vectors):
+        for item in vectors:
+            if not self.elide(item):
+                self.access(item)
+
+    async def send_page(self, data):
+        # no simulated time, no rate
+        for byte in data:
+            self.access((1,1,1,byte))
+        return 0
+
+    async def reset(self):
+        self.shadow = {}
+        self.ctrl.reset()
+
+    def start_clock(self, period_ns):
+        pass
+
+    async def wait_clocks(self, cycles):
+        pass
+
+    async def wait_cs_release(self):
+        pass
+
+    async def wait_tx_done(self):
+        pass
+
+    async def wait_rx_done(self):
+        pass
+
+    async def wait_dv(self):
+        pass
+
+    async def wait_rx_byte(self):
+        pass
+
+    def start_bfm(self):
+        pass
+
+
+class TlmAxilFlashBfm(AxilFlashBfm):
+    def __init__(self):
+        super().__init__()
+        self.ctrl = self.dut.ctrl
+
+    async def send_data_write(self, data):
+        (awvalid,awaddr,wvalid,wdata,bready) = data
+        if awvalid and wvalid and not self.elide(awaddr, wdata):
+            self.ctrl.write_reg(awaddr, wdata)
+            if awaddr == 1:
+                self.data_mon_queue.put_nowait(wdata)
+
+    async def send_data_read(self, data):
+        (arvalid,araddr,rready) = data
+        if arvalid:
+            self.result_mon_queue.put_nowait(self.ctrl.read_reg(araddr))
+
+    async def send_held_write(self, awaddr, wdata):
+        await self.send_data_write((1,awaddr,1,wdata,1))
+
+    async def reset(self):
+        self.shadow = {}
+        self.ctrl.reset()
+
+    def start_clock(self, period_ns):
+        pass
+
+    async def wait_clocks(self, cycles):
+        pass
+
+    async def wait_cs_release(self):
+        pass
+
+    async def wait_tx_done(self):
+        pass
+
+    async def wait_rx_done(self):
+        pass
+
+    async def wait_dv(self):
+        pass
+
+    async def wait_rx_byte(self):
+        pass
+
+    def start_bfm(self):
+        pass
+
+
+# FLASH_BACKEND=tlm swaps in the transaction level BFMs, see tlm_runner.py
+if os.environ.get("FLASH_BACKEND") == "tlm":
+    FlashBfm = TlmFlashBfm
+    AxilFlashBfm = TlmAxilFlashBfm
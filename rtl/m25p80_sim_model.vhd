@@ -3,6 +3,15 @@ use ieee.std_logic_1164.all;
 use ieee.numeric_std.all;
 
 entity m25p80_sim_model is
+	generic (
+			--memory geometry in bytes, powers of 2. The defaults are the reduced geometry
+			--used for the sake of simulation, the actual M25P80 is 1048576/256/65536
+			g_mem_size : natural := 1024;
+			g_page_size : natural := 16;
+			g_sector_size : natural := 64;
+			--keep only the programmed pages (protected type) instead of a signal array,
+			--for the full geometry. The memory is then not visible in the waveforms/backdoor
+			g_sparse_memory : boolean := false);
 	port (
 			i_clk : in std_ulogic;
 			C : in std_ulogic;
@@ -16,55 +25,42 @@ architecture rtl of m25p80_sim_model is
 --===============================================
 --Parameters Regarding Memory Attribute
 --===============================================
---These are the actual sizes of M25P80, below follow then 
---reduced numbers that we will use for the sake of simulation
-
---constant DATA_BITS : natural := 8;
-----Bytes in Memory, 8M bits = 1M bytes
---constant MEM_SIZE : natural := 1048576;
-----Address Bits for Whole Memory
---constant MEM_ADDR_BITS : natural := 20;
-----No. of Pages in Memory
---constant PAGES :natural := 4096;
-----No. of Bytes in Each Page
---constant PAGE_SIZE : natural := 256;
-----Address Bits for Page Access
---constant PAGE_ADDR_BITS : natural := 12;
-----Address Bits for Byte Access in One Page
---constant PAGE_OFFSET_BITS : natural := 8;
-----No. of Sectors in Memory
---constant SECTORS : natural := 16;
-----No. of Bytes in Each Sector
---constant SECTOR_SIZE  : natural := 65536;
-----Address Bits for Sector Access
---constant SECTOR_ADDR_BITS : natural := 4;
-----Address Bits for Byte Access in One Sector
---constant SECTOR_OFFSET_BITS :natural := 16;
-----No. of Lock Registers in Memory
---constant NO_LOCK_REG : natural := 46;	
-
+--These are the actual sizes of M25P80 (the generics give the reduced numbers that we use
+--for the sake of simulation by default)
+--Bytes in Memory, 8M bits = 1M bytes : 1048576
+--No. of Bytes in Each Page : 256
+--No. of Bytes in Each Sector : 65536
+
+function log2(n : natural) return natural is
+	variable v_bits : natural := 0;
+begin
+	while(2**v_bits < n) loop
+		v_bits := v_bits + 1;
+	end loop;
+	return v_bits;
+end function;
 
 constant DATA_BITS : natural := 8;
---Bytes in Memory, 8M bits = 1M bytes
-constant MEM_SIZE : natural := 1024;
+--Bytes in Memory
+constant MEM_SIZE : natural := g_mem_size;
 --Address Bits for Whole Memory
-constant MEM_ADDR_BITS : natural := 10;
+constant MEM_ADDR_BITS : natural := log2(MEM_SIZE);
 --No. of Pages in Memory
-constant PAGES :natural := 64;
+constant PAGES :natural := g_mem_size / g_page_size;
 --No. of Bytes in Each Page
-constant PAGE_SIZE : natural := 16;
+constant PAGE_SIZE : natural := g_page_size;
 --Address Bits for Page Access
-constant PAGE_ADDR_BITS : natural := 6;
+constant PAGE_ADDR_BITS : natural := log2(PAGES);
 --Address Bits for Byte Access in One Page
-constant PAGE_OFFSET_BITS : natural := 4;
+constant PAGE_OFFSET_BITS : natural := log2(PAGE_SIZE);
 --No. of Sectors in Memory
-constant SECTORS : natural := 16;
+constant SECTORS : natural := g_mem_size / g_sector_size;
 --No. of Bytes in Each Sector
-constant SECTOR_SIZE  : natural := 64;
+constant SECTOR_SIZE  : natural := g_sector_size;
 --Address Bits for Sector Access
-constant SECTOR_ADDR_BITS : natural := 4;
+constant SECTOR_ADDR_BITS : natural := log2(SECTORS);
 --Address Bits for Byte Access in One Sector
-constant SECTOR_OFFSET_BITS :natural := 6;
+constant SECTOR_OFFSET_BITS :natural := log2(SECTOR_SIZE);
 --No. of Lock Registers in Memory
 constant NO_LOCK_REG : natural := 46;
 
@@ -179,8 +175,67 @@ signal previous_op : std_ulogic_vector(1 downto 0) :=(others => '0');
 signal device_id,memory_address : std_logic_vector(23 downto 0) :=(others => '0');
 --signal device_id,memory_address : std_ulogic_vector(23 downto 0);
 
-type t_array is array(MEM_SIZE-1 downto 0) of std_ulogic_vector(DATA_BITS-1 downto 0);
+subtype t_byte is std_ulogic_vector(DATA_BITS-1 downto 0);
+constant ERASED_BYTE : t_byte := (others => '1');
+
+--sparse memory : a page table, a page is allocated when it is first programmed and
+--freed when it is erased, pages never programmed read as erased
+type t_sparse_memory is protected
+	procedure write(addr : natural; data : t_byte);
+	impure function read(addr : natural) return t_byte;
+	procedure erase(first : natural; size : natural);
+end protected t_sparse_memory;
+
+type t_sparse_memory is protected body
+	type t_page is array(0 to PAGE_SIZE-1) of t_byte;
+	type t_page_ptr is access t_page;
+	type t_page_table is array(0 to PAGES-1) of t_page_ptr;
+	variable pages : t_page_table;
+
+	procedure write(addr : natural; data : t_byte) is
+	begin
+		if(pages(addr / PAGE_SIZE) = null) then
+			pages(addr / PAGE_SIZE) := new t_page'(others => ERASED_BYTE);
+		end if;
+		pages(addr / PAGE_SIZE)(addr mod PAGE_SIZE) := data;
+	end procedure;
+
+	impure function read(addr : natural) return t_byte is
+	begin
+		if(pages(addr / PAGE_SIZE) = null) then
+			return ERASED_BYTE;
+		end if;
+		return pages(addr / PAGE_SIZE)(addr mod PAGE_SIZE);
+	end function;
+
+	procedure erase(first : natural; size : natural) is
+	begin
+		for p in first / PAGE_SIZE to (first + size) / PAGE_SIZE - 1 loop
+			deallocate(pages(p));
+		end loop;
+	end procedure;
+end protected body t_sparse_memory;
+
+function dense_size(sparse : boolean; size : natural) return natural is
+begin
+	if(sparse) then
+		return 1;
+	end if;
+	return size;
+end function;
+
+--the signal array is only elaborated at its full size without g_sparse_memory
+type t_array is array(dense_size(g_sparse_memory,MEM_SIZE)-1 downto 0) of t_byte;
 signal memory : t_array;
+shared variable sparse_memory : t_sparse_memory;
+
+impure function read_memory(addr : natural) return t_byte is
+begin
+	if(g_sparse_memory) then
+		return sparse_memory.read(addr);
+	end if;
+	return memory(addr);
+end function;
 type t_latch is array(PAGE_SIZE-1 downto 0) of std_ulogic_vector(DATA_BITS-1 downto 0);
 signal data_latch : t_latch;
 signal page_address : std_ulogic_vector(PAGE_ADDR_BITS-1 downto 0) :=(others => '0');
@@ -421,7 +476,9 @@ begin
 			dout <= force status_reg(sr_bit-1);
 			sr_bit <= force sr_bit -1;
 		elsif (mode = ap_mode and write_status_reg = '1' and sr_bit = 0) then
-			write_status_reg <= force '0';
+			--RDSR keeps shifting the status register out until chip-select is driven high
+			dout <= force status_reg(7);
+			sr_bit <= force 7;
 		end if;
 
 		if(mode = ap_mode and read_status_reg = '1' and byte_ok = '1') then
@@ -468,7 +525,7 @@ begin
 				operation <= force READ_OP;
 				read_data_bytes <= force '0';
 
-				dout <= force memory(to_integer(unsigned(v_mem_addr(MEM_ADDR_BITS-1 downto 0))))(7);
+				dout <= force read_memory(to_integer(unsigned(v_mem_addr(MEM_ADDR_BITS-1 downto 0))))(7);
 				i <= force 7;
 
 				--dout <= force memory(to_integer(unsigned(memory_address(MEM_ADDR_BITS-1 downto 0))))(7);
@@ -496,7 +553,7 @@ begin
 				page_address <= v_mem_addr(MEM_ADDR_BITS-1 downto MEM_ADDR_BITS- PAGE_ADDR_BITS);
 
 				for j in 1 to PAGE_SIZE loop 
-					data_latch(to_integer(unsigned(memory_address(PAGE_OFFSET_BITS-1 downto 0)))) <= force memory(to_integer(unsigned(memory_address(MEM_ADDR_BITS-1 downto 0))));
+					data_latch(to_integer(unsigned(memory_address(PAGE_OFFSET_BITS-1 downto 0)))) <= force read_memory(to_integer(unsigned(memory_address(MEM_ADDR_BITS-1 downto 0))));
 					--if(memory_address(PAGE_OFFSET_BITS-1 downto 0) = page_addr_highest) then
 					if(v_mem_addr(PAGE_OFFSET_BITS-1 downto 0) = page_addr_highest) then
 						--memory_address(PAGE_OFFSET_BITS-1 downto 0) <= page_addr_zero;
@@ -513,7 +570,7 @@ begin
 			--i <= force 8;
 			byte_ok <= force '0';
 			dummy_byte <= force '0';
-			dout <= force memory(to_integer(unsigned(memory_address(MEM_ADDR_BITS-1 downto 0))))(7);
+			dout <= force read_memory(to_integer(unsigned(memory_address(MEM_ADDR_BITS-1 downto 0))))(7);
 			i <= force 7;
 		end if;
 
@@ -550,12 +607,12 @@ begin
 					--memory_address <= force std_ulogic_vector(unsigned(memory_address) + address_increase);
 					v_mem_addr := std_ulogic_vector(unsigned(v_mem_addr) + address_increase);
 				end if;
-				dout <= force memory(to_integer(unsigned(v_mem_addr(MEM_ADDR_BITS-1 downto 0))))(7);
+				dout <= force read_memory(to_integer(unsigned(v_mem_addr(MEM_ADDR_BITS-1 downto 0))))(7);
 			else
 			--data_out_buf <=force memory(to_integer(unsigned(memory_address(MEM_ADDR_BITS-1 downto 0))));
 			--dout <= force data_out_buf(i-1);
 				--dout <= force memory(to_integer(unsigned(memory_address(MEM_ADDR_BITS-1 downto 0))))(i-1);
-				dout <= force memory(to_integer(unsigned(v_mem_addr(MEM_ADDR_BITS-1 downto 0))))(i-1);
+				dout <= force read_memory(to_integer(unsigned(v_mem_addr(MEM_ADDR_BITS-1 downto 0))))(i-1);
 				i <= force i-1;
 			end if;
 		end if;
@@ -572,12 +629,12 @@ begin
 					--memory_address <= force std_ulogic_vector(unsigned(v_mem_addr) + address_increase);
 					v_mem_addr := std_ulogic_vector(unsigned(v_mem_addr) + address_increase);
 				end if;
-				dout <= force memory(to_integer(unsigned(v_mem_addr(MEM_ADDR_BITS-1 downto 0))))(7);
+				dout <= force read_memory(to_integer(unsigned(v_mem_addr(MEM_ADDR_BITS-1 downto 0))))(7);
 			else
 			--data_out_buf <=force memory(to_integer(unsigned(memory_address(MEM_ADDR_BITS-1 downto 0))));
 			--dout <= force data_out_buf(i-1);
 				--dout <= force memory(to_integer(unsigned(memory_address(MEM_ADDR_BITS-1 downto 0))))(i-1);
-				dout <= force memory(to_integer(unsigned(v_mem_addr(MEM_ADDR_BITS-1 downto 0))))(i-1);
+				dout <= force read_memory(to_integer(unsigned(v_mem_addr(MEM_ADDR_BITS-1 downto 0))))(i-1);
 				i <= force i-1;
 			end if;
 		end if;
@@ -640,6 +697,7 @@ begin
 				operation <= force "0000";
 				dout <= force 'Z';
 				instruction <= force "0000";
+				write_status_reg <= force '0';
 			end if;
 
 			if(operation = READ_OP) then
@@ -668,7 +726,11 @@ begin
 					v_addr := unsigned(memory_address);
 					v_addr(PAGE_OFFSET_BITS-1 downto 0) := (others => '0');
 					for j in 1 to PAGE_SIZE loop
-						memory(to_integer(unsigned(v_addr(MEM_ADDR_BITS-1 downto 0)))) <= force data_latch(to_integer(unsigned(v_addr(PAGE_OFFSET_BITS-1 downto 0))));
+						if(g_sparse_memory) then
+							sparse_memory.write(to_integer(v_addr(MEM_ADDR_BITS-1 downto 0)),data_latch(to_integer(unsigned(v_addr(PAGE_OFFSET_BITS-1 downto 0)))));
+						else
+							memory(to_integer(unsigned(v_addr(MEM_ADDR_BITS-1 downto 0)))) <= force data_latch(to_integer(unsigned(v_addr(PAGE_OFFSET_BITS-1 downto 0))));
+						end if;
 						--memory(to_integer(unsigned(memory_address(MEM_ADDR_BITS-1 downto 0)))) <= force data_latch(to_integer(unsigned(memory_address(PAGE_OFFSET_BITS-1 downto 0))));
 						--memory_address(PAGE_OFFSET_BITS-1 downto 0) <= std_ulogic_vector(unsigned(memory_address(PAGE_OFFSET_BITS-1 downto 0)) + 1);
 						--memory_address <= force std_ulogic_vector(unsigned(memory_address) + 1);
@@ -696,12 +758,16 @@ begin
 					operation <= (others => '0');
 					--memory_address(3 downto 0) <= "0000";
 					v_addr(SECTOR_OFFSET_BITS-1 downto 0) := (others => '0');
-					for j in 1 to SECTOR_SIZE loop 
-						--memory(to_integer(unsigned(memory_address(MEM_ADDR_BITS-1 downto 0)))) <= force (others => '1');
-						memory(to_integer(unsigned(v_addr(MEM_ADDR_BITS-1 downto 0)))) <= force (others => '1');
-						--memory_address(SECTOR_OFFSET_BITS-1 downto 0) <= std_ulogic_vector(unsigned(memory_address(SECTOR_OFFSET_BITS-1 downto 0)) + 1);
-						v_addr(SECTOR_OFFSET_BITS-1 downto 0) := v_addr(SECTOR_OFFSET_BITS-1 downto 0) + 1;
-					end loop;
+					if(g_sparse_memory) then
+						sparse_memory.erase(to_integer(v_addr(MEM_ADDR_BITS-1 downto 0)),SECTOR_SIZE);
+					else
+						for j in 1 to SECTOR_SIZE loop 
+							--memory(to_integer(unsigned(memory_address(MEM_ADDR_BITS-1 downto 0)))) <= force (others => '1');
+							memory(to_integer(unsigned(v_addr(MEM_ADDR_BITS-1 downto 0)))) <= force (others => '1');
+							--memory_address(SECTOR_OFFSET_BITS-1 downto 0) <= std_ulogic_vector(unsigned(memory_address(SECTOR_OFFSET_BITS-1 downto 0)) + 1);
+							v_addr(SECTOR_OFFSET_BITS-1 downto 0) := v_addr(SECTOR_OFFSET_BITS-1 downto 0) + 1;
+						end loop;
+					end if;
 					sces_id <= force '0';
 				end if;
 			end if;
@@ -714,12 +780,16 @@ begin
 					status_reg(0) <= force '0';
 					operation <= (others => '0');
 
-					for j in 1 to MEM_SIZE loop 
-						--memory(to_integer(unsigned(memory_address(MEM_ADDR_BITS-1 downto 0)))) <= force (others => '1');
-						memory(to_integer(unsigned(v_addr(MEM_ADDR_BITS-1 downto 0)))) <= force (others => '1');
-						--memory_address(MEM_ADDR_BITS-1 downto 0) <= std_ulogic_vector(unsigned(memory_address(MEM_ADDR_BITS-1 downto 0)) + address_increase);
-						v_addr(MEM_ADDR_BITS-1 downto 0) := v_addr(MEM_ADDR_BITS-1 downto 0) + address_increase;
-					end loop;
+					if(g_sparse_memory) then
+						sparse_memory.erase(0,MEM_SIZE);
+					else
+						for j in 1 to MEM_SIZE loop 
+							--memory(to_integer(unsigned(memory_address(MEM_ADDR_BITS-1 downto 0)))) <= force (others => '1');
+							memory(to_integer(unsigned(v_addr(MEM_ADDR_BITS-1 downto 0)))) <= force (others => '1');
+							--memory_address(MEM_ADDR_BITS-1 downto 0) <= std_ulogic_vector(unsigned(memory_address(MEM_ADDR_BITS-1 downto 0)) + address_increase);
+							v_addr(MEM_ADDR_BITS-1 downto 0) := v_addr(MEM_ADDR_BITS-1 downto 0) + address_increase;
+						end loop;
+					end if;
 					bkes_id <= force '0';
 				end if;
 			end if;
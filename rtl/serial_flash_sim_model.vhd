@@ -279,7 +279,11 @@ begin
 					w_state <= TX_DATA;
 					w_pointer <= std_ulogic_vector(unsigned(w_pointer) +1);
 
-					o_dq <= mem(to_integer(unsigned(w_pointer)+1))(7);
+					if(w_cmd_reg = "00000101") then
+						o_dq <= w_status_reg(7);				--RDSR : the status register again
+					else
+						o_dq <= mem(to_integer(unsigned(w_pointer)+1))(7);
+					end if;
 					w_cnt_tx_neg <= to_unsigned(1,w_cnt_tx_neg'length);
 				when others => null;
 			end case;
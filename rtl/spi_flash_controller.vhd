@@ -341,7 +341,7 @@ begin
 					if(w_cnt_rx_pos = 0 and w_cnt_rx_pos_r = 7 and w_rx_underway = '1') then
 						w_rx_underway <= '0';
 						case i_cmd is 
-							when RD_DATA | F_RD_DATA =>
+							when RD_DATA | F_RD_DATA | RD_STATUS_REG =>
 								w_state <= WAIT7;				
 							when others => 
 								w_state <= WAIT5;
@@ -353,7 +353,8 @@ begin
 					data_rx_reg <= w_sr_rx_pos_sclk;
 					o_dv <= '1';
 					case i_cmd is
-						when RD_DATA | F_RD_DATA =>
+						--the status register is clocked out again as long as it is asked for
+						when RD_DATA | F_RD_DATA | RD_STATUS_REG =>
 							if(i_new_rx_req = '1') then
 								w_state <= RX_DATA;
 							else
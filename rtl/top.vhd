@@ -6,7 +6,13 @@ entity top is
 	generic (
 			g_freq_read : natural := 25_000_000;
 			g_freq_rest : natural := 50_000_000;
-			g_sys_clk : natural := 200_000_000);			--system clock freq. in Hz
+			g_sys_clk : natural := 200_000_000;			--system clock freq. in Hz
+			--m25p80_sim_model geometry in bytes (reduced by default, 1048576/256/65536 for the
+			--actual M25P80, which should be paired with g_sparse_memory)
+			g_mem_size : natural := 1024;
+			g_page_size : natural := 16;
+			g_sector_size : natural := 64;
+			g_sparse_memory : boolean := false);
 	port (
 			--system clock and reset
 	 		i_clk : in std_ulogic;
@@ -107,6 +113,11 @@ begin
 	 	); 
 
 	m25p80_sim_model : entity work.m25p80_sim_model(rtl)
+	generic map (
+			g_mem_size => g_mem_size,
+			g_page_size => g_page_size,
+			g_sector_size => g_sector_size,
+			g_sparse_memory => g_sparse_memory)
 	port map (
 			i_clk => i_clk,
 			C =>o_c,